@@ -5,4 +5,5 @@ ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 RES_DIR = os.path.join(ROOT_DIR, "res")
 STATISTICS_DIR = os.path.join(ROOT_DIR, "statistics")
 
-SIMULATION_FACTORY_CONFIG_PATH = os.path.join(RES_DIR, "config.json")
\ No newline at end of file
+SIMULATION_FACTORY_CONFIG_PATH = os.path.join(RES_DIR, "config.json")
+RESULTS_DB_PATH = os.path.join(STATISTICS_DIR, "results.sqlite")
\ No newline at end of file
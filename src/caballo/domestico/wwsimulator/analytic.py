@@ -0,0 +1,193 @@
+from itertools import product
+
+import numpy as np
+
+from caballo.domestico.wwsimulator.model import Network, PSQueue, RoutingTable
+from caballo.domestico.wwsimulator.output import _GLOBAL, OutputStatistic
+
+
+def visit_ratios(network: Network) -> np.ndarray:
+    """
+    Mean number of visits of a job to each (node, class), as a n_nodes x n_classes array,
+    solving the traffic equations v = e + v P of the routing matrix.
+    """
+    routing = network.routing
+    n_rows = routing.n_nodes * routing.n_classes
+    transitions = np.zeros((n_rows, n_rows))
+    entries = np.zeros(n_rows)
+    for node_index, class_id, p in routing.entries():
+        entries[routing.row(node_index, class_id)] += p
+    for node_index in range(routing.n_nodes):
+        for class_id in range(routing.n_classes):
+            row = routing.row(node_index, class_id)
+            for next_node, next_class, p in routing.transitions(node_index, class_id):
+                if next_node != RoutingTable.EXIT:
+                    transitions[row, routing.row(next_node, next_class)] += p
+    visits = np.linalg.solve(np.eye(n_rows) - transitions.T, entries)
+    return visits.reshape(routing.n_nodes, routing.n_classes)
+
+def service_demands(network: Network) -> np.ndarray:
+    """
+    Total mean service time required by a job at each node of the routing table over all its visits
+    (at a replicated node, over all its replicas).
+    """
+    visits = visit_ratios(network)
+    demands = np.zeros(len(network.groups))
+    for group_index, group in enumerate(network.groups):
+        node = group[0]
+        for class_id, n_visits in enumerate(visits[group_index]):
+            if n_visits > 0:
+                demands[group_index] += n_visits / float(node.service_rate[class_id])
+    return demands
+
+def is_exponential(network: Network) -> bool:
+    """
+    Whether the network has Poisson arrivals and exponential services, so that the means of open_network_means are exact.
+    """
+    return network.job_arrival_distr == 'poisson' and all(node.server.server_distribution == 'exp' for node in network.nodes)
+
+def is_single_server(network: Network) -> bool:
+    """
+    Whether every node has a single server and an unlimited buffer (no losses) and is not replicated,
+    and no job is abandoned by the timeout of its client, as assumed by the solutions of this module
+    and by the lockstep and Lindley engines.
+    """
+    return network.timeouts is None and \
+        all(node.queue.servers == 1 and node.queue.max_jobs is None and node.dispatcher is None for node in network.nodes)
+
+def multi_server_means(servers: int, utilization: float) -> tuple:
+    """
+    Mean population and fraction of time busy (at least one job at the node, the simulated utilization)
+    of a M/M/k node with the given utilization of each server, lambda D / k. Also the means of k servers
+    shared by processor sharing, whose number of jobs is the same birth-death process.
+    Infinite population for a saturated node.
+    > Kleinrock - Queueing Systems, Volume 1: Theory, Wiley (1975), Chapter 3.5. The M/M/m Queue
+    """
+    if utilization >= 1.0:
+        return np.inf, 1.0
+    load = servers * utilization
+    # load^n / n! for n < servers, then the states with all the servers busy
+    terms = [1.0]
+    for n in range(1, servers):
+        terms.append(terms[-1] * load / n)
+    all_busy = terms[-1] * load / servers / (1.0 - utilization)
+    empty = 1.0 / (sum(terms) + all_busy)
+    # Erlang C, the probability that an arrival waits
+    waiting = all_busy * empty
+    return load + waiting * utilization / (1.0 - utilization), 1.0 - empty
+
+def open_network_means(network: Network) -> dict:
+    """
+    Known means of the statistics of an open exponential network, by statistic name:
+    the external inter-arrival time, the mean service time per visit at each node
+    and, for the stable processor sharing nodes (product form, M/M/k for k servers), the utilization, the
+    population and the response time per visit of the node, and of the system if all the nodes are such.
+    > Lazowska, Zahorjan, Graham, Sevcik - Quantitative System Performance, Prentice Hall (1984), Chapter 6. Single Class Open Models
+    """
+    arrival_rate = float(network.job_arrival_param[0])
+    visits = visit_ratios(network).sum(axis=1)
+    demands = service_demands(network)
+    means = {OutputStatistic.INTERARRIVAL_TIME.for_node_variant(_GLOBAL, "avg"): 1.0 / arrival_rate}
+
+    populations = []
+    for node in network.nodes:
+        if visits[node.index] <= 0:
+            continue
+        means[OutputStatistic.SERVICE_TIME.for_node_variant(node.id, "avg")] = demands[node.index] / visits[node.index]
+        population, utilization = multi_server_means(node.queue.servers, arrival_rate * demands[node.index] / node.queue.servers)
+        means[OutputStatistic.UTILIZATION.for_node_variant(node.id, "avg")] = utilization
+        if type(node.queue) is not PSQueue or not np.isfinite(population):
+            continue
+        populations.append(population)
+        means[OutputStatistic.POPULATION.for_node_variant(node.id, "avg")] = population
+        means[OutputStatistic.RESPONSE_TIME.for_node_variant(node.id, "avg")] = population / (arrival_rate * visits[node.index])
+    
+    if len(populations) == np.count_nonzero(visits > 0):
+        means[OutputStatistic.POPULATION.for_node_variant(_GLOBAL, "avg")] = sum(populations)
+        means[OutputStatistic.RESPONSE_TIME.for_node_variant(_GLOBAL, "avg")] = sum(populations) / arrival_rate
+    return means
+
+def open_mva(network: Network) -> dict:
+    """
+    Open MVA solution of a network, by statistic name: the utilization, population and response time
+    per visit of each node and the population and response time of the system, treating every node
+    as a M/M/k queue with the k servers of the node, i.e. with residence time D / (1 - U) for a single server
+    (exact for processor sharing nodes and for FIFO nodes with the same rate for all the classes, an approximation
+    otherwise) and the replicas of a node as sharing its load equally.
+    Infinite populations and response times for the saturated nodes.
+    > Lazowska, Zahorjan, Graham, Sevcik - Quantitative System Performance, Prentice Hall (1984), Chapter 6. Single Class Open Models
+    """
+    arrival_rate = float(network.job_arrival_param[0])
+    visits = visit_ratios(network).sum(axis=1)
+    demands = service_demands(network)
+    means = {}
+    system_population = 0.0
+    for group_index, group in enumerate(network.groups):
+        if visits[group_index] <= 0:
+            continue
+        # the replicas of a node share its load equally
+        share = 1.0 / len(group)
+        servers = group[0].queue.servers
+        population, utilization = multi_server_means(servers, arrival_rate * demands[group_index] * share / servers)
+        for node in group:
+            system_population += population
+            means[OutputStatistic.UTILIZATION.for_node_variant(node.id, "avg")] = float(utilization)
+            means[OutputStatistic.POPULATION.for_node_variant(node.id, "avg")] = float(population)
+            means[OutputStatistic.RESPONSE_TIME.for_node_variant(node.id, "avg")] = float(population / (arrival_rate * visits[group_index] * share))
+    means[OutputStatistic.POPULATION.for_node_variant(_GLOBAL, "avg")] = float(system_population)
+    means[OutputStatistic.RESPONSE_TIME.for_node_variant(_GLOBAL, "avg")] = float(system_population / arrival_rate)
+    return means
+
+def closed_mva(network: Network) -> dict:
+    """
+    Exact MVA solution of the network under the closed workload of its population, by statistic name:
+    the utilization, population and response time per visit of each node and the throughput, population and
+    response time of the system. Each group of users is a chain with its own think time (a delay, so only its mean
+    matters) and the demands of the routing table, every node a single server queue with residence time D (1 + Q)
+    at the arrival instant (exact for processor sharing nodes and for FIFO nodes with the same rate for all the
+    classes) and the replicas of a node share its load equally (exact for random dispatch).
+    The recursion goes through all the populations up to the one of each group, i.e. prod(N_r + 1) of them.
+    > Lazowska, Zahorjan, Graham, Sevcik - Quantitative System Performance, Prentice Hall (1984), Chapter 7. Single Class Closed Models
+    > Reiser, Lavenberg - Mean-Value Analysis of Closed Multichain Queuing Networks, Journal of the ACM 27(2) (1980)
+    """
+    population = network.population
+    if population is None:
+        raise ValueError("Closed MVA requires a closed workload")
+    if not all(node.queue.servers == 1 and node.queue.max_jobs is None for node in network.nodes):
+        raise ValueError("Closed MVA requires single server nodes with unlimited buffers")
+    sizes = population.group_sizes()
+    think_times = np.array(population.mean_think_times())
+    visits = visit_ratios(network).sum(axis=1)
+    group_demands = service_demands(network)
+    # the stations: the nodes visited by the jobs, the replicas of a node with a share of its demand
+    stations = [(node, visits[group_index] / len(group), group_demands[group_index] / len(group))
+                for group_index, group in enumerate(network.groups) if visits[group_index] > 0 for node in group]
+    demands = np.array([demand for _, _, demand in stations])
+
+    queue_lengths = {}
+    throughputs = np.zeros(len(sizes))
+    residence_times = np.zeros((len(sizes), len(stations)))
+    for n in product(*(range(size + 1) for size in sizes)):
+        queue_length = np.zeros(len(stations))
+        for chain, n_chain in enumerate(n):
+            if n_chain == 0:
+                throughputs[chain] = 0.0
+                residence_times[chain] = demands
+                continue
+            fewer = n[:chain] + (n_chain - 1,) + n[chain + 1:]
+            residence_times[chain] = demands * (1.0 + queue_lengths.get(fewer, 0.0))
+            throughputs[chain] = n_chain / (think_times[chain] + residence_times[chain].sum())
+            queue_length += throughputs[chain] * residence_times[chain]
+        queue_lengths[n] = queue_length
+
+    throughput = float(throughputs.sum())
+    queue_length = queue_lengths[tuple(sizes)]
+    means = {}
+    for (node, node_visits, demand), node_population in zip(stations, queue_length):
+        means[OutputStatistic.UTILIZATION.for_node_variant(node.id, "avg")] = throughput * demand
+        means[OutputStatistic.POPULATION.for_node_variant(node.id, "avg")] = float(node_population)
+        means[OutputStatistic.RESPONSE_TIME.for_node_variant(node.id, "avg")] = float(node_population / (throughput * node_visits))
+    means[OutputStatistic.THROUGHPUT.for_node_variant(_GLOBAL, "val")] = throughput
+    means[OutputStatistic.POPULATION.for_node_variant(_GLOBAL, "avg")] = float(queue_length.sum())
+    means[OutputStatistic.RESPONSE_TIME.for_node_variant(_GLOBAL, "avg")] = float(queue_length.sum() / throughput)
+    return means
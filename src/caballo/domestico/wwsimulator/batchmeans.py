@@ -34,7 +34,7 @@ class BatchMeansInterceptor(EventHandler):
     Must subscribe as interceptor to ensure that the statistics are flushed
     and estimators reset before they start to sample for the next batch.
     """
-    def __init__(self, batch_size:int, batch_num:int, simulation:Simulation):
+    def __init__(self, batch_size:int, batch_num:int, simulation:Simulation, warmup=None):
         super().__init__()
         self.job_completed = 0
         """
@@ -52,14 +52,20 @@ class BatchMeansInterceptor(EventHandler):
         """
         Numero di batch totali
         """
-        self.batch_statistics = {}
         self.simulation = simulation
+        self.warmup = warmup
+        """
+        Optional WarmupDetector: batches start after the end of the warm-up period.
+        """
     
     def _handle(self, context):
+        context.new_batch = False
+        if self.warmup is not None and not self.warmup.detected:
+            return
+
         # conteggio job che escono dal sistema
         if context.event.external:
             self.job_completed += 1
-        context.new_batch = False
 
         # ogni batch_size job completati, esegue il flush delle statistiche
         if self.job_completed == self.batch_size:
@@ -70,13 +76,13 @@ class BatchMeansInterceptor(EventHandler):
             
             self.job_completed = 0
             self.batch_completed += 1
-            for key in context.statistics:
-                if key not in self.batch_statistics:
-                    self.batch_statistics[key] = []
-                self.batch_statistics[key].append(context.statistics[key])
+            if self.batch_completed <= self.batch_num:
+                # batch statistics and their confidence intervals are collected as batches complete
+                self.simulation.collect_iteration(context.statistics)
+            if self.batch_completed == self.batch_num and self.warmup is not None:
+                # arrivals are not bounded when the warm-up period is discarded
+                scheduler.stop = True
             context.statistics = {}
-            if self.batch_completed == self.batch_num:
-                self.simulation.statistics = self.batch_statistics
                 
 if __name__ == "__main__":
     bms = BatchMeansSimulation(1234, HandleFirstArrival())
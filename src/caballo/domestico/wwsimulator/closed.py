@@ -0,0 +1,155 @@
+import heapq
+
+from caballo.domestico.wwsimulator.distributions import create_distribution
+from caballo.domestico.wwsimulator.events import ArrivalEvent
+from caballo.domestico.wwsimulator.handlers import HandleArrival
+from caballo.domestico.wwsimulator.model import Job
+from caballo.domestico.wwsimulator.streams import THINK
+
+
+class ClosedPopulation():
+    """
+    Closed workload of a fixed population of users, each alternating a think time and a request to the system:
+    the next request of a user is sent when its previous job leaves the system (completed or dropped).
+    The users that are thinking wait in a heap by the time their think time ends, and only the request
+    of the first one to wake up is scheduled, so the event list holds one pending request however many users think.
+    A user ending its think time before the pending request preempts it, the preempted user going back to the heap.
+    """
+
+    def __init__(self, network, think_distributions: list, users: list):
+        self.network = network
+        self.think_distributions = think_distributions
+        """
+        Think time distribution of each group of users.
+        """
+        self.users = users
+        """
+        Group of each user.
+        """
+        self.thinking = []
+        """
+        Heap of the (wake up time, user) of the thinking users, but the one of the pending request.
+        """
+        self.pending = None
+        """
+        Arrival of the request of the first user to wake up, None if all the users are busy or when stopped.
+        """
+        self.active = True
+        """
+        False when no further requests are sent, i.e. after the last arrival of a run.
+        """
+        self._next_job_id = 0
+
+    @property
+    def n_users(self) -> int:
+        return len(self.users)
+
+    def start(self, scheduler, time: float):
+        """
+        All the users start thinking at the given time.
+        """
+        self.thinking = []
+        self.pending = None
+        self.active = True
+        for user in range(self.n_users):
+            self.thinking.append((time + self._think_time(user), user))
+        heapq.heapify(self.thinking)
+        self.next_request(scheduler)
+
+    def _think_time(self, user: int) -> float:
+        return self.think_distributions[self.users[user]].sample(THINK)
+
+    def think(self, job: Job, scheduler, time: float):
+        """
+        The job of a user left the system at the given time: the user thinks before its next request.
+        """
+        if not self.active:
+            return
+        user = job.user
+        wake_time = time + self._think_time(user)
+        pending = self.pending
+        if pending is None:
+            heapq.heappush(self.thinking, (wake_time, user))
+            self.next_request(scheduler)
+        elif wake_time < pending.time:
+            scheduler.cancel(pending)
+            heapq.heappush(self.thinking, (pending.time, pending.job.user))
+            self.pending = None
+            self._schedule(scheduler, wake_time, user)
+        else:
+            heapq.heappush(self.thinking, (wake_time, user))
+
+    def next_request(self, scheduler):
+        """
+        Schedules the request of the first user to wake up, if any: called when the pending request arrives.
+        """
+        self.pending = None
+        if self.active and len(self.thinking) > 0:
+            wake_time, user = heapq.heappop(self.thinking)
+            self._schedule(scheduler, wake_time, user)
+
+    def stop(self, scheduler):
+        """
+        No further requests are sent, the pending one is cancelled.
+        """
+        self.active = False
+        if self.pending is not None:
+            scheduler.cancel(self.pending)
+            self.pending = None
+
+    def _schedule(self, scheduler, time: float, user: int):
+        network = self.network
+        entry_node, entry_class, demand = network.get_entry()
+        job = Job(entry_class, self._next_job_id)
+        self._next_job_id += 1
+        job.user = user
+        job.demand = demand
+        arrival = ArrivalEvent(time, HandleArrival(), job, None, entry_node)
+        arrival.external = True
+        self.pending = arrival
+        scheduler.schedule(arrival)
+
+    def mean_think_times(self) -> list:
+        """
+        Mean think time of each group of users.
+        """
+        return [distribution.mean for distribution in self.think_distributions]
+
+    def group_sizes(self) -> list:
+        """
+        Number of users of each group.
+        """
+        sizes = [0] * len(self.think_distributions)
+        for group in self.users:
+            sizes[group] += 1
+        return sizes
+
+def _split(n_users: int, shares: list) -> list:
+    # largest remainder: the sizes add up to the population
+    total = float(sum(shares))
+    quotas = [n_users * share / total for share in shares]
+    sizes = [int(quota) for quota in quotas]
+    by_remainder = sorted(range(len(shares)), key=lambda group: sizes[group] - quotas[group])
+    for group in by_remainder[:n_users - sum(sizes)]:
+        sizes[group] += 1
+    return sizes
+
+def create_closed_population(arrival_distr: dict, network, n_users: float) -> ClosedPopulation:
+    """
+    Creates the population of an experiment with arrival_distr of type closed, e.g.
+    {"type": "closed", "params": [50], "think_time": 5.0, "think_distr": {"type": "exp"},
+     "users": [{"share": 0.8}, {"share": 0.2, "think_time": 30.0, "think_distr": {"type": "lognormal", "cv": 2.0}}]}
+    where params are the populations of the sweep, split among the groups of users by their shares
+    (one group by default). Each group has the mean and distribution of its think time, by default the ones
+    of the workload (exponential by default).
+    """
+    if n_users < 1 or n_users != int(n_users):
+        raise ValueError(f"A closed population has a positive integer number of users, got {n_users}")
+    groups = arrival_distr.get('users', [{}])
+    distributions = []
+    for group in groups:
+        think_time = float(group.get('think_time', arrival_distr['think_time']))
+        distributions.append(create_distribution(group.get('think_distr', arrival_distr.get('think_distr', {"type": "exp"})), think_time))
+    sizes = _split(int(n_users), [group.get('share', 1.0) for group in groups])
+    users = [group for group, size in enumerate(sizes) for _ in range(size)]
+    return ClosedPopulation(network, distributions, users)
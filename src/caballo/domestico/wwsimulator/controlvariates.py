@@ -0,0 +1,116 @@
+from math import isfinite, sqrt
+
+import numpy as np
+
+from caballo.domestico.wwsimulator.analytic import is_exponential, is_single_server, open_network_means
+from caballo.domestico.wwsimulator.model import Network
+from caballo.domestico.wwsimulator.output import _GLOBAL, OutputStatistic
+from caballo.domestico.wwsimulator.simulation import Simulation
+from pdsteele.des import rvms
+
+
+class ControlVariates():
+    """
+    Post-processes the iterations (batches or replicas) of a simulation with control variates:
+    statistics whose mean is known analytically, e.g. by analytic.open_network_means.
+    The estimate of a statistic Y is the intercept of the least squares regression of Y on the deviations
+    of the controls C from their known means, Y - beta (C - mean C), so the noise of Y explained by
+    the noise of the controls is removed.
+    > Averill M. Law - Simulation Modeling and Analysis, 5th ed., McGraw-Hill (2015), Chapter 11. Variance-Reduction Techniques, Control Variates
+    """
+
+    class Estimate():
+        def __init__(self, statistic: str, avg: float, half_width: float, n_samples: int, variance_reduction: float, controls: list):
+            self.statistic = statistic
+            self.avg = avg
+            self.half_width = half_width
+            self.n_samples = n_samples
+            self.variance_reduction = variance_reduction
+            """
+            Fraction of the variance of the plain mean removed by the controls, 1 - var(controlled) / var(plain).
+            """
+            self.controls = controls
+            """
+            Names of the control statistics.
+            """
+
+    def __init__(self, known_means: dict, confidence: float = 0.95):
+        self.known_means = known_means
+        """
+        Known means of the controls by statistic name.
+        """
+        self.confidence = confidence
+
+    def _t(self, degrees_of_freedom: int):
+        u = 1.0 - 0.5 * (1.0 - self.confidence)
+        return rvms.idfStudent(degrees_of_freedom, u)
+
+    def _controls(self, statistics: dict, statistic: str, n: int) -> list:
+        metric = statistic.split("-")[1]
+        controls = []
+        for key in sorted(self.known_means):
+            values = statistics.get(key)
+            # a statistic is not controlled by the same metric (e.g. the system population is the sum
+            # of the node populations), and each control must vary over the iterations
+            if key.split("-")[1] == metric or not isinstance(values, list) or len(values) != n:
+                continue
+            if not all(isfinite(value) for value in values) or np.std(values) == 0.0:
+                continue
+            controls.append(key)
+        # at least two degrees of freedom left for the residual variance
+        return controls[:max(n - 3, 0)]
+
+    def estimate(self, statistics: dict, statistic: str) -> "ControlVariates.Estimate":
+        """
+        Returns the controlled estimate of a statistic given the values of all the statistics by iteration,
+        or None if the statistic has less than 3 finite values.
+        """
+        values = statistics.get(statistic)
+        if not isinstance(values, list) or len(values) < 3 or not all(isfinite(value) for value in values):
+            return None
+        y = np.asarray(values, dtype=float)
+        n = len(y)
+        plain_variance = np.var(y, ddof=1) / n
+
+        controls = self._controls(statistics, statistic, n)
+        x = np.ones((n, len(controls) + 1))
+        for column, key in enumerate(controls):
+            x[:, column + 1] = np.asarray(statistics[key], dtype=float) - self.known_means[key]
+        coefficients, _, rank, _ = np.linalg.lstsq(x, y, rcond=None)
+        degrees_of_freedom = n - rank
+        residuals = y - x @ coefficients
+        variance = float(residuals @ residuals) / degrees_of_freedom * np.linalg.pinv(x.T @ x)[0, 0]
+
+        variance_reduction = 1.0 - variance / plain_variance if plain_variance > 0 else 0.0
+        half_width = self._t(degrees_of_freedom) * sqrt(max(variance, 0.0))
+        return ControlVariates.Estimate(statistic, float(coefficients[0]), half_width, n, variance_reduction, controls)
+
+    def summary(self, simulation: Simulation, statistics: list = None) -> list:
+        """
+        Returns the controlled estimates of the response times and populations of a simulation,
+        or of the given statistics, as a list of Estimate.
+        """
+        if statistics is None:
+            variants = [OutputStatistic.RESPONSE_TIME.for_node_variant("", "avg"), OutputStatistic.POPULATION.for_node_variant("", "avg")]
+            # per node and system only, class statistics have a dotted node label
+            statistics = [key for key in sorted(simulation.statistics)
+                          if any(key.endswith(variant) for variant in variants) and "." not in key.split("-")[0]]
+        estimates = [self.estimate(simulation.statistics, statistic) for statistic in statistics]
+        return [estimate for estimate in estimates if estimate is not None]
+
+def analytic_controls(network: Network) -> dict:
+    """
+    Known means of the controls of an open exponential network: the external inter-arrival time,
+    the service time per visit of each node and the population of each processor sharing node (M/M/1-PS).
+    Empty if the network is not exponential, or has multi-server or finite buffer nodes.
+    """
+    if not is_exponential(network) or not is_single_server(network):
+        return {}
+    controls = {}
+    for key, mean in open_network_means(network).items():
+        node_id = key.split("-")[0]
+        if key == OutputStatistic.INTERARRIVAL_TIME.for_node_variant(_GLOBAL, "avg") \
+                or key.startswith(f"{node_id}-{OutputStatistic.SERVICE_TIME.value}-") \
+                or (node_id != _GLOBAL and key.startswith(f"{node_id}-{OutputStatistic.POPULATION.value}-")):
+            controls[key] = mean
+    return controls
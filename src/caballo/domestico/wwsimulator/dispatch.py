@@ -0,0 +1,216 @@
+from abc import ABC, abstractmethod
+
+from caballo.domestico.wwsimulator import streams
+from caballo.domestico.wwsimulator.model import Node
+from caballo.domestico.wwsimulator.streams import DISPATCH
+
+def replica_id(node_id: str, replica: int) -> str:
+    """
+    Id of a replica of a node, e.g. A_3 for the fourth replica of A.
+    """
+    return f"{node_id}_{replica}"
+
+class IndexedHeap():
+    """
+    Binary min-heap of the items 0, ..., n - 1 by key, with the position of each item in the heap,
+    so that the key of an item is updated in O(log n) and the item with the least key is found in O(1).
+    Ties are broken by the lowest item.
+    """
+
+    def __init__(self, keys: list):
+        self.keys = list(keys)
+        self.heap = sorted(range(len(self.keys)), key=lambda item: (self.keys[item], item))
+        """
+        Items in heap order.
+        """
+        self.positions = [0] * len(self.keys)
+        """
+        Position of each item in the heap.
+        """
+        for position, item in enumerate(self.heap):
+            self.positions[item] = position
+
+    def top(self) -> int:
+        return self.heap[0]
+
+    def _less(self, a: int, b: int) -> bool:
+        key_a, key_b = self.keys[a], self.keys[b]
+        return key_a < key_b or (key_a == key_b and a < b)
+
+    def _swap(self, i: int, j: int):
+        heap = self.heap
+        heap[i], heap[j] = heap[j], heap[i]
+        self.positions[heap[i]] = i
+        self.positions[heap[j]] = j
+
+    def update(self, item: int, key):
+        """
+        Sets the key of an item and restores the heap order.
+        """
+        self.keys[item] = key
+        heap = self.heap
+        position = self.positions[item]
+        # sift up
+        while position > 0:
+            parent = (position - 1) >> 1
+            if not self._less(item, heap[parent]):
+                break
+            self._swap(position, parent)
+            position = parent
+        # sift down
+        n = len(heap)
+        while True:
+            child = 2 * position + 1
+            if child >= n:
+                break
+            if child + 1 < n and self._less(heap[child + 1], heap[child]):
+                child += 1
+            if not self._less(heap[child], item):
+                break
+            self._swap(position, child)
+            position = child
+
+class Dispatcher(ABC):
+    """
+    Chooses the replica of a node each job routed to the node is sent to, as a load balancer in front of a pool
+    of identical instances. The handlers notify the dispatcher of the arrivals at its replicas and of the
+    departures from them, so that it keeps the number of jobs at each replica for the policies depending on it.
+    """
+
+    def __init__(self, replicas: list):
+        if len(replicas) < 1:
+            raise ValueError("A dispatcher requires at least one replica")
+        self.replicas = replicas
+        self.jobs = [0] * len(replicas)
+        """
+        Number of jobs at each replica.
+        """
+        for position, node in enumerate(replicas):
+            node.dispatcher = self
+            node.replica = position
+
+    @abstractmethod
+    def select(self) -> Node:
+        """
+        Returns the replica the next job is sent to.
+        """
+        pass
+
+    def arrived(self, node: Node, demand: float, time: float):
+        """
+        A job with the given service demand was admitted at the replica.
+        """
+        self.jobs[node.replica] += 1
+
+    def departed(self, node: Node, time: float):
+        """
+        A job left the replica.
+        """
+        self.jobs[node.replica] -= 1
+
+class RoundRobin(Dispatcher):
+
+    def __init__(self, replicas: list):
+        super().__init__(replicas)
+        self._next = 0
+
+    def select(self):
+        node = self.replicas[self._next]
+        self._next = self._next + 1 if self._next + 1 < len(self.replicas) else 0
+        return node
+
+class RandomDispatch(Dispatcher):
+    """
+    Sends each job to a replica drawn uniformly from the DISPATCH stream.
+    """
+
+    def select(self):
+        n = len(self.replicas)
+        return self.replicas[min(int(streams.random(DISPATCH) * n), n - 1)]
+
+class JoinShortestQueue(Dispatcher):
+    """
+    Sends each job to the replica with the fewest jobs (the first one on ties), kept at the top of an indexed heap.
+    """
+
+    def __init__(self, replicas: list):
+        super().__init__(replicas)
+        self._heap = IndexedHeap(self.jobs)
+
+    def select(self):
+        return self.replicas[self._heap.top()]
+
+    def arrived(self, node, demand, time):
+        super().arrived(node, demand, time)
+        self._heap.update(node.replica, self.jobs[node.replica])
+
+    def departed(self, node, time):
+        super().departed(node, time)
+        self._heap.update(node.replica, self.jobs[node.replica])
+
+class PowerOfTwoChoices(Dispatcher):
+    """
+    Sends each job to the replica with fewer jobs of two distinct ones drawn uniformly (the first one on ties).
+    """
+
+    def select(self):
+        n = len(self.replicas)
+        if n == 1:
+            return self.replicas[0]
+        first = min(int(streams.random(DISPATCH) * n), n - 1)
+        second = min(int(streams.random(DISPATCH) * (n - 1)), n - 2)
+        if second >= first:
+            second += 1
+        return self.replicas[second if self.jobs[second] < self.jobs[first] else first]
+
+class LeastWorkLeft(Dispatcher):
+    """
+    Sends each job to the replica with the least unfinished work, i.e. the one that would be idle first without
+    further arrivals. The replicas are work conserving, so a replica with unfinished work drains it at the rate of
+    its servers: the time it becomes idle only changes at its arrivals, and the replicas are kept in an indexed heap by it.
+    Exact for single server replicas, an approximation with more servers (as if all of them were busy).
+    """
+
+    def __init__(self, replicas: list):
+        super().__init__(replicas)
+        self.idle_times = [0.0] * len(replicas)
+        """
+        Time each replica becomes idle, without further arrivals.
+        """
+        self._heap = IndexedHeap(self.idle_times)
+
+    def select(self):
+        return self.replicas[self._heap.top()]
+
+    def arrived(self, node, demand, time):
+        super().arrived(node, demand, time)
+        replica = node.replica
+        self.idle_times[replica] = max(self.idle_times[replica], time) + demand / node.queue.servers
+        self._heap.update(replica, self.idle_times[replica])
+
+DISPATCH_POLICIES = {
+    "rr": lambda replicas, config: RoundRobin(replicas),
+    "random": lambda replicas, config: RandomDispatch(replicas),
+    "jsq": lambda replicas, config: JoinShortestQueue(replicas),
+    "po2": lambda replicas, config: PowerOfTwoChoices(replicas),
+    "lwl": lambda replicas, config: LeastWorkLeft(replicas),
+}
+"""
+Factories of the dispatchers by policy, as in the dispatch of a replicated node of config.json, taking the replicas
+and the configuration, e.g. {"name": "A", "replicas": 8, "dispatch": {"type": "jsq"}, ...}.
+"""
+
+def register_dispatch_policy(policy: str, factory):
+    """
+    Registers the factory of a dispatch policy, a function of the replicas and the configuration.
+    """
+    DISPATCH_POLICIES[policy] = factory
+
+def create_dispatcher(config: dict, replicas: list) -> Dispatcher:
+    """
+    Creates the dispatcher of the replicas of a node with the given configuration, round robin by default.
+    """
+    policy = config.get("type", "rr")
+    if policy not in DISPATCH_POLICIES:
+        raise ValueError(f"Dispatch policy {policy} not supported")
+    return DISPATCH_POLICIES[policy](replicas, config)
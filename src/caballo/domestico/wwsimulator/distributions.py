@@ -0,0 +1,246 @@
+from abc import ABC, abstractmethod
+from math import exp, gamma, log, sqrt
+from statistics import NormalDist
+
+import numpy as np
+from scipy.special import ndtri
+
+from caballo.domestico.wwsimulator import streams
+
+class Distribution(ABC):
+    """
+    Distribution of non negative variates with a given mean, sampled by inversion of the uniforms
+    of a stream (so antithetic streams and common random numbers apply to it as to the exponential).
+    sample draws a variate, samples draws n at once from a block of uniforms: the same variates as n calls
+    of sample, in the same order (up to rounding).
+    """
+
+    uniforms = 1
+    """
+    Uniforms consumed by a variate.
+    """
+
+    def __init__(self, mean: float):
+        if mean <= 0:
+            raise ValueError("The mean of a distribution must be positive")
+        self.mean = mean
+
+    def sample(self, stream: int) -> float:
+        if self.uniforms == 1:
+            return self._inverse(streams.random(stream))
+        return float(self.samples(stream, 1)[0])
+
+    def samples(self, stream: int, n: int) -> np.ndarray:
+        u = streams.randoms(stream, n * self.uniforms)
+        return self._inverses(u if self.uniforms == 1 else u.reshape(n, self.uniforms))
+
+    def _inverse(self, u: float) -> float:
+        return float(self._inverses(np.array([u]))[0])
+
+    @abstractmethod
+    def _inverses(self, u: np.ndarray) -> np.ndarray:
+        """
+        Variates of the uniforms, of shape (n, uniforms) when a variate consumes more than one.
+        """
+        pass
+
+class Exponential(Distribution):
+
+    def _inverse(self, u):
+        # as streams.exponential
+        return -self.mean * log(1.0 - u)
+
+    def _inverses(self, u):
+        return -self.mean * np.log(1.0 - u)
+
+class Erlang(Distribution):
+    """
+    Sum of k exponential phases with mean mean / k each, i.e. coefficient of variation 1 / sqrt(k).
+    """
+
+    def __init__(self, mean: float, k: int):
+        super().__init__(mean)
+        if k < 1:
+            raise ValueError("An Erlang distribution has at least one phase")
+        self.uniforms = k
+
+    def _inverses(self, u):
+        return -(self.mean / self.uniforms) * np.log(1.0 - u).sum(axis=1)
+
+class Hyperexponential(Distribution):
+    """
+    Mixture of exponential phases, the phase being chosen by the first uniform and the variate drawn by the second one.
+    The phase means are scaled so that the mixture has the given mean.
+    By default two phases with balanced means (p1 / rate1 = p2 / rate2) fit the coefficient of variation cv >= 1.
+    """
+
+    uniforms = 2
+
+    def __init__(self, mean: float, cv: float = None, probabilities: list = None, means: list = None):
+        super().__init__(mean)
+        if probabilities is None:
+            if cv is None or cv < 1:
+                raise ValueError("A hyperexponential distribution requires cv >= 1 or the probabilities and means of its phases")
+            p = 0.5 * (1.0 + sqrt((cv * cv - 1.0) / (cv * cv + 1.0)))
+            probabilities = [p, 1.0 - p]
+            means = [0.5 / p, 0.5 / (1.0 - p)]
+        probabilities = np.asarray(probabilities, dtype=float) / np.sum(probabilities)
+        means = np.asarray(means, dtype=float)
+        self.cumulative = np.cumsum(probabilities)
+        self.means = means * (mean / float(np.dot(probabilities, means)))
+        """
+        Means of the phases.
+        """
+
+    def _inverses(self, u):
+        phases = np.minimum(np.searchsorted(self.cumulative, u[:, 0], side="right"), len(self.means) - 1)
+        return -self.means[phases] * np.log(1.0 - u[:, 1])
+
+class Lognormal(Distribution):
+    """
+    exp(mu + sigma Z) with Z standard normal, given its coefficient of variation.
+    """
+
+    _normal = NormalDist()
+
+    def __init__(self, mean: float, cv: float):
+        super().__init__(mean)
+        self.sigma = sqrt(log(1.0 + cv * cv))
+        self.mu = log(mean) - 0.5 * self.sigma * self.sigma
+
+    def _inverse(self, u):
+        return exp(self.mu + self.sigma * Lognormal._normal.inv_cdf(u))
+
+    def _inverses(self, u):
+        return np.exp(self.mu + self.sigma * ndtri(u))
+
+class Pareto(Distribution):
+    """
+    Pareto (type I) distribution with tail index alpha > 1, i.e. P(X > x) = (x_m / x)^alpha for x >= x_m.
+    The variance is infinite for alpha <= 2.
+    """
+
+    def __init__(self, mean: float, alpha: float):
+        super().__init__(mean)
+        if alpha <= 1:
+            raise ValueError("A Pareto distribution with alpha <= 1 has no mean")
+        self.alpha = alpha
+        self.minimum = mean * (alpha - 1.0) / alpha
+
+    def _inverse(self, u):
+        return self.minimum * (1.0 - u) ** (-1.0 / self.alpha)
+
+    def _inverses(self, u):
+        return self.minimum * (1.0 - u) ** (-1.0 / self.alpha)
+
+class Weibull(Distribution):
+    """
+    Weibull distribution with the given shape, heavy tailed for shape < 1.
+    """
+
+    def __init__(self, mean: float, shape: float):
+        super().__init__(mean)
+        if shape <= 0:
+            raise ValueError("The shape of a Weibull distribution must be positive")
+        self.shape = shape
+        self.scale = mean / gamma(1.0 + 1.0 / shape)
+
+    def _inverse(self, u):
+        return self.scale * (-log(1.0 - u)) ** (1.0 / self.shape)
+
+    def _inverses(self, u):
+        return self.scale * (-np.log(1.0 - u)) ** (1.0 / self.shape)
+
+class Empirical(Distribution):
+    """
+    Distribution of measured values (optionally weighted), scaled to the given mean: with the mean of the
+    values, they are sampled as they are. With alias sampling the values are drawn as a discrete distribution
+    by Walker's alias table, in constant time from a single uniform (its integer part picks a column, its
+    fractional part the value or its alias). With inverse sampling the variates are continuous, interpolated
+    from a lookup table of table_size quantiles of the values.
+    """
+
+    def __init__(self, mean: float, values: list, weights: list = None, sampling: str = "alias", table_size: int = 1024):
+        super().__init__(mean)
+        values = np.asarray(values, dtype=float)
+        weights = np.ones(len(values)) if weights is None else np.asarray(weights, dtype=float)
+        if len(values) == 0 or len(weights) != len(values) or np.any(values < 0) or np.any(weights < 0) or weights.sum() <= 0:
+            raise ValueError("An empirical distribution requires non negative values with non negative weights")
+        if table_size < 2:
+            raise ValueError("The lookup table of an empirical distribution has at least two quantiles")
+        probabilities = weights / weights.sum()
+        self.sampling = sampling
+        if sampling == "alias":
+            self.values = values * (mean / float(np.dot(probabilities, values)))
+            self.thresholds, self.aliases = _alias_table(probabilities)
+        elif sampling == "inverse":
+            order = np.argsort(values, kind="stable")
+            values, probabilities = values[order], probabilities[order]
+            # quantile function through the midpoints of the steps of the cumulative distribution
+            midpoints = np.cumsum(probabilities) - 0.5 * probabilities
+            table = np.interp(np.linspace(0.0, 1.0, table_size), midpoints, values)
+            # mean of the piecewise linear interpolation of the table
+            table_mean = float(np.mean(0.5 * (table[1:] + table[:-1])))
+            self.table = table * (mean / table_mean)
+        else:
+            raise ValueError(f"Unknown sampling {sampling} of an empirical distribution")
+
+    def _inverses(self, u):
+        if self.sampling == "alias":
+            position = u * len(self.values)
+            columns = np.minimum(position.astype(int), len(self.values) - 1)
+            chosen = np.where(position - columns < self.thresholds[columns], columns, self.aliases[columns])
+            return self.values[chosen]
+        position = u * (len(self.table) - 1)
+        index = np.minimum(position.astype(int), len(self.table) - 2)
+        fraction = position - index
+        return self.table[index] + fraction * (self.table[index + 1] - self.table[index])
+
+def _alias_table(probabilities: np.ndarray) -> tuple:
+    """
+    Walker's alias table (Vose's construction): column i keeps its own value with probability thresholds[i]
+    and gives aliases[i] otherwise.
+    """
+    n = len(probabilities)
+    scaled = probabilities * n
+    thresholds = np.ones(n)
+    aliases = np.arange(n)
+    small = [i for i in range(n) if scaled[i] < 1.0]
+    large = [i for i in range(n) if scaled[i] >= 1.0]
+    while small and large:
+        i, j = small.pop(), large.pop()
+        thresholds[i] = scaled[i]
+        aliases[i] = j
+        scaled[j] -= 1.0 - scaled[i]
+        (small if scaled[j] < 1.0 else large).append(j)
+    return thresholds, aliases
+
+DISTRIBUTIONS = {
+    "exp": lambda mean, config: Exponential(mean),
+    "poisson": lambda mean, config: Exponential(mean),
+    "erlang": lambda mean, config: Erlang(mean, int(config["k"])),
+    "hyperexp": lambda mean, config: Hyperexponential(mean, config.get("cv"), config.get("probabilities"), config.get("means")),
+    "lognormal": lambda mean, config: Lognormal(mean, float(config["cv"])),
+    "pareto": lambda mean, config: Pareto(mean, float(config["alpha"])),
+    "weibull": lambda mean, config: Weibull(mean, float(config["shape"])),
+    "empirical": lambda mean, config: Empirical(mean, config["values"], config.get("weights"), config.get("sampling", "alias"), config.get("table_size", 1024)),
+}
+"""
+Factories of the distributions by type, as in the server_distr and arrival_distr of config.json, taking the mean
+and the configuration, e.g. {"type": "lognormal", "params": [2.0], "cv": 3.0}. Poisson arrivals are exponential
+interarrival times.
+"""
+
+def register_distribution(distribution_type: str, factory):
+    """
+    Registers the factory of a distribution type, a function of the mean and the configuration.
+    """
+    DISTRIBUTIONS[distribution_type] = factory
+
+def create_distribution(config: dict, mean: float) -> Distribution:
+    """
+    Creates the distribution of a configuration with the given mean.
+    """
+    if config["type"] not in DISTRIBUTIONS:
+        raise ValueError(f"Distribution {config['type']} not supported")
+    return DISTRIBUTIONS[config["type"]](mean, config)
@@ -48,6 +48,10 @@ class JobMovementEvent(Event):
         super().__init__(time, handler)
         self.job = job
         self.node = node
+        self.job_class = job.class_id
+        """
+        Class of the job at the node, the job may switch class when routed to the next node.
+        """
         self.external = False
         """
         True if the job is entering/exiting the system.
@@ -55,12 +59,53 @@ class JobMovementEvent(Event):
 
 # nell'arrival il node è quello in cui sta arrivando il job
 class ArrivalEvent(JobMovementEvent):
-    def __init__(self, time: float, handler: EventHandler, job: Job, node: Node):
+    def __init__(self, time: float, handler: EventHandler, job: Job, node: Node, group: int = None):
         super().__init__(time, handler, job, node)
+        self.group = group if node is None else node.group
+        """
+        Index in the routing table of the node the job arrives at. Without a node, the replica of the group
+        is chosen by its dispatcher when the arrival is processed, see dispatch.
+        """
+        self.dropped = False
+        """
+        True if the node was full when the job arrived: the job is lost and leaves the system.
+        """
+        self.retry = False
+        """
+        True if the job is the retry of a request that timed out: an external arrival not generated by the workload.
+        """
+
+    def dispatch(self, network: Network) -> Node:
+        """
+        Returns the node the job arrives at, choosing the replica of its group on the first call,
+        so that the dispatcher sees the state of the replicas when the job actually arrives.
+        """
+        if self.node is None:
+            self.node = network.dispatch(self.group)
+        return self.node
 
 # nella departure il node è quello da cui sta partendo il job
 class DepartureEvent(JobMovementEvent):
     def __init__(self, time: float, handler: EventHandler, job: Job, node: Node):
         super().__init__(time, handler, job, node)
+        self.next_node = None
+        """
+        Index in the routing table of the node the job is routed to, chosen when the departure is scheduled
+        (the replica of a replicated node is chosen by its dispatcher when the job arrives, see ArrivalEvent.dispatch).
+        """
+        self.next_class = None
+        """
+        Class of the job at the next node.
+        """
 
-   
\ No newline at end of file
+class TimeoutEvent(Event):
+    """
+    The deadline of the client of a job expired before the job left the system.
+    """
+    def __init__(self, time: float, handler: EventHandler, job: Job):
+        super().__init__(time, handler)
+        self.job = job
+        self.retried = False
+        """
+        True if the client sends the request again, False if it gives up.
+        """
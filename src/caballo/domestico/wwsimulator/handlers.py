@@ -1,5 +1,5 @@
 from caballo.domestico.wwsimulator.events import EventContext, EventHandler, Event, ArrivalEvent, DepartureEvent
-from caballo.domestico.wwsimulator.model import Job, Node, PSQueue, State
+from caballo.domestico.wwsimulator.model import Job, Node, PSQueue, RoutingTable, State
 from blist import sortedlist
 
 
@@ -7,12 +7,16 @@ from blist import sortedlist
 class ArrivalsGeneratorSubscriber(EventHandler):
     """
     Subscribes for ArrivalEvents and counts the number of observed external arrivals.
-    It generates new external arrivals until the maximum number is reached.
+    It generates new external arrivals until the maximum number is reached, or past the horizon if given.
     """
     
-    def __init__(self, max_arrivals: int):
+    def __init__(self, max_arrivals: int, horizon: float = None):
         super().__init__()
         self.max_arrivals = max_arrivals
+        self.horizon = horizon
+        """
+        Time after which no external arrival is generated, e.g. the period of a non stationary profile.
+        """
         self.observed_arrivals = 0
     
     def _handle(self, context):
@@ -20,14 +24,31 @@ class ArrivalsGeneratorSubscriber(EventHandler):
         if not isinstance(event, ArrivalEvent):
             raise ValueError(f"{__class__.__qualname__} can only handle {ArrivalEvent.__qualname__}.")
         
-        if event.external:
+        if event.external and not event.retry:
             self.observed_arrivals += 1
 
+            population = context.network.population
+            if population is not None:
+                # closed workload: the users send the requests, until the last arrival
+                if self.horizon is not None:
+                    raise ValueError("The horizon of the arrivals applies to open workloads only")
+                if self.observed_arrivals >= self.max_arrivals:
+                    population.stop(context.scheduler)
+                return
+
             # rigenerazione evento di arrival dall'esterno del sistema
             if self.observed_arrivals < self.max_arrivals:
-                arrival_time = context.network.get_arrivals()
-                new_job = Job(0, context.event.job.job_id+1)
-                arrival = ArrivalEvent(context.event.time + arrival_time, HandleArrival(), new_job, context.network.get_node('A'))
+                network = context.network
+                arrival_time = network.get_arrivals()
+                if arrival_time is None:
+                    # the replayed log is over
+                    return
+                if self.horizon is not None and context.event.time + arrival_time > self.horizon:
+                    return
+                entry_node, entry_class, demand = network.get_entry()
+                new_job = Job(entry_class, context.event.job.job_id+1)
+                new_job.demand = demand
+                arrival = ArrivalEvent(context.event.time + arrival_time, HandleArrival(), new_job, None, entry_node)
                 arrival.external = True
                 context.scheduler.schedule(arrival)
 
@@ -39,6 +60,11 @@ def _update_job_service_time(job: Job, old_remaining: float, new_remaining: floa
 
 def _update_node_departures(now, node: Node, num_jobs_in_service, old_num_jobs_in_service, scheduler,):
         
+    # since the last change each job in service received 1/old_num_jobs_in_service of the servers
+    # (at most a whole server), i.e. that fraction of the elapsed time as work at the full rate of a server
+    served_work = (now - node.queue.last_update) / node.queue.stretch(old_num_jobs_in_service)
+    node.queue.last_update = now
+
     scheduled_departures = node.scheduled_departures
     for departure in scheduled_departures.values():
 
@@ -47,17 +73,12 @@ def _update_node_departures(now, node: Node, num_jobs_in_service, old_num_jobs_i
         # cancel old departures
         scheduler.cancel(departure)
 
-        # re-calculates departure time
-        #
-        # La pesca random è sul tempo di servizio, che chiamiamo S. 
-        # Sia Srem il tempo di servizio rimanente.
-        # Sia Drem la domanda rimanente e mu/N il rate di servizio, allora Srem = Drem/(mu/N).
-        # Prendiamo nuovo rate mu2 = mu/N*, dove N* è il nuovo numero dei job in servizio.
-        # Sia Srem2 = Drem/mu2 il tempo di servizio che ci metterebbe con mu2.
-        # Ti ricavi Drem = Srem•mu/N => Srem2 = (Srem•mu/N)/(mu/N*) = Srem • N*/N
-        # Ora i job vanno schedulati a current time + Srem2
+        # re-calculates departure time from the remaining work of the job:
+        # sharing the servers with num_jobs_in_service jobs, it takes num_jobs_in_service / servers times its work.
+        # Only the remaining work is tracked, so any service demand distribution is shared correctly
+        job.remaining_work -= served_work
         old_remaining_service_time = departure.time - now
-        remaining_service_time = old_remaining_service_time * (num_jobs_in_service / float(old_num_jobs_in_service))
+        remaining_service_time = max(job.remaining_work, 0.0) * node.queue.stretch(num_jobs_in_service)
         departure_time = now + remaining_service_time
 
         # updates job service time
@@ -66,7 +87,11 @@ def _update_node_departures(now, node: Node, num_jobs_in_service, old_num_jobs_i
         # re-schedules departure as a new event with new departure time
         new_departure = DepartureEvent(departure_time, HandleDeparture(), job, departure.node)
         new_departure.external = departure.external
+        new_departure.next_node = departure.next_node
+        new_departure.next_class = departure.next_class
         scheduler.schedule(new_departure)
+        if job.attempt is not None:
+            job.attempt.departure = new_departure
         node.scheduled_departures[job.job_id] = new_departure    
 
 class HandleArrival(EventHandler):
@@ -78,42 +103,78 @@ class HandleArrival(EventHandler):
         
         job = context.event.job
         job_class = job.class_id
-        job_server = context.event.node.id
-        job_server_int = context.event.node.node_map(job_server)
+        node = context.event.dispatch(context.network)
+        node_index = node.index
+        population = context.network.population
+        timeouts = context.network.timeouts
+
+        if context.event.external:
+            # the request of a user arrived, the next user to wake up sends the next one
+            if job.user is not None and not context.event.retry:
+                population.next_request(context.scheduler)
+            # the deadline of the client starts when the job enters the system
+            if timeouts is not None:
+                timeouts.start(job, node.group, context.scheduler, context.event.time)
+        abandoned = job.attempt is not None and job.attempt.abandoned
+
+        # finite buffer: an arrival finding the node full is dropped and the job leaves the system
+        max_jobs = node.queue.max_jobs
+        if max_jobs is not None and context.network.state.get_num_jobs_in_node(node) >= max_jobs:
+            context.event.dropped = True
+            job.demand = None
+            if job.attempt is not None and not abandoned:
+                timeouts.completed(job, context.scheduler)
+            if job.user is not None and not abandoned:
+                population.think(job, context.scheduler, context.event.time)
+            return
         
         # aggiornamento dello stato del sistema
-        context.network.state.update((job_server_int, job_class), True)
+        context.network.state.update((node_index, job_class), True)
 
-        # get service rate of this node according to job class
-        service_rate = float(context.network.nodes[job_server_int].service_rate[job_class])
-        
-        # rescale service rate if we are using a PS node
-        node = context.event.node
+        # the job is served alone, or shares the servers with the other jobs if we are using a PS node
+        stretch = 1.0
         if type(node.queue) is PSQueue:
                         
             # calc num jobs in service.
             num_jobs_in_node = len(node.scheduled_departures) + 1 # so num_jobs_in_node is always > 0
             old_num_jobs_in_node = num_jobs_in_node - 1 if num_jobs_in_node > 1 else num_jobs_in_node
-            service_rate = service_rate / num_jobs_in_node
 
             # update departure times for already scheduled jobs
             now = context.event.time
             _update_node_departures(now, node, num_jobs_in_node, old_num_jobs_in_node, context.scheduler)
+            stretch = node.queue.stretch(num_jobs_in_node)
+
+        # service demand, i.e. service time at the full rate of the server
+        if job.demand is not None:
+            # demand given by the workload
+            demand = job.demand
+            job.demand = None
+        else:
+            demand = node.server.get_service(job_class)
 
         # calc departure time
-        service_time = context.event.node.server.get_service([service_rate])
+        service_time = demand * stretch
         arrival_time = context.event.time
-        queue_time = context.event.node.queue.get_queue_time(context.event.job, arrival_time)
+        queue_time = node.queue.get_queue_time(job, arrival_time)
         departure_time = arrival_time + service_time + queue_time
-        context.network.nodes[job_server_int].queue.register_last_departure(context.event.job, departure_time)
-        context.event.job.service_time = service_time
+        node.queue.register_last_departure(job, departure_time)
+        job.service_time = service_time
+        job.service_demand = demand
+        job.remaining_work = demand
+        if job.attempt is not None:
+            job.attempt.work += demand
+        if node.dispatcher is not None:
+            node.dispatcher.arrived(node, demand, arrival_time)
 
-        # promote job class
-        context.event.job.class_id = job_class+1 if job_server != 'A' else job_class
-        
         # scheduling dell'evento di departure
-        departure = DepartureEvent(departure_time, HandleDeparture(), context.event.job, context.event.node)
-        departure.external = True if (job_server == 'A' and job_class == 2) else False
+        # the next hop is chosen now, so the departure already knows if the job leaves the system
+        departure = DepartureEvent(departure_time, HandleDeparture(), job, node)
+        departure.next_node, departure.next_class = context.network.routing.route(node.group, job_class)
+        departure.external = departure.next_node == RoutingTable.EXIT
+        if job.attempt is not None:
+            # a job abandoned by its client leaves the system once served here
+            departure.external = departure.external or abandoned
+            job.attempt.departure = departure
         context.scheduler.schedule(departure)
 
         # register departure to possibly update it by PS rule in case of another job arrival at the same node in the future 
@@ -125,39 +186,41 @@ class HandleDeparture(EventHandler):
         super().__init__()
 
     def _handle(self, context: EventContext):
-        job = context.event.job
-        job_server_str = context.event.node.id
-        job_server = context.event.node.node_map(job_server_str)
-        job_class = context.event.job.class_id
+        departure = context.event
+        job = departure.job
+        node = departure.node
     
         # aggiornamento dello stato del sistema
-        decrease = job_class-1 if job_class > 0 else job_class
-        context.network.state.update((job_server, decrease), False)
+        context.network.state.update((node.index, job.class_id), False)
+        if node.dispatcher is not None:
+            node.dispatcher.departed(node, departure.time)
 
         # we need to update the departure times of the other jobs in service
         # since now they are receiving a bigger service rate
-        node = context.event.node
         if type(node.queue) is PSQueue:
             
             # remove departure from scheduled departures of this node
             node.scheduled_departures.pop(job.job_id)
             
-            now = context.event.time
+            now = departure.time
             num_jobs_in_node = len(node.scheduled_departures)
             old_jobs_in_node = num_jobs_in_node + 1
             _update_node_departures(now, node, num_jobs_in_node, old_jobs_in_node, context.scheduler)
 
-        
-        if not (job_class == 2 and job_server_str == 'A'):
-            if job_server_str in ['B', 'P']:
-                new_server_id = 'A'
-            elif job_server_str == 'A' and job_class == 0:
-                new_server_id = 'B'
-            else:
-                new_server_id = 'P'
-            next_node = context.network.nodes[context.event.node.node_map(new_server_id)]
-            arrival = ArrivalEvent(context.event.time, HandleArrival(), context.event.job, next_node)
+        # routing with class switching to the next node
+        attempt = job.attempt
+        if attempt is not None:
+            attempt.departure = None
+        if not departure.external:
+            job.class_id = departure.next_class
+            arrival = ArrivalEvent(departure.time, HandleArrival(), job, None, departure.next_node)
             context.scheduler.schedule(arrival)
+        elif attempt is None or not attempt.abandoned:
+            if attempt is not None:
+                context.network.timeouts.completed(job, context.scheduler)
+            if job.user is not None:
+                # the user of a closed workload thinks before its next request
+                context.network.population.think(job, context.scheduler, departure.time)
 
 class HandleInit(EventHandler):
     def __init__(self):
@@ -168,9 +231,14 @@ class HandleFirstArrival(HandleInit):
         super().__init__()
 
     def _handle(self, context: EventContext):
-        job = Job(0, 0)
-        node = context.network.nodes[0]
-        arrival = ArrivalEvent(0.0, HandleArrival(), job, node)
+        if context.network.population is not None:
+            # closed workload: all the users start thinking
+            context.network.population.start(context.scheduler, context.event.time)
+            return
+        entry_node, entry_class, demand = context.network.get_entry()
+        job = Job(entry_class, 0)
+        job.demand = demand
+        arrival = ArrivalEvent(0.0, HandleArrival(), job, None, entry_node)
         arrival.external = True
         context.scheduler.schedule(arrival)
         
\ No newline at end of file
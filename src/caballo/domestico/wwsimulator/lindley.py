@@ -0,0 +1,415 @@
+import numpy as np
+
+from caballo.domestico.wwsimulator import streams
+from caballo.domestico.wwsimulator.analytic import is_exponential, is_single_server
+from caballo.domestico.wwsimulator.model import FIFOQueue, Network, RoutingTable
+from caballo.domestico.wwsimulator.output import (_GLOBAL, OutputStatistic, class_label, class_labels,
+                                                  save_quantile_statistics, save_statistic_value)
+from caballo.domestico.wwsimulator.simulation import Simulation, SimulationFactory
+from caballo.domestico.wwsimulator.statistics import GroupedSamples, HistogramQuantileEstimator
+from caballo.domestico.wwsimulator.streams import EXTERNAL_ARRIVALS, ROUTING
+from pdsteele.des import rngs
+
+_EXIT = -1
+_RANDOM = -2
+
+class LindleySimulation(Simulation):
+    """
+    Simulates a network of single server FIFO nodes without events. The departures of a FIFO node follow
+    from its arrivals by the Lindley recursion D_k = max(A_k, D_k-1) + S_k, the one applied job by job by
+    FIFOQueue.get_queue_time, which in max-plus form is D_k = C_k + max_j<=k (A_j - C_j-1) with C the cumulative
+    sums of the service times: a cumulative sum and a running maximum over all the visits of a node at once.
+    The route of each job (its (node, class) visits) is drawn upfront, then the nodes are swept in turn, each
+    sweep sorting the arrivals of a node, computing its departures and passing them to the next visit of the jobs
+    as arrival times, until the arrival times no longer change: since a job revisits nodes (and classes share
+    them), a node depends on the departures of the others and the sweeps converge to the causal sample path.
+    As the event driven simulation, the service times are drawn from the stream of the node in arrival order
+    and the inter-arrival times from the external arrivals stream, so with deterministic routing the sample path is
+    the one of the events (up to rounding); the random routes are instead drawn job by job, so they are
+    distributed as the ones of the events but do not reproduce them.
+    Each replica generates num_arrivals external arrivals (the first one at time 0) and runs until the system
+    is empty, starting from the final prng state of the previous one as the replicas of ReplicatedSimulation.
+    Its statistics are collected as an iteration, with the same keys as the estimators subscribed by
+    main.subscribe_estimators; with batch_size, the replicas are instead split in batches of batch_size
+    external departures, as by BatchMeansInterceptor.
+    """
+
+    MAX_SWEEPS = 10000
+    """
+    Bound on the sweeps over the nodes, reached only if the arrival times do not converge.
+    """
+
+    def __init__(self, study: str, network: Network, initial_seed: int, num_arrivals: int, replicas: int = 1, batch_size: int = None):
+        super().__init__(study, network, initial_seed)
+        if not is_exponential(network):
+            raise ValueError("The Lindley recursion requires Poisson arrivals and exponential services")
+        if not all(type(node.queue) is FIFOQueue for node in network.nodes):
+            raise ValueError("The Lindley recursion requires FIFO nodes only")
+        if not is_single_server(network):
+            raise ValueError("The Lindley recursion requires single server nodes with unlimited buffers and no timeouts")
+        if replicas < 1 or num_arrivals < 1:
+            raise ValueError("At least one replica and one arrival are required.")
+        self.num_arrivals = num_arrivals
+        self.replicas = replicas
+        self.batch_size = batch_size
+        """
+        Number of external departures per batch, None to collect each replica as an iteration.
+        """
+        self.sweeps = 0
+        """
+        Number of sweeps over the nodes of the last run.
+        """
+
+        self._n_nodes = len(network.nodes)
+        self._n_classes = network.state.n_classes
+        self._rates = np.array([[float(node.service_rate[class_id]) if class_id < len(node.service_rate) else 1.0
+                                 for class_id in range(self._n_classes)] for node in network.nodes])
+        self._arrival_rate = float(network.job_arrival_param[0])
+        self._compile_routing(network.routing)
+
+    def _compile_routing(self, routing: RoutingTable):
+        # rows are flattened as node * n_classes + class, the last column of the distributions is the exit
+        n_rows = self._n_nodes * self._n_classes
+        self._exit = n_rows
+
+        def compile(destinations):
+            if len(destinations) == 1:
+                next_node, next_class, _ = destinations[0]
+                return _EXIT if next_node == RoutingTable.EXIT else routing.row(next_node, next_class), None
+            probabilities = np.zeros(n_rows + 1)
+            for next_node, next_class, p in destinations:
+                probabilities[self._exit if next_node == RoutingTable.EXIT else routing.row(next_node, next_class)] += p
+            return _RANDOM, np.cumsum(probabilities)
+
+        self._next_row = np.full(n_rows, _EXIT)
+        self._cumulative = np.zeros((n_rows, n_rows + 1))
+        for node_index in range(self._n_nodes):
+            for class_id in range(self._n_classes):
+                row = routing.row(node_index, class_id)
+                self._next_row[row], cumulative = compile(routing.transitions(node_index, class_id))
+                if cumulative is not None:
+                    self._cumulative[row] = cumulative
+        self._entry_row, self._entry_cumulative = compile(routing.entries())
+
+    def _draw(self, cumulative: np.ndarray, n: int) -> np.ndarray:
+        # as RoutingTable._draw: the first destination whose cumulative probability exceeds u
+        u = streams.randoms(ROUTING, n)
+        columns = np.minimum((cumulative <= (u * cumulative[:, -1])[:, None]).sum(axis=1), cumulative.shape[1] - 1)
+        return np.where(columns == self._exit, _EXIT, columns)
+
+    def _route(self, rows: np.ndarray) -> np.ndarray:
+        next_rows = self._next_row[rows]
+        random = next_rows == _RANDOM
+        if random.any():
+            next_rows[random] = self._draw(self._cumulative[rows[random]], int(random.sum()))
+        return next_rows
+
+    def _draw_replica(self):
+        """
+        Draws the external arrival times, the routes and the service uniforms of a replica.
+        Returns the arrival times of the jobs, the (node, class) row, job and previous visit of each visit,
+        and the service uniforms of each node in arrival order.
+        """
+        n = self.num_arrivals
+        interarrivals = -(1.0 / self._arrival_rate) * np.log(1.0 - streams.randoms(EXTERNAL_ARRIVALS, n - 1))
+        entry_times = np.cumsum(np.concatenate(([0.0], interarrivals)))
+        if self._entry_cumulative is None:
+            rows = np.full(n, self._entry_row)
+        else:
+            rows = self._draw(np.broadcast_to(self._entry_cumulative, (n, len(self._entry_cumulative))), n)
+
+        # the visits are drawn hop by hop, for all the jobs still in the system
+        jobs = np.arange(n)
+        last_visit = np.full(n, -1)
+        visit_rows, visit_jobs, previous = [], [], []
+        n_visits = 0
+        while len(jobs) > 0:
+            visit_rows.append(rows)
+            visit_jobs.append(jobs)
+            previous.append(last_visit[jobs])
+            last_visit[jobs] = n_visits + np.arange(len(jobs))
+            n_visits += len(jobs)
+            rows = self._route(rows)
+            staying = rows != _EXIT
+            jobs, rows = jobs[staying], rows[staying]
+        visit_rows = np.concatenate(visit_rows)
+        nodes = visit_rows // self._n_classes
+        uniforms = [streams.randoms(node.server.prng_stream, int(np.count_nonzero(nodes == node.index)))
+                    for node in self.network.nodes]
+        return entry_times, visit_rows, np.concatenate(visit_jobs), np.concatenate(previous), uniforms
+
+    def run(self):
+        parts = []
+        seed = self.initial_seed
+        for replica in range(self.replicas):
+            if replica > 0:
+                # final prng state of the previous replica, as ReplicatedSimulation
+                rngs.selectStream(EXTERNAL_ARRIVALS)
+                seed = rngs.getSeed()
+            rngs.plantSeeds(seed)
+            parts.append(self._draw_replica())
+        self._init_path(parts)
+        self._solve()
+        self.set_statistics(self._statistics())
+        if self.on_iteration is not None:
+            self.on_iteration(self)
+
+    def _init_path(self, parts: list):
+        """
+        Concatenates the visits of the replicas, jobs and visits being numbered across them.
+        """
+        job_offsets = np.arange(self.replicas) * self.num_arrivals
+        visit_offsets = np.cumsum([0] + [len(part[1]) for part in parts])
+        self._entry_times = np.concatenate([part[0] for part in parts])
+        rows = np.concatenate([part[1] for part in parts])
+        self._visit_node = rows // self._n_classes
+        self._visit_class = rows % self._n_classes
+        self._visit_job = np.concatenate([part[2] + offset for part, offset in zip(parts, job_offsets)])
+        self._visit_replica = self._visit_job // self.num_arrivals
+        self._previous = np.concatenate([np.where(part[3] >= 0, part[3] + offset, -1) for part, offset in zip(parts, visit_offsets)])
+        self._next = np.full(len(rows), -1)
+        following = np.flatnonzero(self._previous >= 0)
+        self._next[self._previous[following]] = following
+        self._uniforms = [np.concatenate([part[4][node_index] for part in parts]) for node_index in range(self._n_nodes)]
+
+    def _solve(self):
+        """
+        Computes the sample path, i.e. the arrival, service and departure times of the visits, starting from
+        the arrival times of the jobs spending no time at their previous visits.
+        """
+        self._arrival = self._entry_times[self._visit_job].copy()
+        self._departure = np.zeros(len(self._visit_node))
+        self._service = np.zeros(len(self._visit_node))
+        self._node_visits = [np.flatnonzero(self._visit_node == node_index) for node_index in range(self._n_nodes)]
+        self._log_uniforms = [np.log(1.0 - uniforms) for uniforms in self._uniforms]
+        self.sweeps = 0
+        self._sweep(self._visit_replica, self.replicas, np.ones(self.replicas, dtype=bool))
+
+    def _sweep(self, chunks: np.ndarray, n_chunks: int, active: np.ndarray):
+        """
+        Sweeps the nodes until the arrival times of the visits of the active chunks (the replicas) are a fixed point.
+        The visits of a node are laid out in a (chunk, position in arrival order) array, so the cumulative sums
+        and running maxima of the chunks are independent; a chunk whose arrival times did not change in a sweep
+        is no longer active.
+        """
+        offsets = []
+        for visits in self._node_visits:
+            counts = np.bincount(chunks[visits], minlength=n_chunks)
+            offsets.append(np.cumsum(counts) - counts)
+        while active.any():
+            if self.sweeps == LindleySimulation.MAX_SWEEPS:
+                raise RuntimeError(f"The arrival times did not converge in {LindleySimulation.MAX_SWEEPS} sweeps")
+            self.sweeps += 1
+            swept = np.flatnonzero(active[chunks])
+            previous_arrival = self._arrival[swept]
+            for node_index, visits in enumerate(self._node_visits):
+                visits = visits[active[chunks[visits]]]
+                if len(visits) == 0:
+                    continue
+                # visits in arrival order, chunk by chunk
+                ordered = visits[np.lexsort((self._arrival[visits], chunks[visits]))]
+                ordered_chunks = chunks[ordered]
+                first = np.concatenate(([True], ordered_chunks[1:] != ordered_chunks[:-1]))
+                rows = np.cumsum(first) - 1
+                columns = np.arange(len(ordered)) - np.flatnonzero(first)[rows]
+                shape = (int(first.sum()), int(columns.max()) + 1)
+                log_uniforms = np.zeros(shape)
+                log_uniforms[rows, columns] = self._log_uniforms[node_index][offsets[node_index][ordered_chunks] + columns]
+                arrivals = np.zeros(shape)
+                arrivals[rows, columns] = self._arrival[ordered]
+                rates = np.ones(shape)
+                rates[rows, columns] = self._rates[node_index, self._visit_class[ordered]]
+                # inversion, as streams.exponential
+                services = -(1.0 / rates) * log_uniforms
+                cumulative = np.cumsum(services, axis=1)
+                previous = np.zeros(shape)
+                previous[:, 1:] = cumulative[:, :-1]
+                departures = cumulative + np.maximum.accumulate(arrivals - previous, axis=1)
+
+                self._departure[ordered] = departures[rows, columns]
+                self._service[ordered] = services[rows, columns]
+                following = self._next[ordered]
+                routed = following >= 0
+                self._arrival[following[routed]] = self._departure[ordered[routed]]
+            changed = np.zeros(n_chunks, dtype=bool)
+            changed[chunks[swept[self._arrival[swept] != previous_arrival]]] = True
+            active &= changed
+
+    def _windows(self):
+        """
+        Sorts the arrivals and departures of the visits as the events would be processed, a departure before
+        the arrival of the job at its next node at the same time, and splits them in segments:
+        the replicas, or the batches of the replicas followed by the movements after their last batch.
+        Returns the segment starts and whether each segment is an iteration.
+        """
+        n_visits = len(self._visit_node)
+        times = np.concatenate((self._arrival, self._departure))
+        departing = np.repeat([False, True], n_visits)
+        replicas = np.tile(self._visit_replica, 2)
+        order = np.lexsort((~departing, times, replicas))
+        self._time = times[order]
+        self._departing = departing[order]
+        self._visit = np.tile(np.arange(n_visits), 2)[order]
+        self._replica = replicas[order]
+        self._external = np.where(self._departing, self._next[self._visit] < 0, self._previous[self._visit] < 0)
+
+        replica_starts = np.searchsorted(self._replica, np.arange(self.replicas))
+        if self.batch_size is None:
+            return replica_starts, np.ones(self.replicas, dtype=bool)
+        # the departure completing a batch is the first movement of the next one, as with BatchMeansInterceptor
+        exits = np.flatnonzero(self._departing & self._external)
+        n_batches = self.num_arrivals // self.batch_size
+        starts, iterations = [], []
+        for replica in range(self.replicas):
+            boundaries = exits[replica * self.num_arrivals:(replica + 1) * self.num_arrivals][self.batch_size - 1::self.batch_size][:n_batches]
+            starts += [replica_starts[replica]] + boundaries.tolist()
+            iterations += [True] * len(boundaries) + [False]
+        return np.array(starts), np.array(iterations)
+
+    def _statistics(self) -> dict:
+        """
+        Statistics of the iterations by name, with a value per iteration, computed for all of them at once.
+        As with the estimators, a statistic of a node is missing in the iterations where the node has no sample
+        (e.g. no completion), while the statistics of the (node, class) pairs are always saved.
+        """
+        network = self.network
+        N, K = self._n_nodes, self._n_classes
+        starts, iterations = self._windows()
+        n_movements = len(self._time)
+        n_segments = len(starts)
+        ends = np.append(starts[1:], n_movements)
+        lengths = ends - starts
+        segment = np.repeat(np.arange(n_segments), lengths)
+        time = self._time
+        visit = self._visit
+        start_times = time[starts]
+        # a batch lasts until the departure completing it, a replica until its last movement
+        end_times = time[np.minimum(ends, n_movements - 1)] if self.batch_size is not None else time[ends - 1]
+        # the movements after the last batch of a replica are not observed
+        observed_times = np.where(iterations, end_times - start_times, 1.0)
+        # each movement sets the values of the variables held until the next movement of its replica
+        durations = np.zeros(n_movements)
+        durations[:-1] = np.where(self._replica[1:] == self._replica[:-1], np.diff(time), 0.0)
+        after_start = time > start_times[segment]
+
+        nodes = self._visit_node[visit]
+        classes = self._visit_class[visit]
+        pairs = nodes * K + classes
+        steps = np.where(self._departing, -1, 1)
+        statistics = {}
+        save_statistic_value(OutputStatistic.OBSERVATION_TIME, _GLOBAL, (time[ends - 1] - start_times)[iterations].tolist(), "val", statistics)
+
+        def time_averaged(output_statistic: OutputStatistic, label: str, values: np.ndarray):
+            # as WelfordTimeAveragedEstimator: the bounds include the values held before a change after the start
+            # of the iteration, and the final one
+            values = values.astype(float)
+            areas = np.add.reduceat(values * durations, starts)
+            avg = areas / observed_times
+            squares = np.add.reduceat(values * values * durations, starts) / observed_times
+            std = np.sqrt(np.maximum(squares - avg * avg, 0.0))
+            held = np.concatenate(([0.0], values[:-1]))
+            maximum = np.maximum(np.maximum.reduceat(np.where(after_start, held, -np.inf), starts), values[ends - 1])
+            minimum = np.minimum(np.minimum.reduceat(np.where(after_start, held, np.inf), starts), values[ends - 1])
+            for variant, variant_values in (("avg", avg), ("std", std), ("max", maximum), ("min", minimum)):
+                save_statistic_value(output_statistic, label, variant_values[iterations].tolist(), variant, statistics)
+            return areas
+
+        pair_populations = [np.cumsum(np.where(pairs == pair, steps, 0)) for pair in range(N * K)]
+        node_populations = [np.cumsum(np.where(nodes == node_index, steps, 0)) for node_index in range(N)]
+        system_population = np.cumsum(np.where(self._external, steps, 0))
+        for label, values in zip(class_labels(network), pair_populations):
+            time_averaged(OutputStatistic.POPULATION, label, values)
+        for node, values in zip(network.nodes, node_populations):
+            time_averaged(OutputStatistic.POPULATION, node.id, values)
+        for class_id in range(K):
+            time_averaged(OutputStatistic.POPULATION, class_label(_GLOBAL, class_id), np.cumsum(np.where(classes == class_id, steps, 0)))
+        time_averaged(OutputStatistic.POPULATION, _GLOBAL, system_population)
+        for label, pair in zip(class_labels(network), range(N * K)):
+            population = node_populations[pair // K]
+            time_averaged(OutputStatistic.UTILIZATION, label, pair_populations[pair] / np.maximum(population, 1))
+        busy_times = [time_averaged(OutputStatistic.UTILIZATION, node.id, node_populations[node.index] > 0) for node in network.nodes]
+        busy_times.append(np.add.reduceat((system_population > 0) * durations, starts))
+
+        # samples of the departures and of the arrivals, by (segment, label)
+        departures = np.flatnonzero(self._departing)
+        exits = departures[self._external[departures]]
+        response_times = self._departure - self._arrival
+        system_response_times = time[exits] - self._entry_times[self._visit_job[visit[exits]]]
+        arrivals = np.flatnonzero(~self._departing)
+        # arrivals of the same (replica, node) in time order, the first one of each has no inter-arrival time
+        by_node = arrivals[np.lexsort((arrivals, nodes[arrivals], self._replica[arrivals]))]
+        same = (nodes[by_node[1:]] == nodes[by_node[:-1]]) & (self._replica[by_node[1:]] == self._replica[by_node[:-1]])
+        entries = arrivals[self._external[arrivals]]
+        same_system = self._replica[entries[1:]] == self._replica[entries[:-1]]
+        node_labels = [node.id for node in network.nodes] + [_GLOBAL]
+
+        def moments(output_statistic: OutputStatistic, labels: list, movements: np.ndarray, label_indexes, values: np.ndarray, always: bool):
+            # sample mean, population standard deviation and bounds, as WelfordEstimator
+            index = segment[movements] * len(labels) + label_indexes
+            size = n_segments * len(labels)
+            n_samples = np.bincount(index, minlength=size)
+            avg = np.bincount(index, weights=values, minlength=size) / np.maximum(n_samples, 1)
+            std = np.sqrt(np.bincount(index, weights=(values - avg[index]) ** 2, minlength=size) / np.maximum(n_samples, 1))
+            maximum = np.full(size, -np.inf)
+            minimum = np.full(size, np.inf)
+            np.maximum.at(maximum, index, values)
+            np.minimum.at(minimum, index, values)
+            n_samples = n_samples.reshape(n_segments, len(labels))
+            for label_index, label in enumerate(labels):
+                saved = iterations & (always | (n_samples[:, label_index] > 0))
+                for variant, variant_values in (("avg", avg), ("std", std), ("max", maximum), ("min", minimum)):
+                    save_statistic_value(output_statistic, label, variant_values.reshape(n_segments, len(labels))[saved, label_index].tolist(), variant, statistics)
+            return n_samples
+
+        response_movements = np.concatenate((departures, exits))
+        response_labels = np.concatenate((nodes[departures], np.full(len(exits), N)))
+        response_values = np.concatenate((response_times[visit[departures]], system_response_times))
+        moments(OutputStatistic.RESPONSE_TIME, node_labels, response_movements, response_labels, response_values, False)
+        samples = GroupedSamples()
+        samples.add(segment[response_movements], response_labels, response_values)
+        samples = samples.groups()
+        for index, label in enumerate(node_labels):
+            quantiles = {}
+            for segment_index in np.flatnonzero(iterations):
+                if (segment_index, index) in samples:
+                    estimator = HistogramQuantileEstimator()
+                    estimator.update_many(samples[(segment_index, index)])
+                    save_quantile_statistics(OutputStatistic.RESPONSE_TIME, label, estimator, quantiles)
+                    for key, value in quantiles.items():
+                        statistics.setdefault(key, []).append(value)
+        interarrival_movements = np.concatenate((by_node[1:][same], entries[1:][same_system]))
+        interarrival_labels = np.concatenate((nodes[by_node[1:][same]], np.full(int(same_system.sum()), N)))
+        interarrival_values = np.concatenate(((time[by_node[1:]] - time[by_node[:-1]])[same], (time[entries[1:]] - time[entries[:-1]])[same_system]))
+        moments(OutputStatistic.INTERARRIVAL_TIME, node_labels, interarrival_movements, interarrival_labels, interarrival_values, False)
+        moments(OutputStatistic.SERVICE_TIME, node_labels[:-1], departures, nodes[departures], self._service[visit[departures]], False)
+        moments(OutputStatistic.RESPONSE_TIME, class_labels(network), departures, pairs[departures], response_times[visit[departures]], True)
+
+        completions = np.bincount(segment[departures] * (N + 1) + nodes[departures], minlength=n_segments * (N + 1)).reshape(n_segments, N + 1)
+        completions[:, N] = np.bincount(segment[exits], minlength=n_segments)
+        for index, label in enumerate(node_labels):
+            # saved from the first completion, as CompletionsEstimator and BusytimeEstimator
+            completed = iterations & (completions[:, index] > 0)
+            save_statistic_value(OutputStatistic.COMPLETIONS, label, completions[completed, index].tolist(), "val", statistics)
+            save_statistic_value(OutputStatistic.BUSY_TIME, label, busy_times[index][completed].tolist(), "val", statistics)
+        class_completions = np.bincount(segment[departures] * N * K + pairs[departures], minlength=n_segments * N * K).reshape(n_segments, N * K)
+        for index, label in enumerate(class_labels(network)):
+            save_statistic_value(OutputStatistic.COMPLETIONS, label, class_completions[iterations, index].tolist(), "val", statistics)
+
+        # likelihood ratio scores, as ScoreEstimator: the first arrival of a replica is not an exponential draw
+        scored = entries[1:][same_system]
+        arrival_scores = np.bincount(segment[scored], weights=1.0 / self._arrival_rate - (time[entries[1:]] - time[entries[:-1]])[same_system],
+                                     minlength=n_segments)
+        save_statistic_value(OutputStatistic.SCORE, _GLOBAL, arrival_scores[iterations].tolist(), "lambda", statistics)
+        rates = self._rates[nodes[arrivals], classes[arrivals]]
+        class_scores = np.bincount(segment[arrivals] * N * K + pairs[arrivals], weights=1.0 / rates - self._service[visit[arrivals]],
+                                   minlength=n_segments * N * K).reshape(n_segments, N, K)
+        for index, label in enumerate(class_labels(network)):
+            save_statistic_value(OutputStatistic.SCORE, label, class_scores.reshape(n_segments, -1)[iterations, index].tolist(), "rate", statistics)
+        node_scores = (self._rates * class_scores).sum(axis=2)
+        for node in network.nodes:
+            save_statistic_value(OutputStatistic.SCORE, node.id, node_scores[iterations, node.index].tolist(), "speed", statistics)
+        return {key: values for key, values in statistics.items() if len(values) > 0}
+
+def create_lindley_simulation(experiment, lambda_val, num_arrivals: int, seed: int, replicas: int = 1, batch_size: int = None) -> LindleySimulation:
+    network = SimulationFactory().create_network(experiment, lambda_val)
+    return LindleySimulation(experiment['simulation_study'], network, seed, num_arrivals, replicas, batch_size)
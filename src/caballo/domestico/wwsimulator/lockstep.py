@@ -0,0 +1,397 @@
+import numpy as np
+
+from caballo.domestico.wwsimulator.analytic import is_exponential, is_single_server
+from caballo.domestico.wwsimulator.model import Network, PSQueue, RoutingTable
+from caballo.domestico.wwsimulator.output import (_GLOBAL, OutputStatistic, class_label, class_labels,
+                                                  save_quantile_statistics, save_statistic_value)
+from caballo.domestico.wwsimulator.simulation import Simulation, SimulationFactory
+from caballo.domestico.wwsimulator.statistics import GroupedSamples, HistogramQuantileEstimator
+from caballo.domestico.wwsimulator.streams import EXTERNAL_ARRIVALS, ROUTING, SERVICES_BASE
+
+
+class _Moments():
+    """
+    Welford estimates of the mean, standard deviation and bounds of sample statistics by (replica, label).
+    The samples of a step are queued and applied at once by update, so each (replica, label)
+    must receive at most one sample per step.
+    """
+    def __init__(self, replicas: int, n_labels: int):
+        self.n_labels = n_labels
+        self._n_samples = np.zeros(replicas * n_labels, dtype=int)
+        self._avg = np.zeros(replicas * n_labels)
+        self._sum = np.zeros(replicas * n_labels)
+        self._min = np.full(replicas * n_labels, np.inf)
+        self._max = np.full(replicas * n_labels, -np.inf)
+        # viste (replica, label) degli array piatti
+        self.n_samples = self._n_samples.reshape(replicas, n_labels)
+        self.avg = self._avg.reshape(replicas, n_labels)
+        self.min = self._min.reshape(replicas, n_labels)
+        self.max = self._max.reshape(replicas, n_labels)
+        self._indexes = []
+        self._samples = []
+
+    @property
+    def std(self):
+        return np.sqrt(self._sum / np.maximum(self._n_samples, 1)).reshape(self.n_samples.shape)
+
+    def add(self, replicas: np.ndarray, labels, samples: np.ndarray):
+        self._indexes.append(replicas * self.n_labels + labels)
+        self._samples.append(samples)
+
+    def update(self):
+        if len(self._indexes) == 0:
+            return
+        indexes = np.concatenate(self._indexes)
+        samples = np.concatenate(self._samples)
+        self._indexes = []
+        self._samples = []
+        n_samples = self._n_samples[indexes] + 1
+        diff = samples - self._avg[indexes]
+        avg = self._avg[indexes] + diff / n_samples
+        self._n_samples[indexes] = n_samples
+        self._avg[indexes] = avg
+        self._sum[indexes] += diff * (samples - avg)
+        self._min[indexes] = np.minimum(self._min[indexes], samples)
+        self._max[indexes] = np.maximum(self._max[indexes], samples)
+
+class LockstepSimulation(Simulation):
+    """
+    Runs many independent replicas of an exponential network at once, in lockstep:
+    the state of the replicas is kept in NumPy arrays with a row per replica, and each step processes
+    the next event of every replica with masked vector operations, so the Python overhead of an event
+    is paid once for all the replicas.
+    As the replicas of rep_main, each replica generates num_arrivals external arrivals (the first one at time 0)
+    and runs until the system is empty; its statistics are collected as an iteration, with the same keys
+    as the estimators subscribed by main.subscribe_estimators.
+    Jobs are kept in slots (columns) with their node, class and remaining service demand. A PS node serves
+    each of its N jobs at rate 1/N and a FIFO node serves its oldest job at full rate, so the next departure
+    of a replica is the job with the least remaining demand over its share of the server.
+    The random numbers are drawn from NumPy generators seeded by the initial seed and the stream
+    (arrivals, services, routing): the replicas are distributed as the ones of the event driven simulation,
+    but they do not reproduce their sample paths.
+    """
+
+    INITIAL_SLOTS = 16
+    """
+    Initial number of job slots per replica, doubled when a replica has more jobs in the system.
+    """
+
+    def __init__(self, study: str, network: Network, initial_seed: int, replicas: int, num_arrivals: int):
+        super().__init__(study, network, initial_seed)
+        if not is_exponential(network):
+            raise ValueError("Lockstep replicas require Poisson arrivals and exponential services")
+        if not is_single_server(network):
+            raise ValueError("Lockstep replicas require single server nodes with unlimited buffers and no timeouts")
+        if replicas < 1 or num_arrivals < 1:
+            raise ValueError("At least one replica and one arrival are required.")
+        self.replicas = replicas
+        self.num_arrivals = num_arrivals
+
+        self._n_nodes = len(network.nodes)
+        self._n_classes = network.state.n_classes
+        self._rates = np.array([[float(node.service_rate[class_id]) if class_id < len(node.service_rate) else 0.0
+                                 for class_id in range(self._n_classes)] for node in network.nodes])
+        self._ps = np.array([type(node.queue) is PSQueue for node in network.nodes])
+        self._arrival_rate = float(network.job_arrival_param[0])
+        self._compile_routing(network.routing)
+
+    def _compile_routing(self, routing: RoutingTable):
+        # destinations are flattened as node * n_classes + class, the last one is the exit
+        n_rows = self._n_nodes * self._n_classes
+        self._exit = n_rows
+        transitions = np.zeros((n_rows, n_rows + 1))
+        for node_index in range(self._n_nodes):
+            for class_id in range(self._n_classes):
+                row = routing.row(node_index, class_id)
+                for next_node, next_class, p in routing.transitions(node_index, class_id):
+                    column = self._exit if next_node == RoutingTable.EXIT else routing.row(next_node, next_class)
+                    transitions[row, column] += p
+        entries = np.zeros(n_rows)
+        for node_index, class_id, p in routing.entries():
+            entries[routing.row(node_index, class_id)] += p
+        self._transitions = np.cumsum(transitions, axis=1)
+        self._entries = np.cumsum(entries)
+
+    def _draw(self, cumulative: np.ndarray, u: np.ndarray) -> np.ndarray:
+        # cumulative: one row of cumulative probabilities per draw
+        # index of the first destination whose cumulative probability exceeds u
+        return np.minimum((cumulative <= u[:, None] * cumulative[:, -1:]).sum(axis=1), cumulative.shape[1] - 1)
+
+    def _exponential(self, stream: int, size: int) -> np.ndarray:
+        # inversion, as streams.exponential
+        return -np.log(1.0 - self._streams[stream].random(size))
+
+    def _grow(self):
+        n_slots = self._slot_node.shape[1]
+        for name in ("_slot_node", "_slot_class", "_work", "_demand", "_node_arrival", "_entry_time", "_order"):
+            array = getattr(self, name)
+            padding = np.full((self.replicas, n_slots), -1 if array.dtype.kind == 'i' else 0, dtype=array.dtype)
+            setattr(self, name, np.concatenate((array, padding), axis=1))
+
+    def _init_run(self):
+        R = self.replicas
+        self._streams = {stream: np.random.default_rng([self.initial_seed, stream])
+                         for stream in (EXTERNAL_ARRIVALS, SERVICES_BASE, ROUTING)}
+        # slots dei job, -1 per gli slot liberi
+        self._slot_node = np.full((R, LockstepSimulation.INITIAL_SLOTS), -1)
+        self._slot_class = np.full((R, LockstepSimulation.INITIAL_SLOTS), -1)
+        self._work = np.zeros((R, LockstepSimulation.INITIAL_SLOTS))
+        """
+        Remaining service demand of the jobs, at the full rate of the server.
+        """
+        self._demand = np.zeros((R, LockstepSimulation.INITIAL_SLOTS))
+        self._node_arrival = np.zeros((R, LockstepSimulation.INITIAL_SLOTS))
+        self._entry_time = np.zeros((R, LockstepSimulation.INITIAL_SLOTS))
+        self._order = np.full((R, LockstepSimulation.INITIAL_SLOTS), -1)
+        """
+        Step of the arrival of the jobs at their node, the FIFO order.
+        """
+        self._populations = np.zeros((R, self._n_nodes, self._n_classes), dtype=int)
+        self._clock = np.zeros(R)
+        self._next_arrival = np.zeros(R)
+        self._arrivals_left = np.full(R, self.num_arrivals)
+
+        # variables of the time-averaged statistics, layout: (node, class) populations, node populations,
+        # class populations in the system, system population, (node, class) utilizations, node utilizations, system busy
+        n_pairs = self._n_nodes * self._n_classes
+        self._node_base = n_pairs
+        self._class_base = self._node_base + self._n_nodes
+        self._system = self._class_base + self._n_classes
+        self._utilization_base = self._system + 1
+        self._busy_base = self._utilization_base + n_pairs
+        self._system_busy = self._busy_base + self._n_nodes
+        n_variables = self._system_busy + 1
+        self._areas = np.zeros((R, n_variables))
+        self._squared_areas = np.zeros((R, n_variables))
+        self._max = np.full((R, n_variables), -np.inf)
+        self._min = np.full((R, n_variables), np.inf)
+
+        # labels of the sample statistics, layout: response times of the nodes and of the system,
+        # (node, class) response times, inter-arrival times of the nodes and of the system, node service times
+        self._class_response_base = self._n_nodes + 1
+        self._interarrival_base = self._class_response_base + n_pairs
+        self._service_base = self._interarrival_base + self._n_nodes + 1
+        self._moments = _Moments(R, self._service_base + self._n_nodes)
+        self._response_samples = GroupedSamples()
+        """
+        Response times of the nodes and of the system, kept for their quantiles.
+        """
+        self._completions = np.zeros((R, n_pairs), dtype=int)
+        self._system_completions = np.zeros(R, dtype=int)
+        self._last_arrival = np.full((R, self._n_nodes + 1), np.nan)
+        self._arrival_score = np.zeros(R)
+        self._class_scores = np.zeros((R, n_pairs))
+
+    def _variables(self) -> np.ndarray:
+        populations = self._populations
+        node_populations = populations.sum(axis=2)
+        system_population = node_populations.sum(axis=1)
+        shares = populations / np.maximum(node_populations, 1)[:, :, None]
+        return np.concatenate((populations.reshape(self.replicas, -1), node_populations, populations.sum(axis=1),
+                               system_population[:, None], shares.reshape(self.replicas, -1),
+                               node_populations > 0, (system_population > 0)[:, None]), axis=1)
+
+    def _shares(self) -> np.ndarray:
+        """
+        Share of the server of its node received by each job, 0 for free slots and jobs waiting in a FIFO queue.
+        """
+        slot_node = self._slot_node
+        # share of each job of a PS node by node, the last column (index -1) is for the free slots
+        node_shares = np.zeros((self.replicas, self._n_nodes + 1))
+        node_shares[:, :-1] = self._ps / np.maximum(self._populations.sum(axis=2), 1)
+        shares = np.take_along_axis(node_shares, slot_node, axis=1)
+        for node_index in np.flatnonzero(~self._ps):
+            at_node = slot_node == node_index
+            head = np.argmin(np.where(at_node, self._order, np.iinfo(self._order.dtype).max), axis=1)
+            busy = np.flatnonzero(at_node.any(axis=1))
+            shares[busy, head[busy]] = 1.0
+        return shares
+
+    def _arrive(self, replicas: np.ndarray, slots: np.ndarray, destinations: np.ndarray, time: np.ndarray, step: int):
+        """
+        Job arrivals at the (node, class) destinations, the jobs are already in their slots.
+        """
+        nodes, classes = np.divmod(destinations, self._n_classes)
+        rates = self._rates[nodes, classes]
+        demands = self._exponential(SERVICES_BASE, len(replicas)) / rates
+        self._slot_node[replicas, slots] = nodes
+        self._slot_class[replicas, slots] = classes
+        self._work[replicas, slots] = demands
+        self._demand[replicas, slots] = demands
+        self._node_arrival[replicas, slots] = time
+        self._order[replicas, slots] = step
+        self._populations[replicas, nodes, classes] += 1
+
+        last_arrival = self._last_arrival[replicas, nodes]
+        observed = ~np.isnan(last_arrival)
+        self._moments.add(replicas[observed], self._interarrival_base + nodes[observed], (time - last_arrival)[observed])
+        self._last_arrival[replicas, nodes] = time
+        # likelihood ratio score of the service rate, as ScoreEstimator
+        self._class_scores[replicas, destinations] += 1.0 / rates - demands
+
+    def _external_arrivals(self, replicas: np.ndarray, step: int):
+        time = self._clock[replicas]
+        free = self._slot_node[replicas] < 0
+        if not free.any(axis=1).all():
+            self._grow()
+            free = self._slot_node[replicas] < 0
+        slots = np.argmax(free, axis=1)
+        u = self._streams[ROUTING].random(len(replicas))
+        destinations = self._draw(np.broadcast_to(self._entries, (len(replicas), len(self._entries))), u)
+        self._entry_time[replicas, slots] = time
+        self._arrive(replicas, slots, destinations, time, step)
+
+        system = self._n_nodes
+        last_arrival = self._last_arrival[replicas, system]
+        observed = ~np.isnan(last_arrival)
+        self._moments.add(replicas[observed], self._interarrival_base + system, (time - last_arrival)[observed])
+        # the first arrival is not an exponential draw and has no score, as in ScoreEstimator
+        self._arrival_score[replicas[observed]] += 1.0 / self._arrival_rate - (time - last_arrival)[observed]
+        self._last_arrival[replicas, system] = time
+
+        self._arrivals_left[replicas] -= 1
+        interarrivals = self._exponential(EXTERNAL_ARRIVALS, len(replicas)) / self._arrival_rate
+        self._next_arrival[replicas] = np.where(self._arrivals_left[replicas] > 0, time + interarrivals, np.inf)
+
+    def _departures(self, replicas: np.ndarray, slots: np.ndarray, step: int):
+        time = self._clock[replicas]
+        nodes = self._slot_node[replicas, slots]
+        classes = self._slot_class[replicas, slots]
+        pairs = nodes * self._n_classes + classes
+        response_times = time - self._node_arrival[replicas, slots]
+        self._moments.add(replicas, nodes, response_times)
+        self._response_samples.add(replicas, nodes, response_times)
+        self._moments.add(replicas, self._class_response_base + pairs, response_times)
+        self._moments.add(replicas, self._service_base + nodes, self._demand[replicas, slots])
+        self._completions[replicas, pairs] += 1
+        self._populations[replicas, nodes, classes] -= 1
+
+        # routing with class switching to the next node
+        destinations = self._draw(self._transitions[pairs], self._streams[ROUTING].random(len(replicas)))
+        exits = destinations == self._exit
+        leaving, leaving_slots = replicas[exits], slots[exits]
+        system_response_times = time[exits] - self._entry_time[leaving, leaving_slots]
+        self._moments.add(leaving, self._n_nodes, system_response_times)
+        self._response_samples.add(leaving, np.array(self._n_nodes), system_response_times)
+        self._system_completions[leaving] += 1
+        self._slot_node[leaving, leaving_slots] = -1
+        self._slot_class[leaving, leaving_slots] = -1
+        self._work[leaving, leaving_slots] = 0.0
+        self._order[leaving, leaving_slots] = -1
+        self._arrive(replicas[~exits], slots[~exits], destinations[~exits], time[~exits], step)
+
+    def run(self):
+        self._init_run()
+        rows = np.arange(self.replicas)
+        step = 0
+        while True:
+            shares = self._shares()
+            times_to_departure = np.divide(np.maximum(self._work, 0.0), shares, out=np.full(shares.shape, np.inf), where=shares > 0)
+            departing_slots = np.argmin(times_to_departure, axis=1)
+            departure_times = self._clock + times_to_departure[rows, departing_slots]
+            event_times = np.minimum(self._next_arrival, departure_times)
+            active = np.isfinite(event_times)
+            if not active.any():
+                break
+
+            # the variables held their values since the previous event
+            elapsed = np.where(active, event_times - self._clock, 0.0)
+            variables = self._variables()
+            self._areas += variables * elapsed[:, None]
+            self._squared_areas += variables * variables * elapsed[:, None]
+            held = (elapsed > 0)[:, None]
+            np.maximum(self._max, variables, out=self._max, where=held)
+            np.minimum(self._min, variables, out=self._min, where=held)
+            self._work -= shares * elapsed[:, None]
+            self._clock = np.where(active, event_times, self._clock)
+
+            arrivals = active & (self._next_arrival <= departure_times)
+            departures = active & ~arrivals
+            if arrivals.any():
+                self._external_arrivals(rows[arrivals], step)
+            if departures.any():
+                self._departures(rows[departures], departing_slots[departures], step)
+            self._moments.update()
+            step += 1
+
+        # the final values are observed at the end of the replica, as TimeAveragedEstimator.flush
+        variables = self._variables()
+        self._max = np.maximum(self._max, variables)
+        self._min = np.minimum(self._min, variables)
+        # the iterations are collected at once, with their confidence intervals
+        self.set_statistics(self._statistics())
+        if self.on_iteration is not None:
+            self.on_iteration(self)
+
+    def _statistics(self) -> dict:
+        """
+        Statistics of the replicas by name, with a value per replica (per iteration), computed for all
+        the replicas at once. As with the estimators, a statistic of a node is missing in the replicas where
+        the node has no sample (e.g. no completion), while the statistics of the (node, class) pairs are always saved.
+        """
+        network = self.network
+        node_labels = [node.id for node in network.nodes] + [_GLOBAL]
+        pair_labels = class_labels(network)
+        population_labels = pair_labels + node_labels[:-1] + [class_label(_GLOBAL, class_id) for class_id in range(self._n_classes)] + [_GLOBAL]
+        utilization_labels = pair_labels + node_labels[:-1]
+        everywhere = np.ones(self.replicas, dtype=bool)
+        statistics = {}
+        observation_time = self._clock
+        save_statistic_value(OutputStatistic.OBSERVATION_TIME, _GLOBAL, observation_time.tolist(), "val", statistics)
+
+        samples = self._response_samples.groups()
+        for index, label in enumerate(node_labels):
+            for output_statistic, base in ((OutputStatistic.RESPONSE_TIME, 0),
+                                           (OutputStatistic.INTERARRIVAL_TIME, self._interarrival_base),
+                                           (OutputStatistic.SERVICE_TIME, self._service_base)):
+                if base + index < self._moments.n_labels:
+                    _save_moments(output_statistic, label, self._moments, base + index, self._moments.n_samples[:, base + index] > 0, statistics)
+            quantiles = {}
+            for replica in range(self.replicas):
+                if (replica, index) in samples:
+                    estimator = HistogramQuantileEstimator()
+                    estimator.update_many(samples[(replica, index)])
+                    save_quantile_statistics(OutputStatistic.RESPONSE_TIME, label, estimator, quantiles)
+                    for key, value in quantiles.items():
+                        statistics.setdefault(key, []).append(value)
+
+        completions = np.concatenate((self._completions.reshape(self.replicas, self._n_nodes, self._n_classes).sum(axis=2),
+                                      self._system_completions[:, None]), axis=1)
+        busy_times = self._areas[:, self._busy_base:self._system_busy + 1]
+        for index, label in enumerate(node_labels):
+            # saved from the first completion, as CompletionsEstimator and BusytimeEstimator
+            completed = completions[:, index] > 0
+            save_statistic_value(OutputStatistic.COMPLETIONS, label, completions[completed, index].tolist(), "val", statistics)
+            save_statistic_value(OutputStatistic.BUSY_TIME, label, busy_times[completed, index].tolist(), "val", statistics)
+        for index, label in enumerate(pair_labels):
+            save_statistic_value(OutputStatistic.COMPLETIONS, label, self._completions[:, index].tolist(), "val", statistics)
+            _save_moments(OutputStatistic.RESPONSE_TIME, label, self._moments, self._class_response_base + index, everywhere, statistics)
+
+        # time-averaged statistics, as WelfordTimeAveragedEstimator
+        avg = self._areas / observation_time[:, None]
+        std = np.sqrt(np.maximum(self._squared_areas / observation_time[:, None] - avg * avg, 0.0))
+        for labels, base, output_statistic in ((population_labels, 0, OutputStatistic.POPULATION),
+                                               (utilization_labels, self._utilization_base, OutputStatistic.UTILIZATION)):
+            for index, label in enumerate(labels):
+                variable = base + index
+                for variant, values in (("avg", avg), ("std", std), ("max", self._max), ("min", self._min)):
+                    save_statistic_value(output_statistic, label, values[:, variable].tolist(), variant, statistics)
+
+        save_statistic_value(OutputStatistic.SCORE, _GLOBAL, self._arrival_score.tolist(), "lambda", statistics)
+        for index, label in enumerate(pair_labels):
+            save_statistic_value(OutputStatistic.SCORE, label, self._class_scores[:, index].tolist(), "rate", statistics)
+        node_scores = (self._rates * self._class_scores.reshape(self.replicas, self._n_nodes, self._n_classes)).sum(axis=2)
+        for node in network.nodes:
+            save_statistic_value(OutputStatistic.SCORE, node.id, node_scores[:, node.index].tolist(), "speed", statistics)
+        return {key: values for key, values in statistics.items() if len(values) > 0}
+
+def _save_moments(output_statistic: OutputStatistic, label: str, moments: _Moments, index: int, replicas: np.ndarray, statistics: dict):
+    """
+    Saves the mean, standard deviation and bounds of a label for the given replicas (mask), as save_statistics.
+    """
+    for variant, values in (("avg", moments.avg), ("std", moments.std), ("max", moments.max), ("min", moments.min)):
+        save_statistic_value(output_statistic, label, values[replicas, index].tolist(), variant, statistics)
+
+def create_lockstep_simulation(experiment, lambda_val, replicas: int, num_arrivals: int, seed: int) -> LockstepSimulation:
+    network = SimulationFactory().create_network(experiment, lambda_val)
+    return LockstepSimulation(experiment['simulation_study'], network, seed, replicas, num_arrivals)
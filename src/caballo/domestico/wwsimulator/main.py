@@ -1,21 +1,45 @@
+import copy
+import csv
 import json
+import math
 import os
+import sys
 
-from caballo.domestico.wwsimulator import SIMULATION_FACTORY_CONFIG_PATH, STATISTICS_DIR, streams
+from caballo.domestico.wwsimulator import RESULTS_DB_PATH, SIMULATION_FACTORY_CONFIG_PATH, STATISTICS_DIR, streams
+from caballo.domestico.wwsimulator.analytic import closed_mva
 from caballo.domestico.wwsimulator.batchmeans import (BatchMeansInterceptor,
                                                       BatchMeansSimulation)
+from caballo.domestico.wwsimulator.controlvariates import ControlVariates, analytic_controls
 from caballo.domestico.wwsimulator.events import (ArrivalEvent, DepartureEvent,
                                                   Event, JobMovementEvent)
 from caballo.domestico.wwsimulator.handlers import (
     ArrivalsGeneratorSubscriber, HandleFirstArrival)
+from caballo.domestico.wwsimulator.lindley import create_lindley_simulation
+from caballo.domestico.wwsimulator.lockstep import create_lockstep_simulation
+from caballo.domestico.wwsimulator.metamodel import Metamodel
 from caballo.domestico.wwsimulator.output import (BusytimeEstimator, CompletionsEstimator,
+                                                  InterarrivalTimeEstimator,
+                                                  LossEstimator,
                                                   ObservationTimeEstimator,
                                                   PopulationEstimator,
                                                   ResponseTimeEstimator,
+                                                  ScoreEstimator,
+                                                  ServiceTimeEstimator,
+                                                  TimeBucketEstimator,
+                                                  TimeoutEstimator,
+                                                  UtilizationEstimator,
                                                   )
-from caballo.domestico.wwsimulator.replication import ReplicatedSimulation
+from caballo.domestico.wwsimulator.regenerative import create_regenerative_simulation
+from caballo.domestico.wwsimulator.replication import ReplicatedSimulation, paired_difference
+from caballo.domestico.wwsimulator.results import ResultStore, run_key
+from caballo.domestico.wwsimulator.sensitivity import sensitivities
 from caballo.domestico.wwsimulator.transient import TransientSimulation
 from caballo.domestico.wwsimulator.simulation import Simulation, SimulationFactory
+from caballo.domestico.wwsimulator.statistics import IntervalEstimator
+from caballo.domestico.wwsimulator.trace import read_trace, record_trace
+from caballo.domestico.wwsimulator.traceanalysis import TraceAnalysis
+from caballo.domestico.wwsimulator.sweep import SweepPoint, find_max_lambda, saturation_lambda
+from caballo.domestico.wwsimulator.warmup import WarmupDetector
 from pdsteele.des.rngs import getSeed
 from pdsteele.des.rngs import plantSeeds, selectStream
 
@@ -35,12 +59,22 @@ def subscribe_estimators(simulation):
     simulation.scheduler.subscribe(DepartureEvent, CompletionsEstimator())
     simulation.scheduler.subscribe(JobMovementEvent, ResponseTimeEstimator())
     simulation.scheduler.subscribe(JobMovementEvent, PopulationEstimator())
-    # simulation.scheduler.subscribe(ArrivalEvent, InterarrivalTimeEstimator())
-    # simulation.scheduler.subscribe(DepartureEvent, ServiceTimeEstimator())
+    simulation.scheduler.subscribe(JobMovementEvent, UtilizationEstimator())
+    # controls with known mean for the control variates
+    simulation.scheduler.subscribe(ArrivalEvent, InterarrivalTimeEstimator())
+    simulation.scheduler.subscribe(DepartureEvent, ServiceTimeEstimator())
+    # likelihood ratio scores for the sensitivities to the rates
+    simulation.scheduler.subscribe(ArrivalEvent, ScoreEstimator())
+    # losses of the nodes with finite buffers
+    if any(node.queue.max_jobs is not None for node in simulation.network.nodes):
+        simulation.scheduler.subscribe(ArrivalEvent, LossEstimator())
+    # goodput and wasted work under client deadlines
+    if simulation.network.timeouts is not None:
+        simulation.scheduler.subscribe(Event, TimeoutEstimator())
      
 
 def get_output_file_path(simulation: Simulation):
-    simulation_map = {'BatchMeansSimulation': 'BM_S', 'ReplicatedSimulation': 'Rep_S', 'TransientSimulation': 'Tr_S'}
+    simulation_map = {'BatchMeansSimulation': 'BM_S', 'ReplicatedSimulation': 'Rep_S', 'RegenerativeSimulation': 'Reg_S', 'TransientSimulation': 'Tr_S', 'LockstepSimulation': 'Ls_S', 'LindleySimulation': 'Li_S'}
     statistic_path = os.path.join(STATISTICS_DIR, simulation.study, type(simulation).__name__)
     simulation_name = simulation_map[type(simulation).__name__]
     if not os.path.exists(statistic_path):
@@ -48,10 +82,96 @@ def get_output_file_path(simulation: Simulation):
     output_file_path = os.path.join(statistic_path, "{}_{}_lambda={}_{}.csv".format(simulation.study, simulation_name, simulation.network.job_arrival_param[0], simulation.initial_seed))
     return output_file_path
 
-def bm_main(experiment, lambda_val, seed):
+def get_summary_file_path(simulation: Simulation):
+    # kept apart from the per-iteration outputs, which are merged by statistics/sofa_preprocess.py
+    output_file_path = get_output_file_path(simulation)
+    summary_path = os.path.join(os.path.dirname(output_file_path), "summary")
+    if not os.path.exists(summary_path):
+        os.makedirs(summary_path)
+    return os.path.join(summary_path, os.path.basename(output_file_path))
+
+def get_trace_file_path(simulation: Simulation, key: str):
+    # named by the key of the run, so that a trace of another configuration or simulator version is not reused
+    output_file_path = get_output_file_path(simulation)
+    trace_path = os.path.join(os.path.dirname(output_file_path), "traces")
+    if not os.path.exists(trace_path):
+        os.makedirs(trace_path)
+    return os.path.join(trace_path, os.path.basename(output_file_path).replace(".csv", f"_{key}.trace"))
+
+def report_iterations(total, statistic="SYSTEM-response_time-avg", msg=""):
+    """
+    Returns a callback reporting the progress of the iterations of a simulation
+    with the current confidence interval of a statistic.
+    """
+    def report(simulation: Simulation):
+        interval = simulation.intervals.get(statistic)
+        if interval is None:
+            return
+        print_progress(interval.n_samples, total, msg + f"{statistic} = {interval.avg:.4f} +/- {interval.half_width():.4f} ")
+    return report
+
+def run_cached(simulation: Simulation, experiment, lambda_val, seed, mode, store: ResultStore):
+    """
+    Runs the simulation only if the result store has no result for the same experiment configuration,
+    lambda, seed, run mode and simulator version. The statistics and their confidence intervals
+    are then printed to the output files.
+    """
+    key = run_key(experiment, lambda_val, seed, mode)
+    if store.contains(key):
+        simulation.set_statistics(store.load(key))
+    else:
+        simulation.run()
+        store.save(key, experiment, lambda_val, seed, mode, simulation.statistics)
+    simulation.print_statistics(get_output_file_path(simulation))
+    simulation.print_summary(get_summary_file_path(simulation))
+    print_control_variates(simulation)
+    print_sensitivities(simulation)
+
+def print_control_variates(simulation: Simulation):
+    """
+    Prints the response time and population estimates corrected with the control variates
+    of the analytical model next to the summary, if the network is exponential.
+    """
+    known_means = analytic_controls(simulation.network)
+    estimates = ControlVariates(known_means, simulation.confidence).summary(simulation) if known_means else []
+    if not estimates:
+        return
+    output_file_path = get_summary_file_path(simulation).replace("_lambda=", "_cv_lambda=")
+    with open(output_file_path, "w") as output_file:
+        fieldnames = ["statistic", "mean", "half_width", "iterations", "confidence", "variance_reduction", "controls"]
+        writer = csv.DictWriter(output_file, fieldnames=fieldnames)
+        writer.writeheader()
+        for estimate in estimates:
+            writer.writerow({"statistic": estimate.statistic, "mean": estimate.avg, "half_width": estimate.half_width,
+                             "iterations": estimate.n_samples, "confidence": simulation.confidence,
+                             "variance_reduction": estimate.variance_reduction, "controls": " ".join(estimate.controls)})
+
+def print_sensitivities(simulation: Simulation):
+    """
+    Prints the derivatives of the response times and populations with respect to the arrival
+    and service rates, estimated by likelihood ratio over the iterations, next to the summary.
+    """
+    results = sensitivities(simulation)
+    if not results:
+        return
+    output_file_path = get_summary_file_path(simulation).replace("_lambda=", "_sensitivity_lambda=")
+    with open(output_file_path, "w") as output_file:
+        fieldnames = ["statistic", "parameter", "derivative", "half_width", "iterations", "confidence"]
+        writer = csv.DictWriter(output_file, fieldnames=fieldnames)
+        writer.writeheader()
+        for result in results:
+            writer.writerow({"statistic": result.statistic, "parameter": result.parameter, "derivative": result.derivative,
+                             "half_width": result.interval.half_width(), "iterations": result.interval.n_samples,
+                             "confidence": result.interval.confidence})
+
+def bm_main(experiment, lambda_val, seed, store: ResultStore, warmup=False):
+    """
+    With warmup, batches start once MSER-5 detects the end of the warm-up period,
+    instead of from t=0, and arrivals continue until the last batch is completed.
+    """
     batch_size = experiment['batch_means']['batch_size']
     batch_num = experiment['batch_means']['batch_num']
-    num_arrivals = batch_size * batch_num
+    num_arrivals = sys.maxsize if warmup else batch_size * batch_num
     factory = SimulationFactory()
 
     simulation = factory.create(HandleFirstArrival(), experiment, lambda_val, seed=seed)
@@ -59,29 +179,172 @@ def bm_main(experiment, lambda_val, seed):
 
     simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(num_arrivals))
     subscribe_estimators(simulation)
+    detector = None
+    if warmup:
+        detector = WarmupDetector()
+        simulation.scheduler.subscribe(DepartureEvent, detector)
     
-    simulation.scheduler.intercept(DepartureEvent, BatchMeansInterceptor(batch_size, batch_num, bm_simulation))
+    simulation.scheduler.intercept(DepartureEvent, BatchMeansInterceptor(batch_size, batch_num, bm_simulation, detector))
+    bm_simulation.on_iteration = report_iterations(batch_num, msg=f"{experiment['simulation_study']} batch means: ")
 
-    output_file_path = get_output_file_path(bm_simulation)
-    if not os.path.isfile(output_file_path):
-        bm_simulation.run()
-        bm_simulation.print_statistics(output_file_path)
+    run_cached(bm_simulation, experiment, lambda_val, seed, "batch_means_mser" if warmup else "batch_means", store)
+    return bm_simulation
 
-def rep_main(experiment, lambda_val, seed):
+def rep_main(experiment, lambda_val, seed, store: ResultStore, crn=False, antithetic=False):
+    """
+    With crn, the seeds of the replicas only depend on the initial seed, so that
+    all the lambda values and configurations of a sweep share synchronized streams.
+    With antithetic, the replicas are run in antithetic pairs, so their number must be even.
+    """
     replicas = []
     factory = SimulationFactory()
     num_arrivals = experiment['batch_means']['batch_size']
     num_replicas = experiment['batch_means']['batch_num']
+    if antithetic and (num_replicas < 2 or num_replicas % 2 != 0):
+        raise ValueError(f"Antithetic replicas are run in pairs: batch_num must be an even number of replicas, at least 2, got {num_replicas}")
+    num_iterations = num_replicas // 2 if antithetic else num_replicas
     for _ in range(num_replicas):
         replica = factory.create(HandleFirstArrival(), experiment, lambda_val, seed=seed)
         replica.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(num_arrivals))
         subscribe_estimators(replica)
         replicas.append(replica)
+    seeds = streams.independent_seeds(seed, num_iterations) if crn else None
+    simulation = ReplicatedSimulation(replicas, seeds, antithetic)
+    simulation.on_iteration = report_iterations(num_iterations, msg=f"{experiment['simulation_study']} replicas: ")
+    mode = "replication" + ("_crn" if crn else "") + ("_antithetic" if antithetic else "")
+    run_cached(simulation, experiment, lambda_val, seed, mode, store)
+    return simulation
+
+def lockstep_main(experiment, lambda_val, seed, store: ResultStore):
+    """
+    Runs the replicas of rep_main all at once as NumPy arrays, for exponential networks.
+    """
+    num_arrivals = experiment['batch_means']['batch_size']
+    num_replicas = experiment['batch_means']['batch_num']
+    simulation = create_lockstep_simulation(experiment, lambda_val, num_replicas, num_arrivals, seed)
+    run_cached(simulation, experiment, lambda_val, seed, "replication_lockstep", store)
+    return simulation
+
+def lindley_main(experiment, lambda_val, seed, store: ResultStore, replication=False):
+    """
+    Runs bm_main (or rep_main with replication) by the Lindley recursion, for exponential networks of FIFO nodes.
+    """
+    batch_size = experiment['batch_means']['batch_size']
+    batch_num = experiment['batch_means']['batch_num']
+    if replication:
+        simulation = create_lindley_simulation(experiment, lambda_val, batch_size, seed, replicas=batch_num)
+        run_cached(simulation, experiment, lambda_val, seed, "replication_lindley", store)
+    else:
+        simulation = create_lindley_simulation(experiment, lambda_val, batch_size * batch_num, seed, batch_size=batch_size)
+        run_cached(simulation, experiment, lambda_val, seed, "batch_means_lindley", store)
+    return simulation
+
+def trace_main(experiment, lambda_val, seed):
+    """
+    Runs bm_main recording only the trace of the job movements, then estimates the statistics of the batches
+    offline from it. The trace is kept and reused, so new statistics do not require running the simulation again,
+    as long as the experiment configuration and the simulator version are the same (see results.run_key).
+    """
+    batch_size = experiment['batch_means']['batch_size']
+    batch_num = experiment['batch_means']['batch_num']
+    simulation = SimulationFactory().create(HandleFirstArrival(), experiment, lambda_val, seed=seed)
+    bm_simulation = BatchMeansSimulation(simulation)
+    trace_file_path = get_trace_file_path(bm_simulation, run_key(experiment, lambda_val, seed, "trace"))
+    if not os.path.exists(trace_file_path):
+        # recorded apart and moved in place once flushed at the end of the run, so an interrupted run leaves no trace to reuse
+        partial_file_path = trace_file_path + ".partial"
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(batch_size * batch_num))
+        record_trace(simulation, partial_file_path)
+        simulation.scheduler.intercept(DepartureEvent, BatchMeansInterceptor(batch_size, batch_num, bm_simulation))
+        bm_simulation.run()
+        os.replace(partial_file_path, trace_file_path)
+    analysis = TraceAnalysis(read_trace(trace_file_path), [node.id for node in simulation.network.nodes])
+    bm_simulation.set_statistics(analysis.statistics())
+    bm_simulation.print_statistics(get_output_file_path(bm_simulation).replace("_lambda=", "_trace_lambda="))
+    bm_simulation.print_summary(get_summary_file_path(bm_simulation).replace("_lambda=", "_trace_lambda="))
+    return bm_simulation
+
+def nonstationary_main(experiment, lambda_val, seed, store: ResultStore):
+    """
+    Runs rep_main over one period of the non stationary arrival profile (e.g. a day), with the statistics of
+    each of its time buckets ("buckets" of the profile, 24 by default) besides the ones of the whole period.
+    """
+    profile = experiment['arrival_distr']['profile']
+    period = profile['period']
+    n_buckets = profile.get('buckets', 24)
+    num_replicas = experiment['batch_means']['batch_num']
+    replicas = []
+    factory = SimulationFactory()
+    for _ in range(num_replicas):
+        replica = factory.create(HandleFirstArrival(), experiment, lambda_val, seed=seed)
+        # only the end of the period stops the arrivals of a replica
+        replica.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(math.inf, horizon=period))
+        subscribe_estimators(replica)
+        replica.scheduler.subscribe(JobMovementEvent, TimeBucketEstimator(period / n_buckets, n_buckets))
+        replicas.append(replica)
     simulation = ReplicatedSimulation(replicas)
-    output_file_path = get_output_file_path(simulation)
-    if not os.path.isfile(output_file_path):
-        simulation.run()
-        simulation.print_statistics(output_file_path)
+    simulation.on_iteration = report_iterations(num_replicas, msg=f"{experiment['simulation_study']} periods: ")
+    run_cached(simulation, experiment, lambda_val, seed, "replication_nonstationary", store)
+    return simulation
+
+def closed_main(experiment, n_users, seed, store: ResultStore):
+    """
+    Runs rep_main with the closed workload of n_users users of the experiment (arrival_distr of type closed)
+    and prints the closed MVA solution next to the summary, for the statistics both estimate.
+    """
+    simulation = rep_main(experiment, n_users, seed, store)
+    print_closed_mva(simulation)
+    return simulation
+
+def print_closed_mva(simulation: Simulation):
+    """
+    Prints the means of the closed MVA solution of the network next to the simulated ones,
+    the throughput of the system being estimated by the completions over the observation time of each iteration.
+    """
+    means = closed_mva(simulation.network)
+    intervals = dict(simulation.intervals)
+    completions = simulation.statistics.get("SYSTEM-completions-val")
+    observation_times = simulation.statistics.get("SYSTEM-observation_time-val")
+    if completions is not None and observation_times is not None:
+        throughput = IntervalEstimator(simulation.confidence)
+        throughput.update_many([float(n) / t for n, t in zip(completions, observation_times)])
+        intervals["SYSTEM-throughput-val"] = throughput
+    output_file_path = get_summary_file_path(simulation).replace("_lambda=", "_mva_lambda=")
+    with open(output_file_path, "w") as output_file:
+        fieldnames = ["statistic", "mva", "mean", "half_width", "iterations", "confidence"]
+        writer = csv.DictWriter(output_file, fieldnames=fieldnames)
+        writer.writeheader()
+        for statistic, mva in sorted(means.items()):
+            interval = intervals.get(statistic)
+            if interval is None:
+                continue
+            writer.writerow({"statistic": statistic, "mva": mva, "mean": interval.avg, "half_width": interval.half_width(),
+                             "iterations": interval.n_samples, "confidence": simulation.confidence})
+
+def crn_main(experiment, seed, store: ResultStore, statistic="SYSTEM-response_time-avg", antithetic=False):
+    """
+    Runs the lambda sweep of an experiment with common random numbers and prints
+    the confidence intervals of the differences of a statistic between adjacent lambda values.
+    """
+    lambda_values = experiment['arrival_distr']['params']
+    simulations = [rep_main(experiment, lambda_val, seed, store, crn=True, antithetic=antithetic) for lambda_val in lambda_values]
+    output_file_path = get_summary_file_path(simulations[0]).replace("_lambda=", "_differences_lambda=")
+    with open(output_file_path, "w") as output_file:
+        fieldnames = ["statistic", "lambda", "next_lambda", "difference", "half_width", "iterations", "confidence"]
+        writer = csv.DictWriter(output_file, fieldnames=fieldnames)
+        writer.writeheader()
+        for i in range(1, len(simulations)):
+            interval = paired_difference(simulations[i - 1], simulations[i], statistic)
+            writer.writerow({"statistic": statistic, "lambda": lambda_values[i - 1], "next_lambda": lambda_values[i],
+                             "difference": interval.avg, "half_width": interval.half_width(),
+                             "iterations": interval.n_samples, "confidence": interval.confidence})
+
+def regen_main(experiment, lambda_val, seed, store: ResultStore):
+    # as many regenerative cycles as batches
+    num_cycles = experiment['batch_means']['batch_num']
+    simulation = create_regenerative_simulation(experiment, lambda_val, num_cycles, seed)
+    simulation.on_iteration = report_iterations(num_cycles, msg=f"{experiment['simulation_study']} regenerative cycles: ")
+    run_cached(simulation, experiment, lambda_val, seed, "regenerative", store)
 
 def transient_main(experiment, lambda_val, seeds, replicas):
     factory = SimulationFactory()
@@ -94,12 +357,81 @@ def transient_main(experiment, lambda_val, seeds, replicas):
         replica = factory.create(HandleFirstArrival(), experiment, lambda_val, seed=seed)
         replica.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(num_arrivals))
         subscribe_estimators(replica)
+        # the warm-up cutoff is only recorded, the transient is kept
+        replica.scheduler.subscribe(DepartureEvent, WarmupDetector(reset=False))
         simulation = TransientSimulation(replica)
         output_file_path = get_output_file_path(simulation)
         simulation.run()
         simulation.print_sample_statistics(output_file_path)
 
 
+def slo_main(experiment, seed, store: ResultStore, target: float, statistic="SYSTEM-response_time-p99"):
+    """
+    Finds the maximum lambda for which a statistic stays below a target (e.g. an SLO on the p99 response time)
+    with batch means runs placed adaptively between the smallest lambda of the experiment and
+    the saturation of the bottleneck. Runs are cached, so repeated searches reuse them.
+    """
+    lambda_high = saturation_lambda(SimulationFactory().create_network(experiment, 1.0))
+    lambda_low = min(min(experiment['arrival_distr']['params']), lambda_high / 4)
+
+    def evaluate(lambda_val):
+        simulation = bm_main(experiment, lambda_val, seed, store)
+        if statistic not in simulation.intervals:
+            raise ValueError(f"{statistic} is not collected by the runs of {experiment['simulation_study']}")
+        interval = simulation.intervals[statistic]
+        if interval is None:
+            # not finite in some batch, e.g. near saturation: the target is not met
+            return SweepPoint(lambda_val, math.inf, 0.0)
+        return SweepPoint(lambda_val, interval.avg, interval.half_width())
+
+    result = find_max_lambda(evaluate, target, lambda_low, lambda_high)
+    print(f"{experiment['simulation_study']}: {statistic} < {target} up to lambda = {result.estimate}, "
+          f"with confidence up to {result.lower} (saturation at {lambda_high:.4f})")
+    return result
+
+def fleet_main(experiment, lambda_val, seed, store: ResultStore, node_name: str, fleet_sizes: list, target: float,
+               statistic="SYSTEM-response_time-avg"):
+    """
+    Sizes the pool of replicas of a node: runs rep_main with each number of replicas of the node (keeping its
+    dispatch policy) and returns the smallest one for which a statistic stays below a target with confidence,
+    None if there is none.
+    """
+    for n_replicas in sorted(fleet_sizes):
+        fleet = copy.deepcopy(experiment)
+        fleet['simulation_study'] = f"{experiment['simulation_study']}_{node_name}x{n_replicas}"
+        for node in fleet['nodes']:
+            if node['name'] == node_name:
+                node['replicas'] = n_replicas
+        interval = rep_main(fleet, lambda_val, seed, store).intervals[statistic]
+        if interval is not None and interval.avg + interval.half_width() < target:
+            print(f"{experiment['simulation_study']}: {statistic} < {target} at lambda = {lambda_val} with {n_replicas} replicas of {node_name}")
+            return n_replicas
+    print(f"{experiment['simulation_study']}: {statistic} >= {target} at lambda = {lambda_val} with up to {max(fleet_sizes)} replicas of {node_name}")
+    return None
+
+def design_main(experiment, seed, store: ResultStore, runs: int, statistic="SYSTEM-response_time-avg"):
+    """
+    Adds batch means runs of an experiment at the lambda values where the metamodel of a statistic,
+    fitted to the stored runs of the study, is the most uncertain, and returns the metamodel fitted to all of them.
+    """
+    lambda_high = saturation_lambda(SimulationFactory().create_network(experiment, 1.0))
+    candidates = [(experiment, lambda_high * i / 20) for i in range(1, 20)]
+    for _ in range(runs):
+        metamodel = Metamodel(statistic)
+        metamodel.add_store(store, experiment['simulation_study'])
+        simulated = [run[3] for run in store.runs(experiment['simulation_study'], "batch_means")]
+        candidates = [candidate for candidate in candidates if candidate[1] not in simulated]
+        if len(candidates) == 0:
+            break
+        if metamodel.n_samples == 0:
+            _, lambda_val = candidates[len(candidates) // 2]
+        else:
+            _, lambda_val = metamodel.next_design_point(candidates)
+        bm_main(experiment, lambda_val, seed, store)
+    metamodel = Metamodel(statistic)
+    metamodel.add_store(store, experiment['simulation_study'])
+    return metamodel.fit()
+
 def print_progress(part, total, msg=""):
     if total == 0:
         return
@@ -122,6 +454,7 @@ if __name__ == "__main__":
     experiments = data['exps']
     progress_message = None
     batch_size = count_experiments(experiments)
+    store = ResultStore(RESULTS_DB_PATH)
     for experiment in experiments:
         simulation_study = experiment['simulation_study']
         lambda_values = experiment['arrival_distr']['params']
@@ -131,16 +464,35 @@ if __name__ == "__main__":
             print_progress(j, batch_size, progress_message)
 
             # batch mean
-            #bm_main(experiment, lambda_val, SEED)
+            #bm_main(experiment, lambda_val, SEED, store)
             # replicated
-            #rep_main(experiment, lambda_val, SEED)
+            #rep_main(experiment, lambda_val, SEED, store)
+            # replicated with common random numbers across the lambda sweep
+            #rep_main(experiment, lambda_val, SEED, store, crn=True)
+            # replicated in lockstep
+            #lockstep_main(experiment, lambda_val, SEED, store)
+            # FIFO networks by the Lindley recursion
+            #lindley_main(experiment, lambda_val, SEED, store)
+            # statistics estimated offline from the trace
+            #trace_main(experiment, lambda_val, SEED)
+            # replicas of a period of a non stationary arrival profile
+            #nonstationary_main(experiment, lambda_val, SEED, store)
+            # closed workload of lambda_val users, against closed MVA
+            #closed_main(experiment, lambda_val, SEED, store)
+            # regenerative
+            #regen_main(experiment, lambda_val, SEED, store)
             # transient
 
             transient_main(experiment, lambda_val, SEEDS, 5)
 
             j += 1
+        # maximum lambda with SYSTEM p99 response time under 10 s
+        #slo_main(experiment, SEED, store, 10.0)
+        # replicas of A for a SYSTEM response time under 5 s at the largest lambda
+        #fleet_main(experiment, max(lambda_values), SEED, store, "A", [1, 2, 4, 8], 5.0)
     print_progress(j, batch_size, progress_message) # last percentage update
     print("")  # newline
+    store.close()
 
 
 
@@ -0,0 +1,156 @@
+from math import isfinite, log
+
+import numpy as np
+
+from caballo.domestico.wwsimulator.analytic import open_mva
+from caballo.domestico.wwsimulator.results import ResultStore
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+
+
+def features(experiment: dict, lambda_val: float) -> list:
+    """
+    Coordinates of an experiment in the parameter space: lambda, the service rate of each (node, class)
+    and the queue discipline of each node (1 for processor sharing, 0 for FIFO).
+    """
+    coordinates = [float(lambda_val)]
+    for node in experiment['nodes']:
+        coordinates += [float(rate) for rate in node['server_distr']['params']]
+    for node in experiment['nodes']:
+        coordinates.append(1.0 if node['queue_discipline']['type'] == 'ps' else 0.0)
+    return coordinates
+
+class Metamodel():
+    """
+    Gaussian process surrogate of a statistic over the parameter space of a study,
+    fitted to the results of the simulation runs.
+    The prior mean is the open MVA value of the statistic when it has one (mean populations and response times):
+    the process models log(simulated / MVA), i.e. the error of MVA, which is small and smooth also
+    near saturation where the statistic diverges. Other statistics are modelled around their average.
+    The kernel is squared exponential, with length scales proportional to the ranges of the features,
+    whose common factor is chosen by maximum marginal likelihood.
+    > Rasmussen, Williams - Gaussian Processes for Machine Learning, MIT Press (2006), Chapter 2. Regression
+    """
+
+    SCALES = (0.25, 0.5, 1.0, 2.0, 4.0)
+    """
+    Candidate factors of the length scales.
+    """
+
+    def __init__(self, statistic: str = "SYSTEM-response_time-avg"):
+        self.statistic = statistic
+        self._x = []
+        self._y = []
+        self._noise = []
+        self._factory = SimulationFactory()
+        self._model = None
+
+    @property
+    def n_samples(self):
+        """
+        Number of simulation results the metamodel is fitted to.
+        """
+        return len(self._y)
+
+    def prior(self, experiment: dict, lambda_val: float) -> float:
+        """
+        Open MVA value of the statistic, None if MVA does not estimate it.
+        """
+        return open_mva(self._factory.create_network(experiment, lambda_val)).get(self.statistic)
+
+    def add(self, experiment: dict, lambda_val: float, values: list):
+        """
+        Adds a simulation result, given the values of the statistic over the iterations of the run.
+        All the results must have the same nodes and classes, i.e. the same features.
+        """
+        x = features(experiment, lambda_val)
+        if len(self._x) > 0 and len(x) != len(self._x[0]):
+            raise ValueError(f"The runs of study {experiment['simulation_study']} have {len(x)} features instead of {len(self._x[0])}: "
+                             "a metamodel is fitted to the runs of studies with the same nodes and classes")
+        values = [value for value in values if value is not None and isfinite(value)]
+        if len(values) == 0:
+            return
+        mean = float(np.mean(values))
+        # variance of the mean, from the iterations
+        variance = float(np.var(values, ddof=1)) / len(values) if len(values) > 1 else mean * mean
+        prior = self.prior(experiment, lambda_val)
+        if prior is not None:
+            if not isfinite(prior) or prior <= 0.0 or mean <= 0.0:
+                return
+            # delta method for the variance of the log
+            self._y.append(log(mean / prior))
+            self._noise.append(variance / (mean * mean))
+        else:
+            self._y.append(mean)
+            self._noise.append(variance)
+        self._x.append(x)
+        self._model = None
+
+    def add_store(self, store: ResultStore, study: str = None, mode: str = "batch_means"):
+        """
+        Adds the results of the runs in a result store, of a study or of all the studies if None
+        (which must then have the same nodes and classes, see add).
+        """
+        for key, _, _, lambda_val, _, experiment in store.runs(study, mode):
+            values = store.load(key).get(self.statistic)
+            if values is not None:
+                self.add(experiment, lambda_val, values)
+
+    def _kernel(self, a: np.ndarray, b: np.ndarray, length_scales: np.ndarray, signal_variance: float) -> np.ndarray:
+        diff = (a[:, None, :] - b[None, :, :]) / length_scales
+        return signal_variance * np.exp(-0.5 * np.sum(diff * diff, axis=2))
+
+    def fit(self):
+        x = np.asarray(self._x, dtype=float)
+        y = np.asarray(self._y, dtype=float)
+        noise = np.asarray(self._noise, dtype=float)
+        if len(y) == 0:
+            raise ValueError(f"No results to fit the metamodel of {self.statistic}")
+        mean = float(y.mean())
+        residuals = y - mean
+        signal_variance = max(float(residuals.var()), float(noise.mean()), 1e-12)
+        ranges = x.max(axis=0) - x.min(axis=0)
+        # constant features do not matter
+        ranges[ranges == 0.0] = 1.0
+
+        best = None
+        for scale in Metamodel.SCALES:
+            length_scales = ranges * scale
+            covariance = self._kernel(x, x, length_scales, signal_variance) + np.diag(noise + 1e-10 * signal_variance)
+            cholesky = np.linalg.cholesky(covariance)
+            alpha = np.linalg.solve(cholesky.T, np.linalg.solve(cholesky, residuals))
+            log_likelihood = -0.5 * residuals @ alpha - np.log(np.diag(cholesky)).sum()
+            if best is None or log_likelihood > best[0]:
+                best = (log_likelihood, length_scales, cholesky, alpha)
+        _, length_scales, cholesky, alpha = best
+        self._model = (x, mean, signal_variance, length_scales, cholesky, alpha)
+        return self
+
+    def _predict(self, points: list):
+        if self._model is None:
+            self.fit()
+        x, mean, signal_variance, length_scales, cholesky, alpha = self._model
+        cross = self._kernel(np.asarray(points, dtype=float), x, length_scales, signal_variance)
+        v = np.linalg.solve(cholesky, cross.T)
+        variance = np.maximum(signal_variance - np.sum(v * v, axis=0), 0.0)
+        return mean + cross @ alpha, np.sqrt(variance)
+
+    def predict(self, experiment: dict, lambda_val: float):
+        """
+        Returns the predicted mean of the statistic and its standard error.
+        """
+        (y,), (std,) = self._predict([features(experiment, lambda_val)])
+        prior = self.prior(experiment, lambda_val)
+        if prior is None:
+            return float(y), float(std)
+        if not isfinite(prior):
+            return prior, prior
+        value = prior * float(np.exp(y))
+        return value, value * float(std)
+
+    def next_design_point(self, candidates: list):
+        """
+        Returns the candidate (experiment, lambda) where the metamodel is the most uncertain, relative to
+        the predicted value when it models the error of MVA, i.e. the next point to simulate.
+        """
+        _, std = self._predict([features(experiment, lambda_val) for experiment, lambda_val in candidates])
+        return candidates[int(np.argmax(std))]
@@ -1,8 +1,8 @@
+import heapq
 from abc import ABC, abstractmethod
 from copy import copy
-from caballo.domestico.wwsimulator.streams import EXTERNAL_ARRIVALS, SERVICES_BASE
-from pdsteele.des import rngs
-import pdsteele.des.rvgs as des
+from caballo.domestico.wwsimulator import streams
+from caballo.domestico.wwsimulator.streams import EXTERNAL_ARRIVALS, ROUTING, SERVICES_BASE
 error = 'index out of range'
 distr_error = 'distribution not supported'
 class Job():
@@ -13,6 +13,28 @@ class Job():
         self.class_id = class_id
         self.job_id = job_id
         self.service_time = None
+        self.service_demand = None
+        """
+        Service time of the job at the current node at the full rate of the server,
+        i.e. not stretched by processor sharing.
+        """
+        self.remaining_work = None
+        """
+        Service demand of the job at the current node not served yet, tracked by processor sharing.
+        """
+        self.demand = None
+        """
+        Service demand of the job at the node it is arriving to when given by the workload
+        (e.g. a replayed log) instead of drawn, consumed by the arrival.
+        """
+        self.user = None
+        """
+        User of a closed workload that sent the job, None for the jobs of an open workload.
+        """
+        self.attempt = None
+        """
+        Attempt of the client request with a deadline the job is, see timeouts.Attempt, None if the job has no deadline.
+        """
 
     def class_id(self):
         return self.class_id
@@ -26,20 +48,20 @@ class Job():
 
 class State():
     """
-    Classe che definisce lo stato del sistema con una matrice 3x3 
+    Classe che definisce lo stato del sistema con una matrice NxK 
     dove ogni riga rappresenta un nodo e ogni colonna una classe di job
     """
-    def __init__(self, matrix: list, n_nodes: int = 3, n_classes: int = 3):
+    def __init__(self, matrix: list):
         self.matrix = matrix
-        self.n_nodes = n_nodes
-        self.n_classes = n_classes
+        self.n_nodes = len(matrix)
+        self.n_classes = len(matrix[0]) if self.n_nodes > 0 else 0
     
     def update(self, node_class: tuple, increment: bool):
         """
         Metodo per incrementare o decrementare lo stato di un nodo
         """
 
-        if node_class[1] > self.n_classes or node_class[0] > self.n_classes:
+        if node_class[0] >= self.n_nodes or node_class[1] >= self.n_classes:
             raise ValueError(error)
         
         self.matrix[node_class[0]][node_class[1]] += 1 if increment else -1
@@ -60,13 +82,12 @@ class State():
         """
         Metodo per ritornare il numero totale di job in una certa classe nel sistema
         """
-        if class_type > 3:
+        if class_type >= self.n_classes:
             raise ValueError(error)
         return sum([self.matrix[i][class_type] for i in range(self.n_nodes)])
 
     def get_num_jobs_in_node(self, node):
-        node_index = node.node_map(node.id)
-        num_jobs_in_node = sum(self.get_node_state(node_index))
+        num_jobs_in_node = sum(self.get_node_state(node.index))
         return num_jobs_in_node
     
 class Server():
@@ -77,24 +98,44 @@ class Server():
     capacity: capacità del server
     server_distribution: tupla con distribuzione di servizio e parametro della distribuzione
     """
-    def __init__(self, capacity: int, server_distribution: str, prng_stream: int):
+    def __init__(self, capacity: int, server_distribution: str, prng_stream: int, distributions: list = None):
         self.capacity = capacity
         self.server_distribution = server_distribution
         self.prng_stream = prng_stream
+        self.distributions = distributions
+        """
+        Distribution of the service demand of each job class (None for the classes without service),
+        see distributions.py
+        """
     
-    def get_service(self, params):
-        rngs.selectStream(self.prng_stream)
-        if self.server_distribution == 'exp':
-            return des.Exponential(1.0 / params[0])
-        else:
+    def get_service(self, job_class: int) -> float:
+        """
+        Draws the service demand of a job of the class, i.e. its service time at the full rate of the server.
+        """
+        if self.distributions is None or self.distributions[job_class] is None:
             raise ValueError(distr_error)
+        return self.distributions[job_class].sample(self.prng_stream)
 
 
 class Queue(ABC):
-    def __init__(self, capacity: int, queue_params:list):
+    def __init__(self, capacity: int, queue_params:list, servers: int = 1):
+        if servers < 1 or (capacity is not None and capacity < 0):
+            raise ValueError("A node has at least one server and a non negative queue capacity")
         self.id = id
         self.capacity = capacity
+        """
+        Number of jobs that can wait for the servers, None if unlimited.
+        """
         self.queue_params = queue_params
+        self.servers = servers
+        """
+        Number of servers (or cores) of the node, from the capacity of its server.
+        """
+        self.max_jobs = None if capacity is None else servers + capacity
+        """
+        Maximum number of jobs at the node, waiting or in service, None if unlimited:
+        the arrivals finding the node full are dropped.
+        """
     
     @abstractmethod
     def get_queue_time(self, job: Job, arrival_time: float):
@@ -107,24 +148,46 @@ class Queue(ABC):
     
 
 class FIFOQueue(Queue):
-    def __init__(self, capacity: int, queue_params:list):
-        super().__init__(capacity, queue_params)
-        self.last_departure = 0
+    """
+    Jobs are served in order of arrival by the first server that becomes free.
+    """
+    def __init__(self, capacity: int, queue_params:list, servers: int = 1):
+        super().__init__(capacity, queue_params, servers)
+        self.free_times = [0.0] * servers
+        """
+        Heap of the times the servers become free, i.e. of the last departure of each server.
+        """
         self.queue_time = 0
     
+    @property
+    def last_departure(self):
+        """
+        Time of the last scheduled departure.
+        """
+        return max(self.free_times)
+
     def get_queue_time(self, job: Job, arrival_time: float):
-        diff = self.last_departure - arrival_time
+        diff = self.free_times[0] - arrival_time
         # controllare se diff è positivo
         self.queue_time = diff if diff > 0 else 0.0
         return self.queue_time
 
     def register_last_departure(self, job: Job, time: float):
-        self.last_departure = time
+        # the job is served by the first server that becomes free
+        heapq.heapreplace(self.free_times, time)
 
     
 class PSQueue(Queue):
-    def __init__(self, capacity: int, queue_params:list):
-        super().__init__(capacity, queue_params)
+    """
+    The jobs at the node share its servers (e.g. the cores of a CPU) equally: each job is served
+    at the full rate of a server while they are at most as many as the servers.
+    """
+    def __init__(self, capacity: int, queue_params:list, servers: int = 1):
+        super().__init__(capacity, queue_params, servers)
+        self.last_update = 0.0
+        """
+        Time of the last change of the number of jobs sharing the server.
+        """
     
     def get_queue_time(self, job: Job, arrival_time: float):
         return 0.0
@@ -132,6 +195,12 @@ class PSQueue(Queue):
     def register_last_departure(self, job: Job, time: float):
         pass
 
+    def stretch(self, num_jobs: int) -> float:
+        """
+        Time taken to serve a unit of work of a job sharing the servers with num_jobs jobs (itself included).
+        """
+        return max(num_jobs / self.servers, 1.0)
+
 class Node():
     def __init__(self, id: str, service_rate: list, server:Server, queue:Queue):
         self.id = id
@@ -142,28 +211,173 @@ class Node():
         """
         Scheduled departure events by job id in service at this node
         """
+        self.index = None
+        """
+        Position of the node in the network, assigned when the network is built.
+        """
+        self.group = None
+        """
+        Position of the node in the routing table, i.e. of its group of replicas (the node itself if not replicated),
+        assigned when the network is built.
+        """
+        self.dispatcher = None
+        """
+        Dispatcher of the replicas of the group, None if the node is not replicated, see dispatch.py
+        """
+        self.replica = 0
+        """
+        Position of the node among the replicas of its group.
+        """
 
     def get_service_class_rate(self, class_type):
-        if class_type > 3:
+        if class_type >= len(self.service_rate):
             raise ValueError(error)
         
         return self.service_rate[class_type]
-    
-    def node_map(self, node_id):
-        node_map = {'A': 0, 'B': 1, 'P': 2}
-        if node_id not in node_map:
+
+class RoutingTable():
+    """
+    Routing matrix with class switching, compiled into integer-indexed lookup arrays.
+    A job of class r leaving node i goes to node j as class s with probability p[(i, r), (j, s)]
+    and leaves the system with the residual probability.
+    The pair (node index, class) is flattened into the row index node * n_classes + class.
+    """
+    EXIT = -1
+    """
+    Destination node index of a job leaving the system.
+    """
+
+    def __init__(self, n_nodes: int, n_classes: int, entries: list, rows: dict):
+        """
+        entries: list of (node index, class, probability) for external arrivals
+        rows: dict (node index, class) -> list of (node index, class, probability)
+        """
+        self.n_nodes = n_nodes
+        self.n_classes = n_classes
+        self.next_node = [RoutingTable.EXIT] * (n_nodes * n_classes)
+        """
+        Destination node by row for deterministic routes.
+        """
+        self.next_class = [RoutingTable.EXIT] * (n_nodes * n_classes)
+        """
+        Destination class by row for deterministic routes.
+        """
+        self._choices = [None] * (n_nodes * n_classes)
+        """
+        Cumulative distribution of the destinations by row, None for deterministic routes.
+        """
+        for (node_index, class_id), destinations in rows.items():
+            row = self.row(node_index, class_id)
+            (self.next_node[row], self.next_class[row]), self._choices[row] = self._compile(destinations, exit_allowed=True)
+        (self.entry_node, self.entry_class), self._entry_choices = self._compile(entries, exit_allowed=False)
+
+    def row(self, node_index: int, class_id: int):
+        if node_index >= self.n_nodes or class_id >= self.n_classes:
             raise ValueError(error)
-        return node_map[node_id]
+        return node_index * self.n_classes + class_id
+
+    def _compile(self, destinations: list, exit_allowed: bool):
+        """
+        Returns the destination of a deterministic route, or the cumulative distribution
+        of the destinations if the route is random.
+        """
+        total = sum(p for _, _, p in destinations)
+        if total > 1.0 + 1e-9 or (not exit_allowed and abs(total - 1.0) > 1e-9):
+            raise ValueError(f"Routing probabilities must sum to {'at most ' if exit_allowed else ''}1, got {total}")
+        for node_index, class_id, _ in destinations:
+            self.row(node_index, class_id)
+        
+        destinations = [d for d in destinations if d[2] > 0.0]
+        if total < 1.0 - 1e-9:
+            destinations.append((RoutingTable.EXIT, RoutingTable.EXIT, 1.0 - total))
+        
+        # deterministic routes are resolved with a plain lookup, without consuming random numbers
+        if len(destinations) == 1:
+            node_index, class_id, _ = destinations[0]
+            return (node_index, class_id), None
+        
+        cumulative = []
+        acc = 0.0
+        for node_index, class_id, p in destinations:
+            acc += p
+            cumulative.append((acc, node_index, class_id))
+        return (RoutingTable.EXIT, RoutingTable.EXIT), cumulative
+    
+    def _draw(self, cumulative: list):
+        u = streams.random(ROUTING) * cumulative[-1][0]
+        for acc, node_index, class_id in cumulative:
+            if u < acc:
+                return node_index, class_id
+        return cumulative[-1][1], cumulative[-1][2]
+
+    def route(self, node_index: int, class_id: int):
+        """
+        Returns the (node index, class) the job goes to after leaving the node,
+        or (EXIT, EXIT) if it leaves the system.
+        """
+        row = node_index * self.n_classes + class_id
+        cumulative = self._choices[row]
+        if cumulative is None:
+            return self.next_node[row], self.next_class[row]
+        return self._draw(cumulative)
+
+    def _probabilities(self, node_index: int, class_id: int, cumulative: list):
+        if cumulative is None:
+            return [(node_index, class_id, 1.0)]
+        destinations = []
+        previous = 0.0
+        for acc, next_node, next_class in cumulative:
+            destinations.append((next_node, next_class, acc - previous))
+            previous = acc
+        return destinations
+
+    def transitions(self, node_index: int, class_id: int):
+        """
+        Returns the destinations of a job leaving the node as a list of (node index, class, probability),
+        (EXIT, EXIT, probability) for leaving the system.
+        """
+        row = self.row(node_index, class_id)
+        return self._probabilities(self.next_node[row], self.next_class[row], self._choices[row])
+
+    def entries(self):
+        """
+        Returns the destinations of a job entering the system as a list of (node index, class, probability).
+        """
+        return self._probabilities(self.entry_node, self.entry_class, self._entry_choices)
+
+    def entry(self):
+        """
+        Returns the (node index, class) of a job entering the system.
+        """
+        if self._entry_choices is None:
+            return self.entry_node, self.entry_class
+        return self._draw(self._entry_choices)
 
 class Network():
     """
     A network is a collection of nodes that interact with each other to process jobs.
     """
-    def __init__(self, nodes: list, state: State, job_arrival_distr: str, job_arrival_param: list):
+    def __init__(self, nodes: list, state: State, job_arrival_distr: str, job_arrival_param: list, routing: RoutingTable = None,
+                 groups: list = None):
         self.nodes = nodes
         """
         list of nodes in the network
         """
+        self._nodes_by_id = {}
+        for index, node in enumerate(nodes):
+            node.index = index
+            self._nodes_by_id[node.id] = node
+        self.groups = groups if groups is not None else [[node] for node in nodes]
+        """
+        Nodes of each node of the routing table: its replicas, or the node itself if not replicated.
+        """
+        for group_index, group in enumerate(self.groups):
+            for node in group:
+                node.group = group_index
+        self.routing = routing
+        """
+        Compiled routing matrix of the network
+        """
         self.state = state
         """
         State of the network during a simulation run
@@ -176,26 +390,64 @@ class Network():
         """
         Parameters of the job arrival distribution
         """
+        self.arrival_source = None
+        """
+        Source of the external arrivals of a trace or nonstationary distribution, e.g. workload.TraceArrivals
+        """
+        self.arrival_distribution = None
+        """
+        Distribution of the interarrival times, see distributions.py
+        """
+        self.population = None
+        """
+        Users of a closed workload sending the jobs instead of the external arrivals, see closed.ClosedPopulation
+        """
+        self.timeouts = None
+        """
+        Deadlines of the clients of the jobs and retries of the requests timed out, see timeouts.ClientTimeouts
+        """
 
     def get_arrivals(self):
-        rngs.selectStream(EXTERNAL_ARRIVALS)
-        if self.job_arrival_distr == 'poisson':
-            return des.Exponential(1.0 / self.job_arrival_param[0])
+        """
+        Returns the time to the next external arrival, None if there are no more.
+        """
+        if self.arrival_source is not None:
+            return self.arrival_source.next_interarrival()
+        elif self.arrival_distribution is not None:
+            return self.arrival_distribution.sample(EXTERNAL_ARRIVALS)
+        elif self.job_arrival_distr == 'poisson':
+            return streams.exponential(EXTERNAL_ARRIVALS, 1.0 / self.job_arrival_param[0])
         else:
             raise ValueError(distr_error)
+
+    def get_entry(self):
+        """
+        Returns the (node index in the routing table, class, service demand or None) of the next job entering the system.
+        """
+        if self.job_arrival_distr == 'trace':
+            return self.arrival_source.entry()
+        entry_node, entry_class = self.routing.entry()
+        return entry_node, entry_class, None
         
+    def dispatch(self, group_index: int) -> Node:
+        """
+        Returns the node a job routed to the given node of the routing table is sent to:
+        the node itself, or the replica chosen by the dispatcher of its group.
+        """
+        group = self.groups[group_index]
+        if len(group) == 1:
+            return group[0]
+        return group[0].dispatcher.select()
+
     def get_node(self, node_id):
-        for node in self.nodes:
-            if node.id == node_id:
-                return node
-        return None
+        return self._nodes_by_id.get(node_id)
 
     def get_state(self):
         return self.state.get()
 
     def get_node_state(self, node_id):
         node = self.get_node(node_id)
-        return self.state.get_node_state(node.id)
+        return self.state.get_node_state(node.index)
 
     def get_total_class(self, class_type):
         return self.state.get_total_class(class_type)
\ No newline at end of file
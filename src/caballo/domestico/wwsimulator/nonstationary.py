@@ -0,0 +1,131 @@
+import numpy as np
+from scipy.interpolate import CubicSpline
+
+from caballo.domestico.wwsimulator import streams
+from caballo.domestico.wwsimulator.streams import EXTERNAL_ARRIVALS
+
+class ArrivalProfile():
+    """
+    Periodic arrival rate lambda(t) (e.g. over a day) of the given mean rate, shaped by the relative rates
+    at the given times of the period: piecewise constant (each rate holds until the next time) or a periodic
+    cubic spline through them (clamped at 0).
+    The rate is bounded by a piecewise constant majorant over the pieces between the times: lambda itself
+    when piecewise constant, the maximum of the spline over each piece otherwise.
+    """
+
+    def __init__(self, times: list, rates: list, period: float, mean_rate: float, interpolation: str = "constant"):
+        times = np.asarray(times, dtype=float)
+        rates = np.asarray(rates, dtype=float)
+        if len(times) == 0 or len(times) != len(rates) or times[0] != 0.0 or np.any(np.diff(times) <= 0) or times[-1] >= period:
+            raise ValueError("The profile times must increase from 0 within the period, with a rate each")
+        if np.any(rates < 0) or mean_rate <= 0:
+            raise ValueError("The arrival rates must be non negative with a positive mean")
+        self.period = float(period)
+        self.mean_rate = mean_rate
+        self.interpolation = interpolation
+        self.starts = times
+        """
+        Start of each piece within the period.
+        """
+        lengths = np.diff(np.append(times, period))
+        if interpolation == "constant":
+            self._spline = None
+            maxima = rates
+            shape_mean = float(np.dot(rates, lengths)) / self.period
+        elif interpolation == "spline":
+            self._spline = CubicSpline(np.append(times, period), np.append(rates, rates[0]), bc_type="periodic")
+            # the spline is cubic within a piece: its maximum is at an end or where its derivative vanishes
+            roots = self._spline.derivative().roots(extrapolate=False)
+            bounds = np.append(times, period)
+            maxima = []
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                points = np.concatenate(([start, end], roots[(roots > start) & (roots < end)]))
+                maxima.append(max(float(np.max(self._spline(points))), 0.0))
+            # mean of the clamped spline over a fine grid
+            grid = np.linspace(0.0, period, 64 * len(times) + 1)
+            values = np.maximum(self._spline(grid), 0.0)
+            shape_mean = float(np.mean(0.5 * (values[1:] + values[:-1])))
+        else:
+            raise ValueError(f"Unknown interpolation {interpolation} of the arrival rates")
+        if shape_mean <= 0:
+            raise ValueError("The arrival rates must not be all 0")
+        self._scale = mean_rate / shape_mean
+        self.majorant = np.asarray(maxima, dtype=float) * self._scale
+        """
+        Bound of the arrival rate over each piece.
+        """
+        self._cumulative = np.concatenate(([0.0], np.cumsum(self.majorant * lengths)))
+        """
+        Integral of the majorant from the start of the period to the start of each piece, and over the period.
+        """
+
+    def rate(self, t: float) -> float:
+        """
+        Arrival rate at time t.
+        """
+        if self._spline is None:
+            return float(self.majorant[self.piece(t)])
+        return max(float(self._spline(t % self.period)), 0.0) * self._scale
+
+    def piece(self, t: float) -> int:
+        """
+        Index of the piece of time t.
+        """
+        return int(np.searchsorted(self.starts, t % self.period, side="right") - 1)
+
+    def invert_majorant(self, t: float, work: float) -> float:
+        """
+        Returns the time t' such that the integral of the majorant from t to t' is work.
+        """
+        per_period = self._cumulative[-1]
+        k, tau = divmod(t, self.period)
+        piece = self.piece(tau)
+        # integral of the majorant from the start of the period of t to t'
+        target = self._cumulative[piece] + self.majorant[piece] * (tau - self.starts[piece]) + work
+        periods, rest = divmod(target, per_period)
+        piece = min(np.searchsorted(self._cumulative[:-1], rest, side="right") - 1, len(self.starts) - 1)
+        return (k + periods) * self.period + self.starts[piece] + (rest - self._cumulative[piece]) / self.majorant[piece]
+
+class NonStationaryArrivals():
+    """
+    Source of the external arrivals of a non homogeneous Poisson process with the rate of a profile, the first
+    arrival at time 0. The next arrival time inverts the integral of the majorant at an exponential amount of work
+    (time inversion, exact for a piecewise constant rate), and with a spline the candidate is accepted with
+    probability lambda(t) / majorant(t) (thinning), both drawing from the EXTERNAL_ARRIVALS stream.
+    """
+
+    def __init__(self, profile: ArrivalProfile):
+        self.profile = profile
+        self.time = 0.0
+        """
+        Time of the last arrival.
+        """
+        self.candidates = 0
+        """
+        Number of candidate arrivals, accepted or not.
+        """
+
+    def next_interarrival(self) -> float:
+        profile = self.profile
+        time = self.time
+        while True:
+            self.candidates += 1
+            time = profile.invert_majorant(time, -np.log(1.0 - streams.random(EXTERNAL_ARRIVALS)))
+            if profile.interpolation == "constant":
+                break
+            if streams.random(EXTERNAL_ARRIVALS) * profile.majorant[profile.piece(time)] < profile.rate(time):
+                break
+        interarrival = time - self.time
+        self.time = time
+        return interarrival
+
+def create_nonstationary_arrivals(arrival_distr: dict, mean_rate: float) -> NonStationaryArrivals:
+    """
+    Creates the arrival source of an experiment with arrival_distr of type nonstationary, e.g.
+    {"type": "nonstationary", "params": [1.0], "profile": {"times": [0, 28800, 64800], "rates": [0.2, 1.5, 0.6],
+     "period": 86400, "interpolation": "constant"}}
+    where params are the mean rates of the sweep and the rates of the profile are relative.
+    """
+    profile = arrival_distr['profile']
+    return NonStationaryArrivals(ArrivalProfile(profile['times'], profile['rates'], profile['period'], mean_rate,
+                                                profile.get('interpolation', "constant")))
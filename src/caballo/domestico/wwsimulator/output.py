@@ -1,10 +1,11 @@
+from abc import abstractmethod
 from enum import Enum
 
 from caballo.domestico.wwsimulator.events import (ArrivalEvent, DepartureEvent,
                                                   Event, EventHandler,
-                                                  JobMovementEvent)
+                                                  JobMovementEvent, TimeoutEvent)
 from caballo.domestico.wwsimulator.model import Job
-from caballo.domestico.wwsimulator.statistics import WelfordEstimator
+from caballo.domestico.wwsimulator.statistics import HistogramQuantileEstimator, WelfordEstimator, WelfordTimeAveragedEstimator
 
 _GLOBAL = "SYSTEM"
 
@@ -16,6 +17,16 @@ class OutputStatistic(Enum):
     OBSERVATION_TIME = "observation_time"
     COMPLETIONS = "completions"
     BUSY_TIME = "busytime"
+    UTILIZATION = "utilization"
+    THROUGHPUT = "throughput"
+    WARMUP = "warmup"
+    SCORE = "score"
+    LOSS_RATE = "loss_rate"
+    BLOCKING = "blocking"
+    GOODPUT = "goodput"
+    TIMEOUT = "timeout"
+    ABANDONED = "abandoned"
+    WASTED_WORK = "wasted_work"
 
     def for_node_variant(self, node: str, variant: str):
         return f"{node}-{self.value}-{variant}"
@@ -33,6 +44,25 @@ def save_statistics(output_statistic: OutputStatistic, node_id: str, estimator:
 
 def save_statistic_value(output_statistic: OutputStatistic, node_id: str, value: float, variant: str, statistics: dict):
     statistics[output_statistic.for_node_variant(node_id, variant)] = value
+
+def class_label(node_id: str, class_id: int):
+    """
+    Label of the statistics of a job class at a node (or SYSTEM), e.g. A.1 for class 1 at node A.
+    """
+    return f"{node_id}.{class_id}"
+
+def class_labels(network) -> list:
+    """
+    Labels of the (node, class) pairs of a network, indexed by node index * number of classes + class.
+    """
+    return [class_label(node.id, class_id) for node in network.nodes for class_id in range(network.state.n_classes)]
+
+def quantile_variant(q: float):
+    return "p{0:g}".format(q * 100)
+
+def save_quantile_statistics(output_statistic: OutputStatistic, node_id: str, estimator: HistogramQuantileEstimator, statistics: dict):
+    for q in estimator.quantiles:
+        save_statistic_value(output_statistic, node_id, estimator.quantile(q), quantile_variant(q), statistics)
 # new
 def save_sample_statistics(output_statistic: OutputStatistic, node_id: str, time, estimator: WelfordEstimator, sample: dict):
     save_statistic_sample_value(output_statistic, node_id, estimator.avg, time, "avg", sample)
@@ -52,10 +82,25 @@ class CompletionsEstimator(EventHandler):
         super().__init__()
         self._states = {}
         self._states[_GLOBAL] = CompletionsEstimator.State()
+        self._class_labels = None
+        self._class_completions = None
+        """
+        Completions by (node, class), saved when flushed.
+        """
     
+    def flush(self, context):
+        if self._class_completions is None:
+            return
+        for label, completions in zip(self._class_labels, self._class_completions):
+            save_statistic_value(OutputStatistic.COMPLETIONS, label, completions, "val", context.statistics)
+
     def reset(self, context=None):
+        if context is not None:
+            self.flush(context)
         for state in self._states.values():
             state._completion_count = 0
+        if self._class_completions is not None:
+            self._class_completions = [0] * len(self._class_completions)
 
     
     def _estimate_throughput(self, node_id: str, event, statistics):
@@ -76,6 +121,11 @@ class CompletionsEstimator(EventHandler):
             self._estimate_throughput(_GLOBAL, event, context.statistics)
         self._estimate_throughput(event.node.id, event, context.statistics)
 
+        if self._class_completions is None:
+            self._class_labels = class_labels(context.network)
+            self._class_completions = [0] * len(self._class_labels)
+        self._class_completions[event.node.index * context.network.state.n_classes + event.job_class] += 1
+
         
 class ResponseTimeEstimator(EventHandler):
     """
@@ -83,21 +133,49 @@ class ResponseTimeEstimator(EventHandler):
     """
     
     class State():
-        def __init__(self):
+        def __init__(self, quantiles):
             self.estimator = WelfordEstimator()
+            self.quantile_estimator = HistogramQuantileEstimator(quantiles)
             self.timespans_jobs_in_residence = {}
             """
             Jobs currently in service by id.
             """
     
-    def __init__(self):
+    def __init__(self, quantiles=(0.5, 0.95, 0.99)):
         super().__init__()
+        self.quantiles = quantiles
+        """
+        Quantiles of the response time to estimate, e.g. 0.99 is saved as <node>-response_time-p99.
+        """
         self._states_by_node = {}
-        self._states_by_node[_GLOBAL] = ResponseTimeEstimator.State()
+        self._states_by_node[_GLOBAL] = ResponseTimeEstimator.State(quantiles)
+        self._class_labels = None
+        self._class_estimators = None
+        """
+        Response time estimators by (node, class), saved when flushed.
+        """
     
+    def flush(self, context):
+        if self._class_estimators is None:
+            return
+        for label, estimator in zip(self._class_labels, self._class_estimators):
+            save_statistics(OutputStatistic.RESPONSE_TIME, label, estimator, context.statistics)
+
     def reset(self, context=None):
+        if context is not None:
+            self.flush(context)
         for state in self._states_by_node.values():
             state.estimator = WelfordEstimator()
+            state.quantile_estimator = HistogramQuantileEstimator(self.quantiles)
+        if self._class_estimators is not None:
+            self._class_estimators = [WelfordEstimator() for _ in self._class_labels]
+    
+    def get_quantile_estimator(self, node_id: str) -> HistogramQuantileEstimator:
+        """
+        Returns the response time quantile estimator of a node (or SYSTEM),
+        e.g. to merge it with the ones of other replicas or batches.
+        """
+        return self._states_by_node[node_id].quantile_estimator
 
     def _handle(self, context):
 
@@ -113,7 +191,7 @@ class ResponseTimeEstimator(EventHandler):
 
     def _register_arrival(self, node_id: str, job: Job, arrival: ArrivalEvent):
         if node_id not in self._states_by_node:
-            self._states_by_node[node_id] = ResponseTimeEstimator.State()
+            self._states_by_node[node_id] = ResponseTimeEstimator.State(self.quantiles)
         state = self._states_by_node[node_id]
 
         residence_timespan = Timespan()
@@ -125,20 +203,29 @@ class ResponseTimeEstimator(EventHandler):
     def _estimate_response_time(self, node: str, job: Job, departure: DepartureEvent, statistics, samples, time):
         state = self._states_by_node[node]
         
-        residence_timespan = state.timespans_jobs_in_residence[job.job_id]
+        residence_timespan = state.timespans_jobs_in_residence.pop(job.job_id)
         residence_timespan.end = departure.time
         response_time = residence_timespan.end - residence_timespan.start
 
         state.estimator.update(response_time)
+        state.quantile_estimator.update(response_time)
         save_statistics(OutputStatistic.RESPONSE_TIME, node, state.estimator, statistics)
+        save_quantile_statistics(OutputStatistic.RESPONSE_TIME, node, state.quantile_estimator, statistics)
         # new
         save_sample_statistics(OutputStatistic.RESPONSE_TIME, node, time, state.estimator, samples)
+        return response_time
     
     def _handle_arrival(self, context):
         job_movement = context.event
         job = context.event.job
         node = context.event.node
 
+        if job_movement.dropped:
+            # the job is lost: it has no response time
+            if not job_movement.external:
+                self._states_by_node[_GLOBAL].timespans_jobs_in_residence.pop(job.job_id)
+            return
+
         # global statistic
         if job_movement.external:
             self._register_arrival(_GLOBAL, job, job_movement)
@@ -154,7 +241,13 @@ class ResponseTimeEstimator(EventHandler):
         # compute response time of job
         if job_movement.external:
             self._estimate_response_time(_GLOBAL, job, job_movement, context.statistics, context.samples, context.event.time)
-        self._estimate_response_time(node.id, job, job_movement, context.statistics, context.samples, context.event.time)
+        response_time = self._estimate_response_time(node.id, job, job_movement, context.statistics, context.samples, context.event.time)
+
+        # the job keeps its class during the visit of the node
+        if self._class_estimators is None:
+            self._class_labels = class_labels(context.network)
+            self._class_estimators = [WelfordEstimator() for _ in self._class_labels]
+        self._class_estimators[node.index * context.network.state.n_classes + job_movement.job_class].update(response_time)
 
 class ObservationTimeEstimator(EventHandler):
 
@@ -183,38 +276,68 @@ class ObservationTimeEstimator(EventHandler):
         self.state = ObservationTimeEstimator.State()
 
 
-class PopulationEstimator(EventHandler):
+class TimeAveragedEstimator(EventHandler):
     """
-    Subscribes to job movements
+    Base class for estimators of time-averaged statistics of piecewise constant variables
+    (e.g. the population of a node) that change on job movements.
+    The variables are kept in arrays indexed by integers, and each job movement only
+    updates the variables it changes, so the cost per event does not depend on the network size.
+    Statistics are saved when flushed, i.e. at batch boundaries (reset) and at the end of a run.
     """
 
-    class State():
-        def __init__(self):
-            self.estimator = WelfordEstimator()
-            self.population = 0
-    
-    def __init__(self):
+    def __init__(self, output_statistic: OutputStatistic):
         super().__init__()
-        self._states_by_node = {}
-        self._states_by_node[_GLOBAL] = PopulationEstimator.State()
+        self._output_statistic = output_statistic
+        self._labels = None
+        """
+        Node (or node and class) label of each variable.
+        """
+        self._values = None
+        """
+        Current value of each variable.
+        """
+        self._estimators = None
+
+    @abstractmethod
+    def _create_labels(self, network) -> list:
+        pass
+
+    def _init(self, network, time: float):
+        self._labels = self._create_labels(network)
+        self._values = [0] * len(self._labels)
+        self._estimators = [WelfordTimeAveragedEstimator(time) for _ in self._labels]
+    
+    def _observe(self, index: int, value: float, time: float):
+        """
+        Sets a new value of the variable at the given time.
+        """
+        old_value = self._values[index]
+        if value != old_value:
+            # the old value was held since the last update
+            self._estimators[index].update(old_value, time)
+            self._values[index] = value
+    
+    def flush(self, context):
+        if self._estimators is None:
+            return
+        time = context.event.time
+        for label, value, estimator in zip(self._labels, self._values, self._estimators):
+            estimator.update(value, time)
+            save_statistics(self._output_statistic, label, estimator, context.statistics)
     
     def reset(self, context=None):
-        for state in self._states_by_node.values():
-            state.estimator = WelfordEstimator()
-
-    def _update_population(self, node_id: str, event, statistics, count: int):
-        if node_id not in self._states_by_node:
-            self._states_by_node[node_id] = PopulationEstimator.State()
-        state = self._states_by_node[node_id]
-
-        state.population += count
-
-        state.estimator.update(state.population)
-        save_statistics(OutputStatistic.POPULATION, node_id, state.estimator, statistics)
-        
+        if self._estimators is None:
+            return
+        # statistics of the batch are saved before starting to estimate the next one
+        self.flush(context)
+        time = context.event.time
+        self._estimators = [WelfordTimeAveragedEstimator(time) for _ in self._labels]
+    
     def _handle(self, context):
         job_movement = context.event
         self.halt_if_wrong_event(job_movement, JobMovementEvent)
+        if self._estimators is None:
+            self._init(context.network, job_movement.time)
         
         # we increase o decrease the population count based on the job movement direction
         if isinstance(job_movement, ArrivalEvent):
@@ -222,18 +345,95 @@ class PopulationEstimator(EventHandler):
         elif isinstance(job_movement, DepartureEvent):
             count = -1
         else:
-            raise ValueError(f"PopulationEstimator can only handle ArrivalEvent and DepartureEvent, got {type(job_movement)}")        
+            raise ValueError(f"{type(self).__qualname__} can only handle ArrivalEvent and DepartureEvent, got {type(job_movement)}")
+        self._update(context, job_movement, count)
+    
+    @abstractmethod
+    def _update(self, context, job_movement, count: int):
+        pass
+
+class PopulationEstimator(TimeAveragedEstimator):
+    """
+    Subscribes to job movements.
+    Estimates the time-averaged population of each job class at each node,
+    of each node, of each job class in the system and of the system.
+    """
+
+    def __init__(self):
+        super().__init__(OutputStatistic.POPULATION)
+    
+    def _create_labels(self, network):
+        # variables layout: (node, class) pairs, nodes, classes in the system, system
+        self._n_nodes = len(network.nodes)
+        self._n_classes = network.state.n_classes
+        self._node_base = self._n_nodes * self._n_classes
+        self._class_base = self._node_base + self._n_nodes
+        self._global_index = self._class_base + self._n_classes
         
-        statistics = context.statistics
+        labels = class_labels(network)
+        labels += [node.id for node in network.nodes]
+        labels += [class_label(_GLOBAL, class_id) for class_id in range(self._n_classes)]
+        labels.append(_GLOBAL)
+        return labels
+
+    def _update(self, context, job_movement, count):
+        time = job_movement.time
+        node_index = job_movement.node.index
+        job_class = job_movement.job_class
+        values = self._values
+
+        if count > 0 and job_movement.dropped:
+            # the job is lost, leaving the system if it was in it
+            if not job_movement.external:
+                self._observe(self._global_index, values[self._global_index] - 1, time)
+            return
+
+        # the state of the network is already updated by the job movement
+        self._observe(node_index * self._n_classes + job_class, context.network.state.matrix[node_index][job_class], time)
+        self._observe(self._node_base + node_index, values[self._node_base + node_index] + count, time)
+        self._observe(self._class_base + job_class, values[self._class_base + job_class] + count, time)
         if job_movement.external:
-            self._update_population(_GLOBAL, job_movement, statistics, count)
-        self._update_population(job_movement.node.id, job_movement, statistics, count)
-        if context.statistics == {}:
-            print("statistics is empty")
+            self._observe(self._global_index, values[self._global_index] + count, time)
+
+class UtilizationEstimator(TimeAveragedEstimator):
+    """
+    Subscribes to job movements.
+    Estimates the utilization of each node, i.e. the fraction of time the node is busy,
+    and the share of it due to each job class, i.e. the time-averaged fraction of the jobs
+    at the node that belong to the class.
+    """
+
+    def __init__(self):
+        super().__init__(OutputStatistic.UTILIZATION)
+    
+    def _create_labels(self, network):
+        # variables layout: (node, class) pairs, nodes
+        self._n_classes = network.state.n_classes
+        self._node_base = len(network.nodes) * self._n_classes
+        self._populations = [[0] * self._n_classes for _ in network.nodes]
+        
+        labels = class_labels(network)
+        labels += [node.id for node in network.nodes]
+        return labels
+
+    def _update(self, context, job_movement, count):
+        if count > 0 and job_movement.dropped:
+            return
+        time = job_movement.time
+        node_index = job_movement.node.index
+        populations = self._populations[node_index]
+        populations[job_movement.job_class] += count
+        population = sum(populations)
+
+        self._observe(self._node_base + node_index, 1 if population > 0 else 0, time)
+        row = node_index * self._n_classes
+        for class_id in range(self._n_classes):
+            self._observe(row + class_id, populations[class_id] / population if population > 0 else 0.0, time)
 
 class ServiceTimeEstimator(EventHandler):
     """
-    Subscribes to job completions only
+    Subscribes to job completions only.
+    Estimates the service time at the full rate of the server, i.e. the service demand of a visit.
     """
 
     class State():
@@ -261,8 +461,8 @@ class ServiceTimeEstimator(EventHandler):
             self._states_by_node[node.id] = ServiceTimeEstimator.State()
         state = self._states_by_node[node.id]
 
-        state.estimator.update(job.service_time)
-        job.service_time = None
+        state.estimator.update(job.service_demand)
+        job.service_demand = None
 
         save_statistics(OutputStatistic.SERVICE_TIME, node.id, state.estimator, context.statistics)
 
@@ -306,6 +506,9 @@ class InterarrivalTimeEstimator(EventHandler):
         event = context.event
         self.halt_if_wrong_event(event, ArrivalEvent)
 
+        # the retries of the requests that timed out are not interarrivals of the workload
+        if event.external and not event.retry:
+            self._estimate_interarrival_time(_GLOBAL, event, context.statistics)
         self._estimate_interarrival_time(event.node.id, event, context.statistics)
     
 class BusytimeEstimator(EventHandler):
@@ -354,17 +557,19 @@ class BusytimeEstimator(EventHandler):
 
     def _handle_departure(self, departure, state, node_id, network, statistics):
         
+        # the state of the network is already updated by the departure
+        # (scheduled departures are only tracked by PS nodes)
         if node_id == _GLOBAL:
-            # we check for every node if they have scheduled departures
+            # we check for every node if they have jobs
             for node in network.nodes:
-                if len(node.scheduled_departures) > 0:
+                if network.state.get_num_jobs_in_node(node) > 0:
                     return
             self._update_busy_time(node_id, state, departure.time, statistics)
         
-        # if after the departure no more jobs are scheduled for departure at the node,
+        # if after the departure no more jobs are at the node,
         # we can close the busy period
         else:
-            if len(departure.node.scheduled_departures) == 0:
+            if network.state.get_num_jobs_in_node(departure.node) == 0:
                 self._update_busy_time(node_id, state, departure.time, statistics)
     
     def _handle_job_movement(self, node_id, job_movement, network, statistics):
@@ -383,6 +588,13 @@ class BusytimeEstimator(EventHandler):
     def _handle(self, context):
         event = context.event
         self.halt_if_wrong_event(event, JobMovementEvent)
+
+        if isinstance(event, ArrivalEvent) and event.dropped:
+            # a job lost inside the system leaves it as by a departure
+            state = self._states_by_node[_GLOBAL]
+            if not event.external and state.start_busy_period_time is not None:
+                self._handle_departure(event, state, _GLOBAL, context.network, context.statistics)
+            return
         
         if event.external:
             self._handle_job_movement(_GLOBAL, event, context.network, context.statistics)
@@ -390,3 +602,311 @@ class BusytimeEstimator(EventHandler):
         
 
         
+
+class LossEstimator(EventHandler):
+    """
+    Subscribes to job arrivals only.
+    Estimates the losses of the nodes with finite buffers: the blocking probability of each node, i.e. the fraction
+    of its arrivals dropped because it was full, and its loss rate, i.e. the dropped arrivals per unit of time.
+    For the system they are the fraction of the jobs entering the system that are lost at some node and the lost jobs
+    per unit of time. Statistics are saved when flushed, i.e. at batch boundaries (reset) and at the end of a run.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._labels = None
+        """
+        Nodes and SYSTEM, the system last.
+        """
+        self._arrivals = None
+        self._losses = None
+        self._start_time = None
+
+    def _init(self, network, time: float):
+        self._labels = [node.id for node in network.nodes] + [_GLOBAL]
+        self._arrivals = [0] * len(self._labels)
+        self._losses = [0] * len(self._labels)
+        self._start_time = time
+
+    def flush(self, context):
+        if self._labels is None:
+            return
+        elapsed = context.event.time - self._start_time
+        for label, arrivals, losses in zip(self._labels, self._arrivals, self._losses):
+            blocking = losses / arrivals if arrivals > 0 else float("nan")
+            loss_rate = losses / elapsed if elapsed > 0 else float("nan")
+            save_statistic_value(OutputStatistic.BLOCKING, label, blocking, "val", context.statistics)
+            save_statistic_value(OutputStatistic.LOSS_RATE, label, loss_rate, "val", context.statistics)
+
+    def reset(self, context=None):
+        if self._labels is None or context is None:
+            return
+        # statistics of the batch are saved before starting to estimate the next one
+        self.flush(context)
+        self._arrivals = [0] * len(self._labels)
+        self._losses = [0] * len(self._labels)
+        self._start_time = context.event.time
+
+    def _handle(self, context):
+        event = context.event
+        self.halt_if_wrong_event(event, ArrivalEvent)
+        if self._labels is None:
+            self._init(context.network, event.time)
+
+        node_index = event.node.index
+        self._arrivals[node_index] += 1
+        if event.external:
+            self._arrivals[-1] += 1
+        if event.dropped:
+            self._losses[node_index] += 1
+            self._losses[-1] += 1
+
+class TimeoutEstimator(EventHandler):
+    """
+    Subscribes to all events (job movements and timeouts), to be subscribed once as its state is reset once.
+    Estimates the effects of the client deadlines on the system: the goodput, i.e. the jobs leaving the system
+    before their deadline per unit of time, the fraction of the attempts (jobs entering the system, retries included)
+    that time out, the fraction of the requests given up after their last attempt and the wasted work, i.e. the
+    fraction of the service demand served to jobs abandoned by their clients.
+    Statistics are saved when flushed, i.e. at batch boundaries (reset) and at the end of a run.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._start_time = None
+        self._clear()
+
+    def _clear(self):
+        self._requests = 0
+        self._attempts = 0
+        self._successes = 0
+        self._timeouts = 0
+        self._given_up = 0
+        self._work = 0.0
+        self._wasted_work = 0.0
+
+    def flush(self, context):
+        if self._start_time is None:
+            return
+        elapsed = context.event.time - self._start_time
+        save_statistic_value(OutputStatistic.GOODPUT, _GLOBAL, self._successes / elapsed if elapsed > 0 else float("nan"), "val", context.statistics)
+        save_statistic_value(OutputStatistic.TIMEOUT, _GLOBAL, self._timeouts / self._attempts if self._attempts > 0 else float("nan"), "val", context.statistics)
+        save_statistic_value(OutputStatistic.ABANDONED, _GLOBAL, self._given_up / self._requests if self._requests > 0 else float("nan"), "val", context.statistics)
+        save_statistic_value(OutputStatistic.WASTED_WORK, _GLOBAL, self._wasted_work / self._work if self._work > 0 else float("nan"), "val", context.statistics)
+
+    def reset(self, context=None):
+        if self._start_time is None or context is None:
+            return
+        # statistics of the batch are saved before starting to estimate the next one
+        self.flush(context)
+        self._clear()
+        self._start_time = context.event.time
+
+    def _handle(self, context):
+        event = context.event
+        if self._start_time is None:
+            self._start_time = event.time
+
+        if isinstance(event, TimeoutEvent):
+            self._timeouts += 1
+            if not event.retried:
+                self._given_up += 1
+        elif isinstance(event, ArrivalEvent):
+            if event.external:
+                self._attempts += 1
+                if not event.retry:
+                    self._requests += 1
+            if not event.dropped:
+                self._work += event.job.service_demand
+        elif isinstance(event, DepartureEvent) and event.external:
+            attempt = event.job.attempt
+            if attempt is not None and attempt.abandoned:
+                self._wasted_work += attempt.work
+            else:
+                self._successes += 1
+
+class ScoreEstimator(EventHandler):
+    """
+    Subscribes to job arrivals only.
+    Accumulates the likelihood ratio scores of the exponential draws, i.e. the derivatives
+    of their log density with respect to the rates, 1/rate - x for a draw x:
+    of the external arrival rate (saved as SYSTEM-score-lambda), of the service rate
+    of each (node, class) (e.g. P.1-score-rate) and of a speed factor of each node scaling
+    the rates of all its classes (e.g. P-score-speed).
+    The scores of the iterations (batches or replicas) are used by sensitivity.py to estimate
+    the derivatives of the statistics with respect to the rates.
+    The first external arrival is not an exponential draw, and only sets the time of the next ones.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._last_external_arrival = None
+        self._arrival_score = 0.0
+        self._class_labels = None
+        self._class_scores = None
+        self._node_scores = None
+
+    def flush(self, context):
+        if self._class_scores is None:
+            return
+        network = context.network
+        save_statistic_value(OutputStatistic.SCORE, _GLOBAL, self._arrival_score, "lambda", context.statistics)
+        for label, score in zip(self._class_labels, self._class_scores):
+            save_statistic_value(OutputStatistic.SCORE, label, score, "rate", context.statistics)
+        for node in network.nodes:
+            save_statistic_value(OutputStatistic.SCORE, node.id, self._node_scores[node.index], "speed", context.statistics)
+
+    def reset(self, context=None):
+        if context is not None:
+            self.flush(context)
+        self._arrival_score = 0.0
+        if self._class_scores is not None:
+            self._class_scores = [0.0] * len(self._class_scores)
+            self._node_scores = [0.0] * len(self._node_scores)
+
+    def _handle(self, context):
+        event = context.event
+        self.halt_if_wrong_event(event, ArrivalEvent)
+        network = context.network
+        if self._class_scores is None:
+            self._class_labels = class_labels(network)
+            self._class_scores = [0.0] * len(self._class_labels)
+            self._node_scores = [0.0] * len(network.nodes)
+
+        # the retries of the requests that timed out are not draws of the arrival process
+        workload_arrival = event.external and not event.retry
+        if workload_arrival and network.job_arrival_distr == 'poisson' and self._last_external_arrival is not None:
+            arrival_rate = float(network.job_arrival_param[0])
+            self._arrival_score += 1.0 / arrival_rate - (event.time - self._last_external_arrival)
+        if workload_arrival:
+            self._last_external_arrival = event.time
+
+        node = event.node
+        if node.server.server_distribution == 'exp' and not event.dropped:
+            job = event.job
+            rate = float(node.service_rate[job.class_id])
+            score = 1.0 / rate - job.service_demand
+            self._class_scores[node.index * network.state.n_classes + job.class_id] += score
+            self._node_scores[node.index] += rate * score
+
+def bucket_variant(variant: str, bucket: int):
+    """
+    Variant of a statistic over a time bucket, e.g. avg@3 for the average over the fourth bucket.
+    """
+    return f"{variant}@{bucket}"
+
+class TimeBucketEstimator(EventHandler):
+    """
+    Subscribes to job movements.
+    Estimates the statistics of each of n_buckets consecutive time buckets of the given width from time 0
+    (e.g. the hours of a day with a non stationary arrival rate): the time-averaged population of each node
+    and of the system, the utilization of each node, the throughput and the average response time of the
+    jobs leaving each node and the system in the bucket. They are saved when flushed as <node>-<statistic>-<variant>@<bucket>,
+    NaN for the buckets that were not observed (or without departures for the response time).
+    The statistics are meant for replicas of the same time window, so the estimator is not reset by batches.
+    """
+
+    def __init__(self, width: float, n_buckets: int):
+        super().__init__()
+        if width <= 0 or n_buckets < 1:
+            raise ValueError("The time buckets must have a positive width")
+        self.width = width
+        self.n_buckets = n_buckets
+        self._labels = None
+        """
+        Nodes and SYSTEM, the system last.
+        """
+        self._populations = None
+        self._last_time = 0.0
+        self._population_areas = None
+        self._busy_areas = None
+        self._completions = None
+        self._response_times = None
+        """
+        Sum of the response times of the departures of each bucket.
+        """
+        self._arrivals = {}
+        """
+        Arrival time of the jobs in residence by (variable index, job id).
+        """
+
+    def _init(self, network):
+        self._labels = [node.id for node in network.nodes] + [_GLOBAL]
+        self._populations = [0] * len(self._labels)
+        self._population_areas = [[0.0] * self.n_buckets for _ in self._labels]
+        self._busy_areas = [[0.0] * self.n_buckets for _ in self._labels]
+        self._completions = [[0] * self.n_buckets for _ in self._labels]
+        self._response_times = [[0.0] * self.n_buckets for _ in self._labels]
+
+    def _bucket(self, time: float) -> int:
+        return int(time // self.width)
+
+    def _accumulate(self, time: float):
+        """
+        Adds the populations held since the last event to the areas of the buckets, split at their boundaries.
+        """
+        start = self._last_time
+        self._last_time = time
+        bucket = self._bucket(start)
+        while start < time and bucket < self.n_buckets:
+            end = min(time, (bucket + 1) * self.width)
+            for index, population in enumerate(self._populations):
+                if population > 0:
+                    self._population_areas[index][bucket] += population * (end - start)
+                    self._busy_areas[index][bucket] += end - start
+            start = end
+            bucket += 1
+
+    def flush(self, context):
+        if self._labels is None:
+            return
+        end_time = context.event.time
+        self._accumulate(end_time)
+        for index, label in enumerate(self._labels):
+            for bucket in range(self.n_buckets):
+                # the last buckets may be observed only in part, or not at all
+                observed = min(max(end_time - bucket * self.width, 0.0), self.width)
+                population = self._population_areas[index][bucket] / observed if observed > 0 else float("nan")
+                throughput = self._completions[index][bucket] / observed if observed > 0 else float("nan")
+                completions = self._completions[index][bucket]
+                response_time = self._response_times[index][bucket] / completions if completions > 0 else float("nan")
+                save_statistic_value(OutputStatistic.POPULATION, label, population, bucket_variant("avg", bucket), context.statistics)
+                save_statistic_value(OutputStatistic.THROUGHPUT, label, throughput, bucket_variant("val", bucket), context.statistics)
+                save_statistic_value(OutputStatistic.RESPONSE_TIME, label, response_time, bucket_variant("avg", bucket), context.statistics)
+                if label != _GLOBAL:
+                    utilization = self._busy_areas[index][bucket] / observed if observed > 0 else float("nan")
+                    save_statistic_value(OutputStatistic.UTILIZATION, label, utilization, bucket_variant("avg", bucket), context.statistics)
+
+    def _move(self, index: int, job_movement, count: int):
+        key = (index, job_movement.job.job_id)
+        self._populations[index] += count
+        if count > 0:
+            self._arrivals[key] = job_movement.time
+            return
+        bucket = self._bucket(job_movement.time)
+        arrival_time = self._arrivals.pop(key)
+        if bucket < self.n_buckets:
+            self._completions[index][bucket] += 1
+            self._response_times[index][bucket] += job_movement.time - arrival_time
+
+    def _handle(self, context):
+        job_movement = context.event
+        self.halt_if_wrong_event(job_movement, JobMovementEvent)
+        if self._labels is None:
+            self._init(context.network)
+        if isinstance(job_movement, ArrivalEvent):
+            count = 1
+        elif isinstance(job_movement, DepartureEvent):
+            count = -1
+        else:
+            raise ValueError(f"TimeBucketEstimator can only handle ArrivalEvent and DepartureEvent, got {type(job_movement)}")
+        self._accumulate(job_movement.time)
+        if count > 0 and job_movement.dropped:
+            # the job is lost, leaving the system if it was in it
+            if not job_movement.external:
+                self._populations[-1] -= 1
+                self._arrivals.pop((len(self._labels) - 1, job_movement.job.job_id))
+            return
+        self._move(job_movement.node.index, job_movement, count)
+        if job_movement.external:
+            self._move(len(self._labels) - 1, job_movement, count)
@@ -0,0 +1,219 @@
+import sys
+from multiprocessing import Pool
+
+from caballo.domestico.wwsimulator.events import ArrivalEvent, DepartureEvent, EventHandler, JobMovementEvent
+from caballo.domestico.wwsimulator.handlers import ArrivalsGeneratorSubscriber, HandleFirstArrival
+from caballo.domestico.wwsimulator.output import _GLOBAL, OutputStatistic
+from caballo.domestico.wwsimulator.simulation import Simulation, SimulationFactory
+from caballo.domestico.wwsimulator.statistics import RatioEstimator
+from caballo.domestico.wwsimulator.streams import independent_seeds
+
+
+class RegenerativeSimulation(Simulation):
+    """
+    A regenerative simulation runs a single simulation and divides it into cycles
+    at the regeneration points of the network, i.e. the external arrivals that find the system empty.
+    With Poisson arrivals and exponential services the cycles are i.i.d., so the statistics
+    are estimated as ratios of the means of the cycle sums, with no batch size to tune.
+    For each cycle, the simulation collects the sums of the response times, the completions,
+    the time-integrated population and busy time of each node and of the system, and the cycle length.
+    """
+    def __init__(self, simulation: Simulation):
+        super().__init__(simulation.study, simulation.network, simulation.initial_seed)
+        self.simulation = simulation
+        self.statistics = {}
+        self.ratios = {}
+        """
+        Ratio estimators of the statistics, also registered as their confidence intervals.
+        key: statistic name
+        value: RatioEstimator
+        """
+
+    def run(self):
+        self.simulation.run()
+
+    @property
+    def simulation(self):
+        return self._simulation
+
+    @simulation.setter
+    def simulation(self, simulation):
+        self._simulation = simulation
+        self.scheduler = simulation.scheduler
+        self.network = simulation.network
+        self.study = simulation.study
+
+    def _update_ratio(self, key: str, y: float, x: float):
+        if key not in self.ratios:
+            self.ratios[key] = RatioEstimator(self.confidence)
+        self.ratios[key].update(y, x)
+
+    def _update_ratios(self, statistics: dict):
+        cycle_length = statistics[OutputStatistic.OBSERVATION_TIME.for_node_variant(_GLOBAL, "val")]
+        for node_id in [node.id for node in self.network.nodes] + [_GLOBAL]:
+            completions = statistics[OutputStatistic.COMPLETIONS.for_node_variant(node_id, "val")]
+            self._update_ratio(OutputStatistic.RESPONSE_TIME.for_node_variant(node_id, "avg"),
+                               statistics[OutputStatistic.RESPONSE_TIME.for_node_variant(node_id, "sum")], completions)
+            self._update_ratio(OutputStatistic.POPULATION.for_node_variant(node_id, "avg"),
+                               statistics[OutputStatistic.POPULATION.for_node_variant(node_id, "sum")], cycle_length)
+            self._update_ratio(OutputStatistic.UTILIZATION.for_node_variant(node_id, "avg"),
+                               statistics[OutputStatistic.BUSY_TIME.for_node_variant(node_id, "val")], cycle_length)
+            self._update_ratio(OutputStatistic.THROUGHPUT.for_node_variant(node_id, "avg"), completions, cycle_length)
+
+    def collect_iteration(self, statistics: dict):
+        self._update_ratios(statistics)
+        self.intervals.update(self.ratios)
+        super().collect_iteration(statistics)
+
+    def set_statistics(self, statistics: dict):
+        super().set_statistics(statistics)
+        # the ratio estimators are rebuilt from the sums of the cycles
+        self.ratios = {}
+        n_cycles = len(statistics.get(OutputStatistic.OBSERVATION_TIME.for_node_variant(_GLOBAL, "val"), []))
+        for cycle in range(n_cycles):
+            self._update_ratios({key: values[cycle] for key, values in statistics.items()})
+        self.intervals.update(self.ratios)
+
+    def merge(self, statistics: dict):
+        """
+        Merges the cycles of another regenerative simulation of the same network (e.g. run by a parallel worker).
+        """
+        merged = {key: list(values) for key, values in self.statistics.items()}
+        for key, values in statistics.items():
+            merged.setdefault(key, []).extend(values)
+        self.set_statistics(merged)
+
+class RegenerationInterceptor(EventHandler):
+    """
+    Intercepts job movements.
+    Must subscribe as interceptor to detect the external arrivals that find the system empty
+    before they are processed, i.e. at the regeneration points.
+    Stops the simulation after the requested number of cycles.
+    """
+    def __init__(self, cycle_num: int, simulation: RegenerativeSimulation):
+        super().__init__()
+        self.cycle_num = cycle_num
+        """
+        Numero di cicli totali
+        """
+        self.cycle_completed = 0
+        """
+        Numero di cicli completati
+        """
+        self.simulation = simulation
+        self._cycle_start = None
+        self._labels = None
+        self._system = None
+
+    def _init(self, network):
+        # node indexes, then the system
+        self._labels = [node.id for node in network.nodes] + [_GLOBAL]
+        self._system = len(network.nodes)
+        self._populations = [0] * len(self._labels)
+        self._arrival_times = {}
+        """
+        Arrival time at the current node by job id
+        """
+        self._entry_times = {}
+        """
+        Arrival time in the system by job id
+        """
+
+    def _reset_cycle(self, time: float):
+        self._cycle_start = time
+        self._last_changes = [time] * len(self._labels)
+        self._areas = [0.0] * len(self._labels)
+        self._busy_times = [0.0] * len(self._labels)
+        self._completions = [0] * len(self._labels)
+        self._response_times = [0.0] * len(self._labels)
+
+    def _advance(self, index: int, time: float):
+        elapsed = time - self._last_changes[index]
+        population = self._populations[index]
+        self._areas[index] += population * elapsed
+        if population > 0:
+            self._busy_times[index] += elapsed
+        self._last_changes[index] = time
+
+    def _arrive(self, index: int, time: float):
+        self._advance(index, time)
+        self._populations[index] += 1
+
+    def _depart(self, index: int, time: float, response_time: float):
+        self._advance(index, time)
+        self._populations[index] -= 1
+        self._completions[index] += 1
+        self._response_times[index] += response_time
+
+    def _end_cycle(self, time: float):
+        statistics = {OutputStatistic.OBSERVATION_TIME.for_node_variant(_GLOBAL, "val"): time - self._cycle_start}
+        for index, label in enumerate(self._labels):
+            self._advance(index, time)
+            statistics[OutputStatistic.RESPONSE_TIME.for_node_variant(label, "sum")] = self._response_times[index]
+            statistics[OutputStatistic.COMPLETIONS.for_node_variant(label, "val")] = self._completions[index]
+            statistics[OutputStatistic.POPULATION.for_node_variant(label, "sum")] = self._areas[index]
+            statistics[OutputStatistic.BUSY_TIME.for_node_variant(label, "val")] = self._busy_times[index]
+        self.cycle_completed += 1
+        self.simulation.collect_iteration(statistics)
+        self._reset_cycle(time)
+
+    def _handle(self, context):
+        event = context.event
+        self.halt_if_wrong_event(event, JobMovementEvent)
+        if self._labels is None:
+            self._init(context.network)
+
+        time = event.time
+        job_id = event.job.job_id
+        if isinstance(event, ArrivalEvent):
+            if event.external:
+                # regeneration point: the state of the system is the same as at the start of the previous cycle
+                if self._populations[self._system] == 0:
+                    if self._cycle_start is None:
+                        # the first cycle starts with the first arrival
+                        self._reset_cycle(time)
+                    else:
+                        self._end_cycle(time)
+                        if self.cycle_completed == self.cycle_num:
+                            context.scheduler.stop = True
+                            return
+                self._arrive(self._system, time)
+                self._entry_times[job_id] = time
+            # intercepted before HandleArrival, the replica of the job is chosen now
+            self._arrive(event.dispatch(context.network).index, time)
+            self._arrival_times[job_id] = time
+        elif isinstance(event, DepartureEvent):
+            self._depart(event.node.index, time, time - self._arrival_times.pop(job_id))
+            if event.external:
+                self._depart(self._system, time, time - self._entry_times.pop(job_id))
+
+def create_regenerative_simulation(experiment, lambda_val, cycle_num: int, seed: int) -> RegenerativeSimulation:
+    factory = SimulationFactory()
+    simulation = factory.create(HandleFirstArrival(), experiment, lambda_val, seed=seed)
+    regenerative_simulation = RegenerativeSimulation(simulation)
+    # arrivals are generated until the last cycle is completed
+    simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(sys.maxsize))
+    simulation.scheduler.intercept(JobMovementEvent, RegenerationInterceptor(cycle_num, regenerative_simulation))
+    return regenerative_simulation
+
+def _run_worker(experiment, lambda_val, cycle_num, seed):
+    simulation = create_regenerative_simulation(experiment, lambda_val, cycle_num, seed)
+    simulation.run()
+    return simulation.statistics
+
+def run_parallel(experiment, lambda_val, cycle_num: int, seed: int, workers: int) -> RegenerativeSimulation:
+    """
+    Runs the cycles of a regenerative simulation in parallel processes.
+    Each worker runs an independent simulation with its own seed, the cycles of all
+    the workers are i.i.d. so they are merged as the cycles of a single simulation.
+    """
+    seeds = independent_seeds(seed, workers)
+    cycles = [cycle_num // workers + (1 if worker < cycle_num % workers else 0) for worker in range(workers)]
+
+    with Pool(workers) as pool:
+        results = pool.starmap(_run_worker, [(experiment, lambda_val, cycles[worker], seeds[worker]) for worker in range(workers)])
+
+    simulation = create_regenerative_simulation(experiment, lambda_val, cycle_num, seed)
+    for statistics in results:
+        simulation.merge(statistics)
+    return simulation
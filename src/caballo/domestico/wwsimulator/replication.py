@@ -6,6 +6,7 @@ from caballo.domestico.wwsimulator import simulation
 from caballo.domestico.wwsimulator.events import EventHandler
 from pdsteele.des import rngs
 from caballo.domestico.wwsimulator.simulation import Simulation, SimulationFactory
+from caballo.domestico.wwsimulator.statistics import IntervalEstimator
 
 class ReplicatedSimulation(Simulation):
     """
@@ -13,12 +14,28 @@ class ReplicatedSimulation(Simulation):
     Caller is responsible to ensure that the simulation list passed as input
     are independent replicas (i.e. they do not share state of network, scheduler, event listeners, etc.)
     """
-    def __init__(self, replicas: Iterable[Simulation]):
+    def __init__(self, replicas: Iterable[Simulation], seeds: Iterable[int] = None, antithetic: bool = False):
         if len(replicas) < 1:
             raise ValueError("At least one replica is required.")
+        if antithetic and len(replicas) % 2 != 0:
+            raise ValueError("Antithetic replicas must be an even number.")
         super().__init__(replicas[0].scheduler, replicas[0].network, replicas[0].initial_seed)
         self.replicas = replicas
+        self.seeds = seeds
+        """
+        Optional initial seeds of the replicas (of the pairs if antithetic), e.g. the same for all
+        the configurations of a sweep to compare them with common random numbers.
+        By default each replica starts from the final prng state of the previous one.
+        """
+        self.antithetic = antithetic
+        """
+        Whether the replicas are run in antithetic pairs: the second replica of a pair
+        has the same seed and uses the complements of the random numbers of the first one.
+        Each pair is an iteration, whose statistics are the averages of the two replicas.
+        """
         self.simulation = replicas[0]
+        if seeds is not None:
+            self.simulation.initial_seed = seeds[0]
 
     @property
     def simulation(self):
@@ -31,23 +48,48 @@ class ReplicatedSimulation(Simulation):
         self.network = simulation.network
         self.study = simulation.study
 
+    def _next_seed(self, i: int) -> int:
+        if self.antithetic and i % 2 == 1:
+            return self.simulation.initial_seed
+        if self.seeds is not None:
+            return self.seeds[i // 2 if self.antithetic else i]
+        # use a stream which has been surely advanced by the previous replica
+        rngs.selectStream(streams.EXTERNAL_ARRIVALS)
+        return rngs.getSeed()
     
     def run(self):
         i = 0
+        first_of_pair = None
         while i < len(self.replicas):
-            self.simulation.run()
+            streams.antithetic = self.antithetic and i % 2 == 1
+            try:
+                self.simulation.run()
+            finally:
+                streams.antithetic = False
             # collect statistics
-            for key, value in self.simulation.statistics.items():
-                if (key not in self.statistics):
-                    self.statistics[key] = []
-                self.statistics[key].append(value) 
+            if not self.antithetic:
+                self.collect_iteration(self.simulation.statistics)
+            elif i % 2 == 0:
+                first_of_pair = self.simulation.statistics
+            else:
+                self.collect_iteration(_average(first_of_pair, self.simulation.statistics))
                 
             # run replicas using final prng state of previous replica
             # as initial state of the next one to reduce overlap
             i += 1
             if i < len(self.replicas):
-                # use a stream which has been surely advanced by the previous replica
-                rngs.selectStream(streams.EXTERNAL_ARRIVALS)
-                seed = rngs.getSeed()
+                seed = self._next_seed(i)
                 self.simulation = self.replicas[i]
                 self.simulation.initial_seed = seed
+
+def _average(statistics: dict, other: dict) -> dict:
+    return {key: (value + other[key]) / 2 for key, value in statistics.items() if key in other}
+
+def paired_difference(simulation: Simulation, other: Simulation, statistic: str) -> IntervalEstimator:
+    """
+    Confidence interval of the difference of a statistic between two simulations
+    whose iterations are paired, i.e. run with the same seeds (common random numbers).
+    """
+    interval = IntervalEstimator(simulation.confidence)
+    interval.update_many([b - a for a, b in zip(simulation.statistics[statistic], other.statistics[statistic])])
+    return interval
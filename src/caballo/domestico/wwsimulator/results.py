@@ -0,0 +1,177 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from caballo.domestico.wwsimulator import ROOT_DIR
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    key TEXT PRIMARY KEY,
+    study TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    lambda REAL NOT NULL,
+    seed INTEGER NOT NULL,
+    version TEXT NOT NULL,
+    config TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS statistics (
+    key TEXT NOT NULL REFERENCES runs(key) ON DELETE CASCADE,
+    iteration INTEGER NOT NULL,
+    statistic TEXT NOT NULL,
+    node TEXT,
+    metric TEXT,
+    variant TEXT,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS runs_study ON runs(study, mode, lambda);
+CREATE INDEX IF NOT EXISTS statistics_key ON statistics(key);
+CREATE INDEX IF NOT EXISTS statistics_metric_node ON statistics(metric, node);
+"""
+
+_simulator_version = None
+
+def simulator_version() -> str:
+    """
+    Hash of the simulator source code, so that results computed by a different
+    version of the simulator are not reused.
+    """
+    global _simulator_version
+    if _simulator_version is None:
+        digest = hashlib.sha256()
+        for file_name in sorted(os.listdir(ROOT_DIR)):
+            if file_name.endswith(".py"):
+                with open(os.path.join(ROOT_DIR, file_name), "rb") as source:
+                    digest.update(file_name.encode())
+                    digest.update(source.read())
+        _simulator_version = digest.hexdigest()
+    return _simulator_version
+
+def canonical_experiment(experiment: dict) -> str:
+    """
+    Canonical serialization of an experiment configuration.
+    The list of lambda values to sweep is left out, since each lambda is a separate run:
+    adding or removing a lambda value does not invalidate the other runs of the study.
+    """
+    experiment = dict(experiment)
+    experiment['arrival_distr'] = {key: value for key, value in experiment['arrival_distr'].items() if key != 'params'}
+    return json.dumps(experiment, sort_keys=True, separators=(",", ":"))
+
+def run_key(experiment: dict, lambda_val: float, seed: int, mode: str, version: str = None) -> str:
+    """
+    Content address of a simulation run.
+    """
+    if version is None:
+        version = simulator_version()
+    content = json.dumps([canonical_experiment(experiment), float(lambda_val), int(seed), mode, version], separators=(",", ":"))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def _split_statistic(statistic: str):
+    # statistics are named <node>-<metric>-<variant>, see OutputStatistic
+    parts = statistic.rsplit("-", 2)
+    if len(parts) != 3:
+        return None, None, None
+    return tuple(parts)
+
+class ResultStore():
+    """
+    Persistent store of the statistics of simulation runs, indexed by the content address
+    of the run (experiment configuration, lambda, seed, run mode and simulator version).
+    Backed by SQLite, so it can be shared among parallel workers: each run is written
+    in a single transaction.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=60.0)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA foreign_keys=ON")
+        with self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def contains(self, key: str) -> bool:
+        cursor = self._connection.execute("SELECT 1 FROM runs WHERE key = ?", (key,))
+        return cursor.fetchone() is not None
+
+    def save(self, key: str, experiment: dict, lambda_val: float, seed: int, mode: str, statistics: dict):
+        """
+        Atomically stores the statistics of a run, replacing a previous run with the same key.
+        statistics: dict statistic name -> value, or list of values by iteration
+        """
+        rows = []
+        for statistic, values in statistics.items():
+            if not isinstance(values, list):
+                values = [values]
+            node, metric, variant = _split_statistic(statistic)
+            for iteration, value in enumerate(values):
+                rows.append((key, iteration, statistic, node, metric, variant, value))
+
+        with self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.execute("DELETE FROM runs WHERE key = ?", (key,))
+            self._connection.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                     (key, experiment['simulation_study'], mode, float(lambda_val), int(seed),
+                                      simulator_version(), canonical_experiment(experiment), time.time()))
+            self._connection.executemany("INSERT INTO statistics VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def load(self, key: str) -> dict:
+        """
+        Returns the statistics of a run as a dict statistic name -> list of values by iteration.
+        """
+        statistics = {}
+        cursor = self._connection.execute(
+            "SELECT statistic, value FROM statistics WHERE key = ? ORDER BY statistic, iteration", (key,))
+        for statistic, value in cursor:
+            if statistic not in statistics:
+                statistics[statistic] = []
+            statistics[statistic].append(value)
+        return statistics
+
+    def runs(self, study: str = None, mode: str = None, version: str = None) -> list:
+        """
+        Returns the stored runs matching the given filters as a list of tuples
+        (key, study, mode, lambda, seed, experiment), where experiment is the configuration of the run without its lambda list.
+        Only the runs of the current simulator version are returned, unless another version is given.
+        """
+        if version is None:
+            version = simulator_version()
+        filters = [("study", study), ("mode", mode), ("version", version)]
+        where = [f"{column} = ?" for column, value in filters if value is not None]
+        params = [value for _, value in filters if value is not None]
+        sql = "SELECT key, study, mode, lambda, seed, config FROM runs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY study, lambda, seed"
+        return [(key, study, mode, lambda_val, seed, json.loads(config))
+                for key, study, mode, lambda_val, seed, config in self._connection.execute(sql, params)]
+
+    def query(self, study: str = None, mode: str = None, metric: str = None, node: str = None, variant: str = None, lambda_val: float = None):
+        """
+        Returns the stored statistic values matching the given filters as a list of tuples
+        (study, mode, lambda, seed, iteration, node, metric, variant, value).
+        """
+        filters = [("runs.study", study), ("runs.mode", mode), ("statistics.metric", metric),
+                   ("statistics.node", node), ("statistics.variant", variant), ("runs.lambda", lambda_val)]
+        where = [f"{column} = ?" for column, value in filters if value is not None]
+        params = [value for _, value in filters if value is not None]
+        sql = ("SELECT runs.study, runs.mode, runs.lambda, runs.seed, statistics.iteration, "
+               "statistics.node, statistics.metric, statistics.variant, statistics.value "
+               "FROM statistics JOIN runs ON runs.key = statistics.key")
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY runs.study, runs.lambda, runs.seed, statistics.statistic, statistics.iteration"
+        return self._connection.execute(sql, params).fetchall()
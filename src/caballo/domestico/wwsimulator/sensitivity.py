@@ -0,0 +1,53 @@
+from caballo.domestico.wwsimulator.output import OutputStatistic
+from caballo.domestico.wwsimulator.simulation import Simulation, _is_finite_number
+from caballo.domestico.wwsimulator.statistics import IntervalEstimator
+
+
+class Sensitivity():
+    """
+    Likelihood ratio estimate of the derivative of the mean of a statistic Y with respect to a rate,
+    d E[Y] / d rate = E[Y S], where S is the score of the rate over an iteration (see output.ScoreEstimator).
+    Y is centered on its mean over the iterations to reduce the variance, since E[S] = 0.
+    With batch means the score of a batch ignores the draws of the previous batches that affect it,
+    so the estimate is biased for batches short compared to the busy periods.
+    > Peter W. Glynn - Likelihood ratio gradient estimation for stochastic systems, Communications of the ACM 33(10) (1990)
+    """
+
+    def __init__(self, statistic: str, parameter: str, interval: IntervalEstimator):
+        self.statistic = statistic
+        self.parameter = parameter
+        """
+        Name of the score of the rate, e.g. SYSTEM-score-lambda or P.1-score-rate.
+        """
+        self.interval = interval
+
+    @property
+    def derivative(self):
+        return self.interval.avg
+
+def sensitivities(simulation: Simulation, statistics: list = None) -> list:
+    """
+    Returns the sensitivities of the response times and populations of a simulation, or of the given statistics,
+    with respect to all the rates whose score has been collected over the iterations, as a list of Sensitivity.
+    """
+    score = f"-{OutputStatistic.SCORE.value}-"
+    parameters = [key for key in sorted(simulation.statistics) if score in key]
+    if statistics is None:
+        variants = [OutputStatistic.RESPONSE_TIME.for_node_variant("", "avg"), OutputStatistic.POPULATION.for_node_variant("", "avg")]
+        statistics = [key for key in sorted(simulation.statistics)
+                      if any(key.endswith(variant) for variant in variants) and "." not in key.split("-")[0]]
+
+    results = []
+    for statistic in statistics:
+        values = simulation.statistics[statistic]
+        if not isinstance(values, list) or len(values) < 2 or not all(_is_finite_number(value) for value in values):
+            continue
+        avg = sum(values) / len(values)
+        for parameter in parameters:
+            scores = simulation.statistics[parameter]
+            if len(scores) != len(values) or all(score == 0.0 for score in scores):
+                continue
+            interval = IntervalEstimator(simulation.confidence)
+            interval.update_many([(value - avg) * score for value, score in zip(values, scores)])
+            results.append(Sensitivity(statistic, parameter, interval))
+    return results
@@ -1,17 +1,30 @@
 import csv
+from collections import deque
+from math import isfinite
 from typing import Type
 
 from blist import sortedlist
 
+from caballo.domestico.wwsimulator.closed import create_closed_population
+from caballo.domestico.wwsimulator.dispatch import create_dispatcher, replica_id
+from caballo.domestico.wwsimulator.distributions import create_distribution
 from caballo.domestico.wwsimulator.model import (FIFOQueue, Network, Node,
-                                                 PSQueue, Server, State)
+                                                 PSQueue, RoutingTable, Server,
+                                                 State)
 from caballo.domestico.wwsimulator.events import (Event,
                                                             EventContext,
                                                             EventHandler)
-from caballo.domestico.wwsimulator.streams import SERVICES_BASE
+from caballo.domestico.wwsimulator.nonstationary import create_nonstationary_arrivals
+from caballo.domestico.wwsimulator.statistics import IntervalEstimator
+from caballo.domestico.wwsimulator.timeouts import create_client_timeouts
+from caballo.domestico.wwsimulator.streams import SERVICES_BASE, SERVICES_NUM
+from caballo.domestico.wwsimulator.workload import create_trace_arrivals
 from pdsteele.des import rngs
 
 
+def _is_finite_number(value) -> bool:
+    return isinstance(value, (int, float)) and isfinite(value)
+
 class Simulation():
     """
     A simulation represents a run of the network model with a scheduler.
@@ -40,6 +53,64 @@ class Simulation():
         Name of the study this simulation belongs to. Used to group statistics.
         """
         self.sample = {}
+        self.confidence = 0.95
+        """
+        Confidence level of the intervals estimated over the iterations (batches or replicas).
+        """
+        self.intervals = {}
+        """
+        Confidence interval estimators of the statistics, updated as iterations complete.
+        key: statistic name
+        value: IntervalEstimator
+        """
+        self.on_iteration = None
+        """
+        Optional callback called with the simulation after each completed iteration, e.g. to report progress.
+        """
+    
+    def collect_iteration(self, statistics: dict):
+        """
+        Appends the statistic values of a completed iteration (batch or replica)
+        and updates their confidence intervals.
+        """
+        for key, value in statistics.items():
+            if key not in self.statistics:
+                self.statistics[key] = []
+            self.statistics[key].append(value)
+            if key not in self.intervals:
+                self.intervals[key] = IntervalEstimator(self.confidence)
+            interval = self.intervals[key]
+            if interval is not None:
+                if _is_finite_number(value):
+                    interval.update(value)
+                else:
+                    # no interval for statistics that are undefined in some iteration
+                    self.intervals[key] = None
+        if self.on_iteration is not None:
+            self.on_iteration(self)
+    
+    def set_statistics(self, statistics: dict):
+        """
+        Sets the statistic values of all the iterations at once (e.g. loaded from the result store)
+        and computes their confidence intervals.
+        """
+        self.statistics = statistics
+        self.intervals = {}
+        for key, values in statistics.items():
+            values = values if isinstance(values, list) else [values]
+            if all(_is_finite_number(value) for value in values):
+                self.intervals[key] = IntervalEstimator(self.confidence)
+                self.intervals[key].update_many(values)
+            else:
+                self.intervals[key] = None
+    
+    def summary(self) -> list:
+        """
+        Returns the summary of the statistics over the iterations
+        as a list of (statistic, mean, half width, number of iterations).
+        """
+        return [(key, interval.avg, interval.half_width(), interval.n_samples)
+                for key, interval in sorted(self.intervals.items()) if interval is not None]
     
     def run(self):
         # init prng streams with initial seed
@@ -47,6 +118,8 @@ class Simulation():
         # consume events until the scheduler has no more events
         while self.scheduler.has_next():
             self.scheduler.next()
+        # estimators that save their statistics lazily save them at the end of the run
+        self.scheduler.flush_subscribers()
     
     def print_statistics(self, output_file_path):
 
@@ -64,6 +137,15 @@ class Simulation():
                     iteration = 0
                     value = values
                     writer.writerow({"iteration": iteration, "statistic": statistic, "value": value})  
+    def print_summary(self, output_file_path):
+
+        with open(output_file_path, "w") as output_file:
+            fieldnames = ["statistic", "mean", "half_width", "iterations", "confidence"]
+            writer = csv.DictWriter(output_file, fieldnames=fieldnames)
+            writer.writeheader()
+            for statistic, mean, half_width, iterations in self.summary():
+                writer.writerow({"statistic": statistic, "mean": mean, "half_width": half_width, "iterations": iterations, "confidence": self.confidence})
+
     # new
     def print_sample_statistics(self, output_file_path):
 
@@ -76,24 +158,98 @@ class Simulation():
                 for sample_tuple in iteration[0]:
                     writer.writerow({"statistic": statistic, "value": sample_tuple[0], "time": sample_tuple[1]}) 
 
+WEBAPP_ROUTING = {
+    "entry": [{"node": "A", "class": 0, "p": 1.0}],
+    "matrix": [
+        {"from": {"node": "A", "class": 0}, "to": [{"node": "B", "class": 0, "p": 1.0}]},
+        {"from": {"node": "B", "class": 0}, "to": [{"node": "A", "class": 1, "p": 1.0}]},
+        {"from": {"node": "A", "class": 1}, "to": [{"node": "P", "class": 1, "p": 1.0}]},
+        {"from": {"node": "P", "class": 1}, "to": [{"node": "A", "class": 2, "p": 1.0}]},
+        {"from": {"node": "A", "class": 2}, "to": []}
+    ]
+}
+"""
+Routing of the web app workflow (A -> B -> A -> P -> A), used by experiments
+that do not describe their own routing matrix.
+"""
+
 class SimulationFactory():
+    def create_routing(self, experiment, node_ids: list, n_classes: int) -> RoutingTable:
+        """
+        Compiles the routing matrix of the experiment into a routing table indexed by integers,
+        given the ids of the nodes of the experiment (before their replicas are created).
+        """
+        routing = experiment.get('routing', WEBAPP_ROUTING)
+        node_indexes = {node_id: index for index, node_id in enumerate(node_ids)}
+
+        def destination(hop):
+            if hop['node'] not in node_indexes:
+                raise ValueError(f"Unknown node {hop['node']} in routing matrix")
+            return node_indexes[hop['node']], hop['class']
+
+        entries = [destination(hop) + (hop.get('p', 1.0),) for hop in routing['entry']]
+        rows = {}
+        for row in routing['matrix']:
+            rows[destination(row['from'])] = [destination(hop) + (hop.get('p', 1.0),) for hop in row['to']]
+        return RoutingTable(len(node_ids), n_classes, entries, rows)
+
     def create_network(self, experiment, lambda_val) -> Network:
         nodes = []
-        prng_streams_services = {"A": SERVICES_BASE, "B": SERVICES_BASE + 1, "P": SERVICES_BASE + 2}
         node_list = experiment["nodes"]
-        for node in node_list:
-            server = Server(node['server_capacity'], node['server_distr']['type'], prng_streams_services[node['name']])
-            if node['queue_discipline']['type'] == 'fifo':
-                queue = FIFOQueue(node['queue_capacity'], node['queue_discipline']['params'])
-            elif node['queue_discipline']['type'] == 'ps':
-                queue = PSQueue(node['queue_capacity'], node['queue_discipline']['params'])
-            else:
-                raise ValueError("Queue discipline not supported")
-            node = Node(node['name'], node['server_distr']['params'], server, queue)
-            nodes.append(node)
-        state = State(experiment['state'])
+        if len(node_list) > SERVICES_NUM:
+            raise ValueError(f"At most {SERVICES_NUM} nodes are supported, got {len(node_list)}")
+        groups = []
+        for node_index, node in enumerate(node_list):
+            # the distribution of each class has the mean of its rate, classes with rate 0 are not served
+            distributions = [create_distribution(node['server_distr'], 1.0 / float(rate)) if rate > 0 else None
+                             for rate in node['server_distr']['params']]
+            # server_capacity is the number of servers (cores), queue_capacity the jobs that can wait (null if unlimited)
+            servers = node.get('server_capacity', 1)
+            # a replicated node is a pool of identical nodes behind a dispatcher, sharing the service stream of the node
+            n_replicas = node.get('replicas', 1)
+            if n_replicas < 1:
+                raise ValueError(f"Node {node['name']} must have at least one replica")
+            group = []
+            for replica in range(n_replicas):
+                server = Server(servers, node['server_distr']['type'], SERVICES_BASE + node_index, distributions)
+                if node['queue_discipline']['type'] == 'fifo':
+                    queue = FIFOQueue(node.get('queue_capacity'), node['queue_discipline']['params'], servers)
+                elif node['queue_discipline']['type'] == 'ps':
+                    queue = PSQueue(node.get('queue_capacity'), node['queue_discipline']['params'], servers)
+                else:
+                    raise ValueError("Queue discipline not supported")
+                node_id = node['name'] if n_replicas == 1 else replica_id(node['name'], replica)
+                group.append(Node(node_id, node['server_distr']['params'], server, queue))
+            if n_replicas > 1:
+                create_dispatcher(node.get('dispatch', {}), group)
+            groups.append(group)
+            nodes.extend(group)
+        n_classes = max(len(node.service_rate) for node in nodes)
+        if 'state' in experiment:
+            # the initial jobs of a replicated node are at its first replica
+            state = State([list(row) if replica == 0 else [0] * len(row)
+                           for row, group in zip(experiment['state'], groups) for replica in range(len(group))])
+        else:
+            state = State([[0] * n_classes for _ in nodes])
+        node_ids = [node['name'] for node in node_list]
+        routing = self.create_routing(experiment, node_ids, n_classes)
         # creazione della rete
-        return Network(nodes, state, experiment['arrival_distr']['type'], [lambda_val])
+        network = Network(nodes, state, experiment['arrival_distr']['type'], [lambda_val], routing, groups)
+        if network.job_arrival_distr == 'trace':
+            # lambda is the load factor of the replayed log
+            node_indexes = {node_id: index for index, node_id in enumerate(node_ids)}
+            network.arrival_source = create_trace_arrivals(experiment['arrival_distr'], node_indexes, lambda_val)
+        elif network.job_arrival_distr == 'closed':
+            # lambda is the number of users
+            network.population = create_closed_population(experiment['arrival_distr'], network, lambda_val)
+        elif network.job_arrival_distr == 'nonstationary':
+            # lambda is the mean rate of the profile
+            network.arrival_source = create_nonstationary_arrivals(experiment['arrival_distr'], lambda_val)
+        else:
+            network.arrival_distribution = create_distribution(experiment['arrival_distr'], 1.0 / float(lambda_val))
+        if 'timeouts' in experiment:
+            network.timeouts = create_client_timeouts(experiment['timeouts'], n_classes)
+        return network
     """
     factory for creating simulations.
     """
@@ -114,6 +270,15 @@ class SimulationFactory():
 class NextEventScheduler:
     def __init__(self, simulation: Simulation):
         self._event_list = sortedlist(key=lambda event: event.time)
+        self._immediate_events = deque()
+        """
+        FIFO micro-queue of events scheduled at the current simulation time
+        (e.g. zero-delay routing of a job to the next node). They bypass the sorted event list.
+        """
+        self.clock = 0.0
+        """
+        Time of the last processed (i.e. not cancelled) event.
+        """
         self._simulation = simulation
         self.stop=False
         self._subscribers_by_topic = {}
@@ -134,19 +299,28 @@ class NextEventScheduler:
         """
         Return true if there are more events to process.
         """
-        return not self.stop and len(self._event_list) > 0
+        return not self.stop and (len(self._immediate_events) > 0 or len(self._event_list) > 0)
+    
+    def _pop_next_event(self) -> Event:
+        # events in the sorted list at the current time have been scheduled before
+        # any immediate event, so they keep precedence as they would in a single sorted list
+        if len(self._immediate_events) > 0:
+            if len(self._event_list) == 0 or self._event_list[0].time > self.clock:
+                return self._immediate_events.popleft()
+        return self._event_list.pop(0)
         
     def next(self):
         """
         Consumes the event with the earliest scheduled time in the event list
         and calls the event handler.
         """
-        if len(self._event_list) == 0:
+        if len(self._immediate_events) == 0 and len(self._event_list) == 0:
             raise ValueError("No more events to process.")
         
         # gets event from event list and creates context
-        event = self._event_list.pop(0)
+        event = self._pop_next_event()
         if not event.is_cancelled:
+            self.clock = event.time
 
             context = EventContext(event, self._simulation.network, self, self._simulation.statistics, self._simulation.sample)
 
@@ -163,9 +337,14 @@ class NextEventScheduler:
         """
         Adds the event to the event list with an optional delay
         added to its scheduling time.
+        Events scheduled at the current simulation time are queued FIFO
+        in the immediate micro-queue instead of the sorted event list.
         """
         event.time += delay
-        self._event_list.add(event)
+        if event.time == self.clock:
+            self._immediate_events.append(event)
+        else:
+            self._event_list.add(event)
     
     def cancel(self, event: Event):
         """
@@ -202,4 +381,22 @@ class NextEventScheduler:
                         subscriber.reset(context)
                     except AttributeError:
                         pass
+                    seen.append(subscriber)
+    
+    def flush_subscribers(self, context: EventContext = None):
+        """
+        For each subscriber, tries to flush it.
+        A subscriber must implement a flush method if it does not save its statistics
+        at each event (e.g. time-averaged estimators) and must save them at the end of a run.
+        @param context: context of the event triggering the flush, by default an event at the current time
+        """
+        if context is None:
+            context = EventContext(Event(self.clock, None), self._simulation.network, self, self._simulation.statistics, self._simulation.sample)
+        seen = []
+        for topic in self._subscribers_by_topic:
+            for subscriber in self._subscribers_by_topic[topic]:
+                if subscriber not in seen:
+                    flush = getattr(subscriber, "flush", None)
+                    if flush is not None:
+                        flush(context)
                     seen.append(subscriber)
\ No newline at end of file
@@ -1,5 +1,8 @@
 from abc import ABC
-from math import inf, sqrt
+from math import ceil, inf, log, sqrt
+
+import numpy as np
+from pdsteele.des import rvms
 
 class WelfordEstimator():
     """
@@ -63,6 +66,63 @@ class WelfordEstimator():
         self.n_samples += 1
         self._update(sample)
     
+    def _merge(self, n_samples: float, avg: float, sum_squares: float, minimum: float, maximum: float):
+        """
+        Merges the statistics of another sequence of samples into this one
+        using the Chan et al. pairwise algorithm.
+        > Chan, Golub, LeVeque - Updating Formulae and a Pairwise Algorithm for Computing Sample Variances (1979)
+        """
+        if n_samples <= 0:
+            return
+        total = self._n_samples + n_samples
+        diff = avg - self.avg
+        self.avg += diff * n_samples / total
+        self._sum += sum_squares + diff * diff * self._n_samples * n_samples / total
+        self._n_samples = total
+        self._prev_n_samples = total
+        self.std = sqrt(self._sum / total)
+        self.min = minimum if minimum < self.min else self.min
+        self.max = maximum if maximum > self.max else self.max
+    
+    def merge(self, other: "WelfordEstimator"):
+        """
+        Merges the samples observed by another estimator into this one,
+        as if they were all observed by this estimator.
+        """
+        if type(other) is not type(self):
+            raise ValueError(f"Cannot merge {type(other).__qualname__} into {type(self).__qualname__}")
+        self._merge(other._n_samples, other.avg, other._sum, other.min, other.max)
+        return self
+    
+    def update_many(self, samples):
+        """
+        Updates the statistics with a sequence of samples at once.
+        """
+        samples = np.asarray(samples, dtype=float)
+        if samples.size == 0:
+            return
+        avg = samples.mean()
+        self._merge(samples.size, avg, float(np.square(samples - avg).sum()), samples.min(), samples.max())
+    
+    def serialize(self) -> tuple:
+        """
+        Compact form of the estimator, suitable to be sent to another process and merged there.
+        """
+        return (self._n_samples, self.avg, self._sum, self.min, self.max)
+    
+    @classmethod
+    def deserialize(cls, data):
+        estimator = cls()
+        n_samples, avg, sum_squares, minimum, maximum = data
+        estimator._n_samples = n_samples
+        estimator._prev_n_samples = n_samples
+        estimator.avg = avg
+        estimator._sum = sum_squares
+        estimator.std = sqrt(sum_squares / n_samples) if n_samples > 0 else 0
+        estimator.min = minimum
+        estimator.max = maximum
+        return estimator
+    
     def __str__(self):
         return "for a sample of size {0:d}\n".format(self._n_samples) \
             + "mean ................. = {0:7.8f}\n".format(self.avg) \
@@ -73,15 +133,381 @@ class WelfordEstimator():
 class WelfordTimeAveragedEstimator(WelfordEstimator):
     """
     A variant of the WelfordEstimator intended to be used to compute
-    time-averaged statistics.
+    time-averaged statistics. Each sample is the value held by the observed variable
+    since the previous update, and its weight is the time elapsed since then.
+    The number of samples is the observed time.
     > Lawrence M. Leemis_ Stephen K. Park - Discrete-Event Simulation_ A First Course-Prentice Hall (2004), Chapter 4. Statistics, p. 146, Theorem 4.1.4
     """
 
-    def __init__(self):
+    def __init__(self, start_time: float = 0.0):
         super().__init__()
+        self.last_time = start_time
+        """
+        Time of the last update, the observation starts at start_time.
+        """
     
     def update(self, sample: float, time: float):
         
-        self.n_samples = time
+        self.n_samples = self._n_samples + (time - self.last_time)
+        self.last_time = time
         self._update(sample)
+    
+    def update_many(self, samples, times):
+        """
+        Updates the statistics with a sequence of samples at once.
+        samples[i] is the value held by the variable from times[i-1] to times[i].
+        """
+        samples = np.asarray(samples, dtype=float)
+        times = np.asarray(times, dtype=float)
+        if samples.size == 0:
+            return
+        weights = np.diff(times, prepend=self.last_time)
+        self.last_time = float(times[-1])
+        total = weights.sum()
+        if total <= 0:
+            return
+        avg = float(np.dot(weights, samples) / total)
+        self._merge(total, avg, float(np.dot(weights, np.square(samples - avg))), samples.min(), samples.max())
+    
+    def merge(self, other: "WelfordTimeAveragedEstimator"):
+        """
+        Merges the observation of another estimator (e.g. of the next time window) into this one,
+        the next update weighting its sample by the time elapsed since the later of the two observations.
+        """
+        super().merge(other)
+        self.last_time = max(self.last_time, other.last_time)
+        return self
+    
+    def serialize(self) -> tuple:
+        return super().serialize() + (self.last_time,)
+    
+    @classmethod
+    def deserialize(cls, data):
+        estimator = super().deserialize(data[:-1])
+        estimator.last_time = data[-1]
+        return estimator
+
+
+class IntervalEstimator(WelfordEstimator):
+    """
+    Estimates the mean of a statistic from its values in independent iterations
+    (batches or replicas) together with its Student-t confidence interval.
+    > Lawrence M. Leemis_ Stephen K. Park - Discrete-Event Simulation_ A First Course-Prentice Hall (2004), Chapter 8. Output Analysis, p. 362, Algorithm 8.1.1
+    """
+
+    def __init__(self, confidence: float = 0.95):
+        super().__init__()
+        self.confidence = confidence
+
+    def half_width(self) -> float:
+        """
+        Half width of the confidence interval of the mean, inf with less than 2 iterations.
+        """
+        if self.n_samples < 2:
+            return inf
+        u = 1.0 - 0.5 * (1.0 - self.confidence)
+        t = rvms.idfStudent(self.n_samples - 1, u)
+        return t * self.std / sqrt(self.n_samples - 1)
+
+class RatioEstimator():
+    """
+    Estimates the ratio E[Y]/E[X] of the means of paired samples (Y, X), e.g. the sums
+    over the cycles of a regenerative simulation, with its confidence interval.
+    The (co)variances are updated with the one-pass Welford algorithm and can be merged.
+    > Averill M. Law - Simulation Modeling and Analysis, 5th ed., McGraw-Hill (2015), Chapter 9. Output Data Analysis, Regenerative Method
+    """
+
+    def __init__(self, confidence: float = 0.95):
+        self.confidence = confidence
+        self.n_samples = 0
+        self._avg_y = 0.0
+        self._avg_x = 0.0
+        self._sum_yy = 0.0
+        self._sum_xx = 0.0
+        self._sum_xy = 0.0
+    
+    @property
+    def avg(self):
+        """
+        Estimate of the ratio.
+        """
+        return self._avg_y / self._avg_x if self._avg_x != 0 else 0.0
+    
+    def update(self, y: float, x: float):
+        self.n_samples += 1
+        diff_x = x - self._avg_x
+        diff_y = y - self._avg_y
+        self._avg_x += diff_x / self.n_samples
+        self._avg_y += diff_y / self.n_samples
+        self._sum_xx += diff_x * (x - self._avg_x)
+        self._sum_yy += diff_y * (y - self._avg_y)
+        self._sum_xy += diff_x * (y - self._avg_y)
+    
+    def half_width(self) -> float:
+        """
+        Half width of the confidence interval of the ratio, inf with less than 2 samples.
+        """
+        if self.n_samples < 2 or self._avg_x == 0:
+            return inf
+        ratio = self.avg
+        variance = (self._sum_yy - 2 * ratio * self._sum_xy + ratio * ratio * self._sum_xx) / (self.n_samples - 1)
+        u = 1.0 - 0.5 * (1.0 - self.confidence)
+        t = rvms.idfStudent(self.n_samples - 1, u)
+        return t * sqrt(max(variance, 0.0)) / (self._avg_x * sqrt(self.n_samples))
+    
+    def merge(self, other: "RatioEstimator"):
+        """
+        Merges the samples observed by another estimator into this one.
+        """
+        if other.n_samples == 0:
+            return self
+        total = self.n_samples + other.n_samples
+        weight = self.n_samples * other.n_samples / total
+        diff_x = other._avg_x - self._avg_x
+        diff_y = other._avg_y - self._avg_y
+        self._sum_xx += other._sum_xx + diff_x * diff_x * weight
+        self._sum_yy += other._sum_yy + diff_y * diff_y * weight
+        self._sum_xy += other._sum_xy + diff_x * diff_y * weight
+        self._avg_x += diff_x * other.n_samples / total
+        self._avg_y += diff_y * other.n_samples / total
+        self.n_samples = total
+        return self
+    
+    def serialize(self) -> tuple:
+        return (self.confidence, self.n_samples, self._avg_y, self._avg_x, self._sum_yy, self._sum_xx, self._sum_xy)
+    
+    @classmethod
+    def deserialize(cls, data):
+        confidence, n_samples, avg_y, avg_x, sum_yy, sum_xx, sum_xy = data
+        estimator = cls(confidence)
+        estimator.n_samples = n_samples
+        estimator._avg_y, estimator._avg_x = avg_y, avg_x
+        estimator._sum_yy, estimator._sum_xx, estimator._sum_xy = sum_yy, sum_xx, sum_xy
+        return estimator
+
+class MSEREstimator():
+    """
+    Estimates the end of the warm-up period of a sequence of samples with the
+    Marginal Standard Error Rule on the means of batches of batch_size samples (MSER-5 by default).
+    The truncation point is the number of batches d that minimizes the squared standard error
+    of the mean of the remaining batches, sum((Y_i - avg_d)^2) / (n - d)^2, with d at most n / 2.
+    > White, Cobb, Spratt - A comparison of five steady-state truncation heuristics for simulation (2000)
+    """
 
+    def __init__(self, batch_size: int = 5):
+        self.batch_size = batch_size
+        self.n_samples = 0
+        self._batch_sum = 0.0
+        self._batch_means = []
+        self._batch_times = []
+        """
+        Time of the last sample of each batch.
+        """
+    
+    @property
+    def n_batches(self):
+        return len(self._batch_means)
+    
+    def update(self, sample: float, time: float = None):
+        self.n_samples += 1
+        self._batch_sum += sample
+        if self.n_samples % self.batch_size == 0:
+            self._batch_means.append(self._batch_sum / self.batch_size)
+            self._batch_times.append(time)
+            self._batch_sum = 0.0
+    
+    def truncation(self) -> int:
+        """
+        Number of batches to truncate, None if the minimum is not in the first half
+        of the batches, i.e. the sequence is too short to leave the warm-up period.
+        """
+        n = self.n_batches
+        if n < 2:
+            return None
+        means = np.asarray(self._batch_means, dtype=float)
+        # sums of the batches from d onwards, for each d
+        suffix_sum = np.cumsum(means[::-1])[::-1]
+        suffix_sum_squares = np.cumsum(np.square(means[::-1]))[::-1]
+        counts = np.arange(n, 0, -1, dtype=float)
+        mser = (suffix_sum_squares - np.square(suffix_sum) / counts) / np.square(counts)
+        d = int(np.argmin(mser[:n // 2 + 1]))
+        return d if d < n // 2 else None
+    
+    def cutoff_time(self, truncation: int) -> float:
+        """
+        Time of the last truncated sample, None if no sample is truncated.
+        """
+        return self._batch_times[truncation - 1] if truncation > 0 else None
+
+class HistogramQuantileEstimator():
+    """
+    Estimates quantiles of a sequence of positive samples in bounded memory
+    using a histogram with logarithmically sized buckets (HDR/DDSketch style).
+    The estimated quantiles have a relative error of at most `relative_accuracy`
+    for samples in [min_value, max_value], samples out of range are clamped.
+    Two estimators with the same configuration can be merged by summing their buckets.
+    > Masson, Rim, Lee - DDSketch: A Fast and Fully-Mergeable Quantile Sketch with Relative-Error Guarantees (2019)
+
+    The tracked quantiles are kept up to date at each update by moving a cursor
+    on the buckets, so reading them costs O(1).
+    """
+
+    def __init__(self, quantiles=(0.5, 0.95, 0.99), relative_accuracy: float = 0.01, min_value: float = 1e-6, max_value: float = 1e6):
+        self.quantiles = tuple(quantiles)
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = log(self._gamma)
+        self._offset = ceil(log(min_value) / self._log_gamma)
+        self._counts = [0] * (ceil(log(max_value) / self._log_gamma) - self._offset + 1)
+        self._n_samples = 0
+        self._cursors = [[0, 0] for _ in self.quantiles]
+        """
+        For each tracked quantile, the bucket holding it and the number of samples in the buckets before it.
+        """
+        self.min = +inf
+        self.max = -inf
+    
+    @property
+    def n_samples(self):
+        return self._n_samples
+
+    def _bucket(self, sample: float) -> int:
+        if sample <= self.min_value:
+            return 0
+        if sample >= self.max_value:
+            return len(self._counts) - 1
+        return ceil(log(sample) / self._log_gamma) - self._offset
+    
+    def _bucket_value(self, bucket: int) -> float:
+        # the bucket k holds (gamma^(k-1), gamma^k], its representative has relative error <= relative_accuracy
+        return 2 * self._gamma ** (bucket + self._offset) / (self._gamma + 1)
+
+    def _move_cursor(self, cursor: list, rank: int):
+        counts = self._counts
+        bucket, below = cursor
+        while rank >= below + counts[bucket]:
+            below += counts[bucket]
+            bucket += 1
+        while rank < below:
+            bucket -= 1
+            below -= counts[bucket]
+        cursor[0] = bucket
+        cursor[1] = below
+
+    def update(self, sample: float):
+        bucket = self._bucket(sample)
+        self._counts[bucket] += 1
+        self._n_samples += 1
+        if sample > self.max:
+            self.max = sample
+        if sample < self.min:
+            self.min = sample
+
+        for q, cursor in zip(self.quantiles, self._cursors):
+            if bucket < cursor[0]:
+                cursor[1] += 1
+            self._move_cursor(cursor, int(q * (self._n_samples - 1)))
+    
+    def _reset_cursors(self):
+        # the cursors are placed with a binary search on the cumulative counts instead of scanning the buckets
+        cumulative = np.cumsum(self._counts)
+        for q, cursor in zip(self.quantiles, self._cursors):
+            cursor[0] = 0
+            cursor[1] = 0
+            if self._n_samples > 0:
+                bucket = int(np.searchsorted(cumulative, int(q * (self._n_samples - 1)), side='right'))
+                cursor[0] = bucket
+                cursor[1] = int(cumulative[bucket - 1]) if bucket > 0 else 0
+
+    def update_many(self, samples):
+        samples = np.asarray(samples, dtype=float)
+        if samples.size == 0:
+            return
+        clamped = np.clip(samples, self.min_value, self.max_value)
+        buckets = np.ceil(np.log(clamped) / self._log_gamma).astype(int) - self._offset
+        buckets = np.clip(buckets, 0, len(self._counts) - 1)
+        self._counts = (np.asarray(self._counts) + np.bincount(buckets, minlength=len(self._counts))).tolist()
+        self._n_samples += samples.size
+        self.min = min(self.min, float(samples.min()))
+        self.max = max(self.max, float(samples.max()))
+        self._reset_cursors()
+
+    def quantile(self, q: float) -> float:
+        """
+        Returns the estimate of the q-quantile, q in [0, 1].
+        """
+        if self._n_samples == 0:
+            return 0.0
+        if q in self.quantiles:
+            bucket = self._cursors[self.quantiles.index(q)][0]
+        else:
+            cursor = [0, 0]
+            self._move_cursor(cursor, int(q * (self._n_samples - 1)))
+            bucket = cursor[0]
+        # exact bounds are known, the estimate must not exceed them
+        return min(max(self._bucket_value(bucket), self.min), self.max)
+    
+    def merge(self, other: "HistogramQuantileEstimator"):
+        """
+        Merges the samples observed by another estimator into this one.
+        """
+        if (other.relative_accuracy, other.min_value, other.max_value) != (self.relative_accuracy, self.min_value, self.max_value):
+            raise ValueError("Cannot merge quantile estimators with different bucket configuration")
+        self._counts = [count + other_count for count, other_count in zip(self._counts, other._counts)]
+        self._n_samples += other._n_samples
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._reset_cursors()
+        return self
+    
+    def serialize(self) -> tuple:
+        """
+        Compact form of the estimator, only non empty buckets are kept.
+        """
+        buckets = tuple((bucket, count) for bucket, count in enumerate(self._counts) if count > 0)
+        return (self.quantiles, self.relative_accuracy, self.min_value, self.max_value, self.min, self.max, buckets)
+    
+    @classmethod
+    def deserialize(cls, data):
+        quantiles, relative_accuracy, min_value, max_value, minimum, maximum, buckets = data
+        estimator = cls(quantiles, relative_accuracy, min_value, max_value)
+        for bucket, count in buckets:
+            estimator._counts[bucket] = count
+            estimator._n_samples += count
+        estimator.min = minimum
+        estimator.max = maximum
+        estimator._reset_cursors()
+        return estimator
+
+class GroupedSamples():
+    """
+    Samples of a statistic by (replica, label), collected in chunks (e.g. of one step of the lockstep engine)
+    and grouped only at the end of the run.
+    """
+    def __init__(self):
+        self._replicas = []
+        self._labels = []
+        self._values = []
+
+    def add(self, replicas: np.ndarray, labels: np.ndarray, values: np.ndarray):
+        if len(replicas) > 0:
+            self._replicas.append(replicas)
+            self._labels.append(np.broadcast_to(labels, replicas.shape))
+            self._values.append(values)
+
+    def groups(self) -> dict:
+        """
+        Returns the samples as a dict (replica, label) -> array of values, in observation order.
+        """
+        if len(self._values) == 0:
+            return {}
+        replicas = np.concatenate(self._replicas)
+        labels = np.concatenate(self._labels)
+        values = np.concatenate(self._values)
+        order = np.lexsort((labels, replicas))
+        replicas, labels, values = replicas[order], labels[order], values[order]
+        bounds = np.flatnonzero((np.diff(replicas) != 0) | (np.diff(labels) != 0)) + 1
+        starts = np.concatenate(([0], bounds))
+        return {(int(replicas[start]), int(labels[start])): group for start, group in zip(starts, np.split(values, bounds))}
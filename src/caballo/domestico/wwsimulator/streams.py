@@ -1,3 +1,6 @@
+from math import log
+
+import numpy as np
 from pdsteele.des import rngs
 
 SERVICES_NUM = 64
@@ -16,8 +19,87 @@ SERVICES_BASE = 2
 Stream for generating service times. Streams from SERVICES_BASE up to SERVICES_BASE + SERVICES_NUM - 1
 are reserved for indipendent service times.
 """
+ROUTING = SERVICES_BASE + SERVICES_NUM
+"""
+Stream for the random choice of the next node/class of a job when routing is not deterministic.
+"""
+
+DISPATCH = ROUTING + 1
+"""
+Stream for the random choices of the dispatchers of replicated nodes.
+"""
 
+THINK = DISPATCH + 1
+"""
+Stream for the think times of the users of a closed workload.
+"""
+
+RETRY = THINK + 1
+"""
+Stream for the jitter of the backoff of the retries of the requests that timed out.
+"""
 
 # register more streams here ...
 
-NUM_STREAMS = rngs.STREAMS
\ No newline at end of file
+NUM_STREAMS = rngs.STREAMS
+
+antithetic = False
+"""
+When True the variates are generated from 1 - u instead of u, i.e. by the antithetic replica of a pair.
+"""
+
+def random(stream: int) -> float:
+    """
+    Returns the next uniform (0, 1) value of a stream, or its complement when antithetic.
+    """
+    rngs.selectStream(stream)
+    u = rngs.random()
+    return 1.0 - u if antithetic else u
+
+def randoms(stream: int, n: int) -> np.ndarray:
+    """
+    Returns the next n uniform (0, 1) values of a stream as an array, or their complements when antithetic:
+    the same values as n calls of random, computed at once as x_k = a^k * x mod m from the powers of the multiplier.
+    """
+    rngs.selectStream(stream)
+    if n <= 0:
+        return np.empty(0)
+    seeds = _multiplier_powers(n) * rngs.getSeed() % rngs.MODULUS
+    rngs.putSeed(int(seeds[-1]))
+    u = seeds / rngs.MODULUS
+    return 1.0 - u if antithetic else u
+
+_powers = np.array([rngs.MULTIPLIER], dtype=np.int64)
+
+def _multiplier_powers(n: int) -> np.ndarray:
+    """
+    a^1, ..., a^n mod m, doubling the cached powers as needed.
+    Products of two values below m = 2^31 - 1 fit in 64 bits.
+    """
+    global _powers
+    while len(_powers) < n:
+        k = min(len(_powers), n - len(_powers))
+        _powers = np.concatenate((_powers, _powers[:k] * _powers[-1] % rngs.MODULUS))
+    return _powers[:n]
+
+def exponential(stream: int, mean: float) -> float:
+    """
+    Exponential variate by inversion (as pdsteele.des.rvgs.Exponential) on a stream,
+    so that the same uniform maps to the same quantile for any mean (common random numbers).
+    """
+    return -mean * log(1.0 - random(stream))
+
+def independent_seeds(seed: int, n: int) -> list:
+    """
+    Returns n initial seeds starting from seed, e.g. the seeds of the replicas shared by all
+    the configurations of a sweep (common random numbers) or of parallel workers.
+    Planting a seed spaces its STREAMS streams by A256 jumps (8,367,782 numbers), so consecutive seeds
+    are STREAMS jumps apart: the streams of different seeds do not overlap as long as each one draws less than 8,367,782 numbers.
+    """
+    x = seed % rngs.MODULUS
+    seeds = []
+    for _ in range(n):
+        seeds.append(x)
+        for _ in range(rngs.STREAMS):
+            x = rngs.A256 * x % rngs.MODULUS
+    return seeds
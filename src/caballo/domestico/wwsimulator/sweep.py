@@ -0,0 +1,100 @@
+from typing import Callable
+
+from caballo.domestico.wwsimulator.analytic import service_demands
+from caballo.domestico.wwsimulator.model import Network
+
+
+def saturation_lambda(network: Network) -> float:
+    """
+    Arrival rate at which the bottleneck node saturates, 1 / max service demand per server
+    (over the servers of all the replicas of a node): the asymptote of the response time of an open network.
+    """
+    servers = [len(group) * group[0].queue.servers for group in network.groups]
+    return 1.0 / float(max(service_demands(network) / servers))
+
+class SweepPoint():
+    def __init__(self, lambda_val: float, avg: float, half_width: float):
+        self.lambda_val = lambda_val
+        self.avg = avg
+        self.half_width = half_width
+
+    def is_below(self, target: float):
+        return self.avg + self.half_width < target
+
+    def is_above(self, target: float):
+        return self.avg - self.half_width > target
+
+class SweepResult():
+    def __init__(self, target: float, points: list, lower: float, upper: float, estimate: float):
+        self.target = target
+        self.points = points
+        """
+        Evaluated points, in evaluation order.
+        """
+        self.lower = lower
+        """
+        Largest lambda whose statistic is below the target with confidence (its upper bound is below the target),
+        i.e. the confidence bound of the maximum sustainable lambda. None if not found.
+        """
+        self.upper = upper
+        """
+        Smallest lambda whose statistic is above the target with confidence.
+        """
+        self.estimate = estimate
+        """
+        Estimate of the maximum sustainable lambda, where the mean of the statistic crosses the target.
+        """
+
+def _crossing(low: SweepPoint, high: SweepPoint, target: float) -> float:
+    # the reciprocal of the response time is linear in lambda for a single M/M/1 node,
+    # and close to linear near the saturation of the bottleneck of a network
+    y_low, y_high = 1.0 / low.avg, 1.0 / high.avg
+    if y_low == y_high:
+        return (low.lambda_val + high.lambda_val) / 2
+    return low.lambda_val + (1.0 / target - y_low) * (high.lambda_val - low.lambda_val) / (y_high - y_low)
+
+def find_max_lambda(evaluate: Callable[[float], SweepPoint], target: float, lambda_low: float, lambda_high: float,
+                    tolerance: float = 0.01, max_runs: int = 12) -> SweepResult:
+    """
+    Searches the maximum arrival rate for which a statistic (e.g. SYSTEM-response_time-p99) stays below a target.
+    The bracket [lambda_low, lambda_high] is narrowed by regula falsi on the reciprocal of the statistic,
+    each new point being kept at least a tenth of the bracket away from its ends so that the bracket always shrinks,
+    until the bracket is narrower than tolerance * lambda_high, a point is not distinguishable from the target
+    within its confidence interval, or max_runs points are evaluated.
+    evaluate: returns the SweepPoint of a lambda, e.g. from a cached simulation run
+    lambda_high: a lambda above the maximum, e.g. saturation_lambda, that is never evaluated
+    """
+    points = []
+    low = evaluate(lambda_low)
+    points.append(low)
+    if not low.is_below(target):
+        above = low.is_above(target)
+        return SweepResult(target, points, None, lambda_low if above else None, None if above else lambda_low)
+
+    high = None
+    high_lambda = lambda_high
+    estimate = None
+    while len(points) < max_runs and high_lambda - low.lambda_val > tolerance * lambda_high:
+        width = high_lambda - low.lambda_val
+        if high is None:
+            lambda_val = low.lambda_val + width / 2
+        else:
+            lambda_val = _crossing(low, high, target)
+        lambda_val = min(max(lambda_val, low.lambda_val + width / 10), high_lambda - width / 10)
+
+        point = evaluate(lambda_val)
+        points.append(point)
+        if point.is_below(target):
+            low = point
+        elif point.is_above(target):
+            high = point
+            high_lambda = lambda_val
+        else:
+            # the statistic is at the target within its confidence interval
+            estimate = lambda_val
+            break
+
+    if estimate is None:
+        estimate = _crossing(low, high, target) if high is not None else low.lambda_val
+        estimate = min(max(estimate, low.lambda_val), high_lambda)
+    return SweepResult(target, points, low.lambda_val, high.lambda_val if high is not None else None, estimate)
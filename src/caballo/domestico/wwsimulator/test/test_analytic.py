@@ -0,0 +1,62 @@
+import json
+import unittest
+
+import numpy as np
+
+from caballo.domestico.wwsimulator import SIMULATION_FACTORY_CONFIG_PATH
+from caballo.domestico.wwsimulator.analytic import open_mva, open_network_means, service_demands, visit_ratios
+from caballo.domestico.wwsimulator.controlvariates import ControlVariates
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+
+
+class TestOpenNetwork(unittest.TestCase):
+    def setUp(self):
+        with open(SIMULATION_FACTORY_CONFIG_PATH, 'r') as file:
+            self.experiment = json.load(file)['exps'][0]
+        self.network = SimulationFactory().create_network(self.experiment, 0.8)
+
+    def test_webapp(self):
+        # A -> B -> A -> P -> A
+        np.testing.assert_allclose([[1, 1, 1], [1, 0, 0], [0, 1, 0]], visit_ratios(self.network))
+        np.testing.assert_allclose([1 / 5 + 1 / 2.5 + 1 / 10, 1 / 1.25, 1 / 2.5], service_demands(self.network))
+
+        means = open_network_means(self.network)
+        self.assertAlmostEqual(1.25, means["SYSTEM-interarrival-avg"])
+        self.assertAlmostEqual(0.7 / 3, means["A-service-avg"])
+        self.assertAlmostEqual(0.64 / 0.36, means["B-population-avg"])
+        self.assertAlmostEqual((0.56 / 0.44 + 0.64 / 0.36 + 0.32 / 0.68) / 0.8, means["SYSTEM-response_time-avg"])
+
+    def test_multi_server(self):
+        # M/M/4 with lambda = 3, mu = 1, saturated as a single server: C(4, 3) = 13.5 / 26.5, R = C / (4 mu - lambda) + 1 / mu
+        experiment = {
+            "simulation_study": "capacity",
+            "arrival_distr": {"type": "poisson"},
+            "nodes": [{"name": "A", "server_distr": {"type": "exp", "params": [1.0]}, "queue_discipline": {"type": "ps", "params": []},
+                       "server_capacity": 4, "queue_capacity": None}],
+            "routing": {"entry": [{"node": "A", "class": 0}], "matrix": []}
+        }
+        network = SimulationFactory().create_network(experiment, 3.0)
+        response_time = 13.5 / 26.5 + 1.0
+        # busy unless empty, p0 = 1 / 26.5
+        utilization = 1.0 - 1.0 / 26.5
+        for means in (open_mva(network), open_network_means(network)):
+            self.assertAlmostEqual(response_time, means["A-response_time-avg"])
+            self.assertAlmostEqual(3.0 * response_time, means["SYSTEM-population-avg"])
+            self.assertAlmostEqual(utilization, means["A-utilization-avg"])
+        self.assertEqual(float("inf"), open_mva(SimulationFactory().create_network(experiment, 4.0))["SYSTEM-response_time-avg"])
+
+class TestControlVariates(unittest.TestCase):
+    def test_estimate(self):
+        prng = np.random.default_rng(1234)
+        control = prng.exponential(1.0, 50)
+        noise = prng.normal(0.0, 0.1, 50)
+        statistics = {"SYSTEM-response_time-avg": list(2.0 + 3.0 * (control - 1.0) + noise),
+                      "SYSTEM-interarrival-avg": list(control)}
+        estimate = ControlVariates({"SYSTEM-interarrival-avg": 1.0}).estimate(statistics, "SYSTEM-response_time-avg")
+        self.assertEqual(["SYSTEM-interarrival-avg"], estimate.controls)
+        self.assertAlmostEqual(2.0, estimate.avg, delta=3 * estimate.half_width)
+        self.assertLess(estimate.half_width, 0.1)
+        self.assertGreater(estimate.variance_reduction, 0.99)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+from math import factorial
+
+from caballo.domestico.wwsimulator.events import ArrivalEvent
+from caballo.domestico.wwsimulator.handlers import ArrivalsGeneratorSubscriber, HandleFirstArrival
+from caballo.domestico.wwsimulator.lockstep import create_lockstep_simulation
+from caballo.domestico.wwsimulator.main import subscribe_estimators
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+from caballo.domestico.wwsimulator.trace import LOSS, read_trace, record_trace
+from caballo.domestico.wwsimulator.traceanalysis import TraceAnalysis
+
+
+def _node(name: str, rate: float, discipline: str, servers: int, queue_capacity) -> dict:
+    return {"name": name, "server_distr": {"type": "exp", "params": [rate]}, "queue_discipline": {"type": discipline, "params": []},
+            "server_capacity": servers, "queue_capacity": queue_capacity}
+
+def _experiment(nodes: list, matrix: list = ()) -> dict:
+    return {
+        "simulation_study": "capacity",
+        "arrival_distr": {"type": "poisson"},
+        "nodes": nodes,
+        "routing": {"entry": [{"node": nodes[0]["name"], "class": 0}], "matrix": list(matrix)}
+    }
+
+def _erlang_c(servers: int, load: float) -> float:
+    """
+    Probability of waiting in a M/M/c queue with the given offered load lambda / mu.
+    """
+    rho = load / servers
+    top = load ** servers / factorial(servers) / (1.0 - rho)
+    return top / (sum(load ** k / factorial(k) for k in range(servers)) + top)
+
+class TestCapacity(unittest.TestCase):
+
+    def _run(self, experiment: dict, lambda_val: float, num_arrivals: int = 20000):
+        simulation = SimulationFactory().create(HandleFirstArrival(), experiment, lambda_val, seed=1234)
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(num_arrivals))
+        subscribe_estimators(simulation)
+        simulation.run()
+        return simulation
+
+    def test_multi_server(self):
+        # M/M/4 (Erlang C): R = C / (c mu - lambda) + 1 / mu, the same mean for 4 cores shared by PS
+        expected = _erlang_c(4, 3.0) / (4.0 - 3.0) + 1.0
+        for discipline in ("fifo", "ps"):
+            simulation = self._run(_experiment([_node("A", 1.0, discipline, 4, None)]), 3.0)
+            self.assertAlmostEqual(expected, simulation.statistics["SYSTEM-response_time-avg"], delta=0.1 * expected, msg=discipline)
+            # unlimited buffers: no losses are estimated
+            self.assertNotIn("SYSTEM-blocking-val", simulation.statistics)
+
+    def test_single_server(self):
+        # a single server has the full rate, as before
+        experiment = _experiment([_node("A", 2.0, "ps", 1, None)])
+        self.assertAlmostEqual(1.0, self._run(experiment, 1.0).statistics["SYSTEM-response_time-avg"], delta=0.1)
+
+    def test_finite_buffer(self):
+        # M/M/1/K with K = 3: P(block) = (1 - rho) rho^K / (1 - rho^(K + 1))
+        rho = 0.8
+        expected = (1 - rho) * rho ** 3 / (1 - rho ** 4)
+        for discipline in ("fifo", "ps"):
+            statistics = self._run(_experiment([_node("A", 1.25, discipline, 1, 2)]), 1.0).statistics
+            self.assertAlmostEqual(expected, statistics["A-blocking-val"], delta=0.1 * expected, msg=discipline)
+            self.assertEqual(statistics["A-blocking-val"], statistics["SYSTEM-blocking-val"])
+            self.assertAlmostEqual(expected, statistics["SYSTEM-loss_rate-val"], delta=0.1 * expected, msg=discipline)
+            self.assertLessEqual(statistics["A-population-max"], 3)
+
+    def test_loss_system(self):
+        # M/M/3/3 (Erlang B) with offered load 2
+        expected = (8.0 / 6.0) / (1.0 + 2.0 + 2.0 + 8.0 / 6.0)
+        statistics = self._run(_experiment([_node("A", 1.0, "ps", 3, 0)]), 2.0).statistics
+        self.assertAlmostEqual(expected, statistics["SYSTEM-blocking-val"], delta=0.05 * expected)
+        self.assertAlmostEqual(1.0, statistics["A-response_time-avg"], delta=0.05)
+
+    def test_internal_losses(self):
+        # the jobs dropped by B were in the system, and leave it
+        experiment = _experiment([_node("A", 2.0, "ps", 2, None), _node("B", 1.5, "fifo", 1, 1)],
+                                 [{"from": {"node": "A", "class": 0}, "to": [{"node": "B", "class": 0, "p": 1.0}]}])
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "simulation.trace")
+            simulation = SimulationFactory().create(HandleFirstArrival(), experiment, 1.2, seed=1234)
+            simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(5000))
+            subscribe_estimators(simulation)
+            record_trace(simulation, path)
+            simulation.run()
+            trace = read_trace(path)
+            statistics = simulation.statistics
+            lost = int((trace["kind"] == LOSS).sum())
+            self.assertGreater(lost, 0)
+            self.assertEqual(5000, statistics["SYSTEM-completions-val"] + lost)
+            self.assertAlmostEqual(statistics["A-population-avg"] + statistics["B-population-avg"], statistics["SYSTEM-population-avg"])
+            self.assertAlmostEqual(lost / 5000, statistics["SYSTEM-blocking-val"])
+            # the trace analysis agrees with the estimators
+            offline = TraceAnalysis(trace, ["A", "B"]).statistics()
+            for name in ("SYSTEM-population-avg", "B-population-avg", "SYSTEM-response_time-avg", "B-utilization-avg", "SYSTEM-busytime-val"):
+                self.assertAlmostEqual(statistics[name], offline[name][0], msg=name)
+            del trace
+
+    def test_array_engines(self):
+        with self.assertRaises(ValueError):
+            create_lockstep_simulation(_experiment([_node("A", 2.0, "ps", 2, None)]), 1.0, 2, 10, 1234)
+
+if __name__ == "__main__":
+    unittest.main()
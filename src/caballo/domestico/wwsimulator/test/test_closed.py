@@ -0,0 +1,111 @@
+import unittest
+
+from caballo.domestico.wwsimulator.analytic import closed_mva
+from caballo.domestico.wwsimulator.closed import create_closed_population
+from caballo.domestico.wwsimulator.events import ArrivalEvent, Event, EventHandler
+from caballo.domestico.wwsimulator.handlers import ArrivalsGeneratorSubscriber, HandleFirstArrival
+from caballo.domestico.wwsimulator.main import subscribe_estimators
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+
+
+def _experiment(think_time: float, users: list = None, queue_capacity=None) -> dict:
+    # A (two visits) -> B, as the web app with a single class at B
+    arrival_distr = {"type": "closed", "think_time": think_time}
+    if users is not None:
+        arrival_distr["users"] = users
+    return {
+        "simulation_study": "closed",
+        "arrival_distr": arrival_distr,
+        "nodes": [{"name": "A", "server_distr": {"type": "exp", "params": [1.0, 2.0]}, "queue_discipline": {"type": "ps", "params": []},
+                   "server_capacity": 1, "queue_capacity": queue_capacity},
+                  {"name": "B", "server_distr": {"type": "exp", "params": [2.0]}, "queue_discipline": {"type": "fifo", "params": []},
+                   "server_capacity": 1, "queue_capacity": None}],
+        "routing": {"entry": [{"node": "A", "class": 0}],
+                    "matrix": [{"from": {"node": "A", "class": 0}, "to": [{"node": "B", "class": 0, "p": 1.0}]},
+                               {"from": {"node": "B", "class": 0}, "to": [{"node": "A", "class": 1, "p": 1.0}]}]}
+    }
+
+class _PendingRequestsObserver(EventHandler):
+
+    def __init__(self):
+        super().__init__()
+        self.max_pending = 0
+
+    def _handle(self, context):
+        # requests in the event list, but the cancelled ones (that are never processed)
+        pending = sum(1 for event in context.scheduler._event_list
+                      if isinstance(event, ArrivalEvent) and event.external and not event.is_cancelled)
+        self.max_pending = max(self.max_pending, pending)
+
+class TestClosed(unittest.TestCase):
+
+    def _run(self, experiment: dict, n_users: int, num_arrivals: int = 10000):
+        simulation = SimulationFactory().create(HandleFirstArrival(), experiment, n_users, seed=1234)
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(num_arrivals))
+        subscribe_estimators(simulation)
+        simulation.run()
+        return simulation
+
+    def _assert_mva(self, simulation, tolerance: float):
+        statistics = simulation.statistics
+        means = closed_mva(simulation.network)
+        throughput = statistics["SYSTEM-completions-val"] / statistics["SYSTEM-observation_time-val"]
+        self.assertAlmostEqual(means["SYSTEM-throughput-val"], throughput, delta=tolerance * means["SYSTEM-throughput-val"])
+        for name in ("SYSTEM-response_time-avg", "A-utilization-avg", "B-response_time-avg"):
+            self.assertAlmostEqual(means[name], statistics[name], delta=tolerance * means[name], msg=name)
+
+    def test_mva(self):
+        # machine repairman with 2 users, Z = 1 and D = 1: X(1) = 1 / 2, Q(1) = 1 / 2, R(2) = 3 / 2, X(2) = 2 / 2.5
+        experiment = _experiment(1.0)
+        experiment["nodes"] = experiment["nodes"][:1]
+        experiment["routing"]["matrix"] = []
+        means = closed_mva(SimulationFactory().create_network(experiment, 2))
+        self.assertAlmostEqual(1.5, means["SYSTEM-response_time-avg"])
+        self.assertAlmostEqual(0.8, means["SYSTEM-throughput-val"])
+        self.assertAlmostEqual(1.2, means["A-population-avg"])
+
+    def test_population(self):
+        network = SimulationFactory().create_network(_experiment(5.0, [{"share": 2}, {"share": 1, "think_time": 20.0}]), 10)
+        population = network.population
+        self.assertEqual([7, 3], population.group_sizes())
+        self.assertEqual([5.0, 20.0], population.mean_think_times())
+        with self.assertRaises(ValueError):
+            create_closed_population({"type": "closed", "think_time": 5.0}, network, 2.5)
+
+    def test_closed_mva(self):
+        # near the saturation of A (D = 1.5, N* = (D + Z) / D_max ~ 4.5 users)
+        self._assert_mva(self._run(_experiment(5.0), 10), 0.05)
+
+    def test_groups(self):
+        # users with different think times: a chain each, the think time distribution does not matter
+        users = [{"share": 1}, {"share": 1, "think_time": 20.0, "think_distr": {"type": "lognormal", "cv": 2.0}}]
+        self._assert_mva(self._run(_experiment(5.0, users), 10), 0.05)
+
+    def test_event_list(self):
+        # many thinking users, a single pending request
+        simulation = SimulationFactory().create(HandleFirstArrival(), _experiment(10000.0), 1000, seed=1234)
+        observer = _PendingRequestsObserver()
+        simulation.scheduler.subscribe(Event, observer)
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(2000))
+        subscribe_estimators(simulation)
+        simulation.run()
+        self.assertEqual(2000, simulation.statistics["SYSTEM-completions-val"])
+        self.assertEqual(1, observer.max_pending)
+        self._assert_mva(simulation, 0.1)
+
+    def test_losses(self):
+        # the users of the dropped requests think again, never more jobs than users in the system
+        simulation = self._run(_experiment(1.0, queue_capacity=1), 5, 5000)
+        statistics = simulation.statistics
+        self.assertGreater(statistics["SYSTEM-blocking-val"], 0.0)
+        self.assertAlmostEqual(5000 * (1.0 - statistics["SYSTEM-blocking-val"]), statistics["SYSTEM-completions-val"])
+        self.assertLessEqual(statistics["SYSTEM-population-max"], 5)
+
+    def test_horizon(self):
+        simulation = SimulationFactory().create(HandleFirstArrival(), _experiment(5.0), 3, seed=1234)
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(100, horizon=10.0))
+        with self.assertRaises(ValueError):
+            simulation.run()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import random
+import unittest
+
+from caballo.domestico.wwsimulator.dispatch import (DISPATCH_POLICIES, IndexedHeap, JoinShortestQueue,
+                                                    create_dispatcher, register_dispatch_policy)
+from caballo.domestico.wwsimulator.events import ArrivalEvent, EventHandler
+from caballo.domestico.wwsimulator.handlers import ArrivalsGeneratorSubscriber, HandleFirstArrival
+from caballo.domestico.wwsimulator.main import subscribe_estimators
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+from caballo.domestico.wwsimulator.sweep import saturation_lambda
+
+
+def _experiment(replicas: int, policy: str) -> dict:
+    # a pool of replicas of A, then B
+    return {
+        "simulation_study": "fleet",
+        "arrival_distr": {"type": "poisson"},
+        "nodes": [{"name": "A", "server_distr": {"type": "exp", "params": [1.0]}, "queue_discipline": {"type": "ps", "params": []},
+                   "server_capacity": 1, "queue_capacity": None, "replicas": replicas, "dispatch": {"type": policy}},
+                  {"name": "B", "server_distr": {"type": "exp", "params": [10.0]}, "queue_discipline": {"type": "fifo", "params": []},
+                   "server_capacity": 1, "queue_capacity": None}],
+        "routing": {"entry": [{"node": "A", "class": 0}],
+                    "matrix": [{"from": {"node": "A", "class": 0}, "to": [{"node": "B", "class": 0, "p": 1.0}]}]}
+    }
+
+def _fifo_pool(replicas: int, policy: str) -> dict:
+    # a pool of replicas of A only, with FIFO single server replicas
+    return {
+        "simulation_study": "fleet",
+        "arrival_distr": {"type": "poisson"},
+        "nodes": [{"name": "A", "server_distr": {"type": "exp", "params": [1.0]}, "queue_discipline": {"type": "fifo", "params": []},
+                   "server_capacity": 1, "queue_capacity": None, "replicas": replicas, "dispatch": {"type": policy}}],
+        "routing": {"entry": [{"node": "A", "class": 0}], "matrix": []}
+    }
+
+class IdleReplicaChecker(EventHandler):
+    """
+    Counts the jobs that joined a busy replica while another replica of the pool was idle.
+    """
+    def __init__(self):
+        super().__init__()
+        self.violations = 0
+
+    def _handle(self, context):
+        node = context.event.node
+        state = context.network.state
+        if state.get_num_jobs_in_node(node) > 1:
+            group = context.network.groups[node.group]
+            if any(state.get_num_jobs_in_node(replica) == 0 for replica in group):
+                self.violations += 1
+
+class TestDispatch(unittest.TestCase):
+
+    def _run(self, experiment: dict, lambda_val: float, num_arrivals: int = 10000, *subscribers):
+        simulation = SimulationFactory().create(HandleFirstArrival(), experiment, lambda_val, seed=1234)
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(num_arrivals))
+        subscribe_estimators(simulation)
+        for subscriber in subscribers:
+            simulation.scheduler.subscribe(ArrivalEvent, subscriber)
+        simulation.run()
+        return simulation
+
+    def test_heap(self):
+        generator = random.Random(1234)
+        keys = [generator.randint(0, 5) for _ in range(50)]
+        heap = IndexedHeap(keys)
+        for _ in range(2000):
+            item = generator.randrange(50)
+            keys[item] = generator.randint(0, 5)
+            heap.update(item, keys[item])
+            self.assertEqual(min(range(50), key=lambda i: (keys[i], i)), heap.top())
+            self.assertEqual(list(range(50)), sorted(heap.heap))
+            self.assertTrue(all(heap.heap[heap.positions[i]] == i for i in range(50)))
+
+    def test_network(self):
+        network = SimulationFactory().create_network(_experiment(3, "jsq"), 1.0)
+        self.assertEqual(["A_0", "A_1", "A_2", "B"], [node.id for node in network.nodes])
+        self.assertEqual([0, 0, 0, 1], [node.group for node in network.nodes])
+        self.assertIsInstance(network.nodes[0].dispatcher, JoinShortestQueue)
+        self.assertIs(network.nodes[3], network.dispatch(1))
+        # the replicas share the service stream of A, the pool saturates at 3 jobs per unit of time
+        self.assertEqual(1, len({node.server.prng_stream for node in network.nodes[:3]}))
+        self.assertAlmostEqual(3.0, saturation_lambda(network))
+        # JSQ: the fewest jobs, the first replica on ties
+        dispatcher = network.nodes[0].dispatcher
+        dispatcher.arrived(network.nodes[0], 1.0, 0.0)
+        dispatcher.arrived(network.nodes[1], 1.0, 0.0)
+        self.assertIs(network.nodes[2], network.dispatch(0))
+        dispatcher.departed(network.nodes[0], 1.0)
+        self.assertIs(network.nodes[0], network.dispatch(0))
+
+    def test_round_robin(self):
+        network = SimulationFactory().create_network(_experiment(3, "rr"), 1.0)
+        self.assertEqual(["A_0", "A_1", "A_2", "A_0"], [network.dispatch(0).id for _ in range(4)])
+
+    def test_registry(self):
+        with self.assertRaises(ValueError):
+            create_dispatcher({"type": "unknown"}, [])
+        register_dispatch_policy("last", lambda replicas, config: JoinShortestQueue(replicas[::-1]))
+        try:
+            network = SimulationFactory().create_network(_experiment(3, "last"), 1.0)
+            self.assertEqual("A_2", network.dispatch(0).id)
+        finally:
+            del DISPATCH_POLICIES["last"]
+
+    def test_policies(self):
+        # random dispatch splits the arrivals into independent M/M/1 nodes with rate lambda / 4
+        statistics = self._run(_experiment(4, "random"), 3.0).statistics
+        self.assertAlmostEqual(4.0, statistics["A_1-response_time-avg"], delta=0.6)
+        response_times = {"random": statistics["SYSTEM-response_time-avg"]}
+        for policy in ("rr", "jsq", "po2", "lwl"):
+            statistics = self._run(_experiment(4, policy), 3.0).statistics
+            self.assertEqual(10000, statistics["SYSTEM-completions-val"])
+            self.assertEqual(10000, sum(statistics[f"A_{replica}-completions-val"] for replica in range(4)))
+            response_times[policy] = statistics["SYSTEM-response_time-avg"]
+        # the state aware policies balance the load better than the blind ones
+        self.assertLess(response_times["rr"], response_times["random"])
+        for policy in ("jsq", "po2", "lwl"):
+            self.assertLess(response_times[policy], response_times["rr"], policy)
+
+    def test_single_replica(self):
+        # a pool of one replica is the node itself
+        self.assertEqual(self._run(_experiment(1, "jsq"), 0.5, 2000).statistics["SYSTEM-response_time-avg"],
+                         self._run(_experiment(1, "rr"), 0.5, 2000).statistics["SYSTEM-response_time-avg"])
+
+    def test_mm2(self):
+        # M/M/2 with mu = 1 and rho = 0.8: R = 1 / mu + C(2, rho) / (2 mu - lambda), C = 2 rho^2 / (1 + rho)
+        expected = 1.0 + (2 * 0.8 ** 2 / 1.8) / (2.0 - 1.6)
+        response_times = {}
+        for policy in ("lwl", "jsq", "po2"):
+            # the replica is chosen when the job arrives: never a busy one while the other is idle
+            checker = IdleReplicaChecker()
+            statistics = self._run(_fifo_pool(2, policy), 1.6, 50000, checker).statistics
+            self.assertEqual(0, checker.violations, policy)
+            response_times[policy] = statistics["SYSTEM-response_time-avg"]
+        # LWL on FIFO replicas is the central FIFO queue of the M/M/2 on the same sample path
+        self.assertAlmostEqual(expected, response_times["lwl"], delta=0.07 * expected)
+        # JSQ (and po2, the same with two replicas) is bounded by the M/M/2 and close to it
+        for policy in ("jsq", "po2"):
+            self.assertGreater(response_times[policy], 0.97 * expected, policy)
+            self.assertLess(response_times[policy], 1.1 * expected, policy)
+
+if __name__ == "__main__":
+    unittest.main()
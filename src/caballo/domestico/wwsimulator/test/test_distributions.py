@@ -0,0 +1,91 @@
+import unittest
+
+import numpy as np
+
+from caballo.domestico.wwsimulator import streams
+from caballo.domestico.wwsimulator.distributions import DISTRIBUTIONS, Exponential, create_distribution, register_distribution
+from caballo.domestico.wwsimulator.events import ArrivalEvent
+from caballo.domestico.wwsimulator.handlers import ArrivalsGeneratorSubscriber, HandleFirstArrival
+from caballo.domestico.wwsimulator.main import subscribe_estimators
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+from pdsteele.des import rngs
+
+
+class TestDistributions(unittest.TestCase):
+
+    def test_moments(self):
+        # coefficient of variation of each distribution
+        configs = [({"type": "exp"}, 1.0), ({"type": "erlang", "k": 4}, 0.5), ({"type": "hyperexp", "cv": 2.0}, 2.0),
+                   ({"type": "lognormal", "cv": 1.5}, 1.5), ({"type": "pareto", "alpha": 3.0}, 1.0 / np.sqrt(3.0)),
+                   ({"type": "weibull", "shape": 2.0}, np.sqrt(4.0 / np.pi - 1.0))]
+        for config, cv in configs:
+            rngs.plantSeeds(1234)
+            samples = create_distribution(config, 0.5).samples(2, 100000)
+            self.assertAlmostEqual(0.5, samples.mean(), delta=0.02, msg=config["type"])
+            self.assertAlmostEqual(cv, samples.std() / samples.mean(), delta=0.1 * cv, msg=config["type"])
+
+    def test_batched(self):
+        for config in [{"type": "exp"}, {"type": "erlang", "k": 3}, {"type": "hyperexp", "cv": 3.0}, {"type": "lognormal", "cv": 2.0},
+                       {"type": "empirical", "values": [1, 2, 5]}, {"type": "empirical", "values": [1, 2, 5], "sampling": "inverse"}]:
+            distribution = create_distribution(config, 2.0)
+            rngs.plantSeeds(1234)
+            samples = distribution.samples(2, 100)
+            rngs.plantSeeds(1234)
+            self.assertTrue(np.allclose(samples, [distribution.sample(2) for _ in range(100)], rtol=1e-12), config["type"])
+
+    def test_exponential(self):
+        # the same variates as the exponential of the streams
+        rngs.plantSeeds(1234)
+        expected = [streams.exponential(2, 0.5) for _ in range(10)]
+        rngs.plantSeeds(1234)
+        self.assertEqual(expected, [Exponential(0.5).sample(2) for _ in range(10)])
+
+    def test_empirical(self):
+        rngs.plantSeeds(1234)
+        # alias sampling of weighted values, scaled to the mean
+        distribution = create_distribution({"type": "empirical", "values": [1.0, 2.0, 10.0], "weights": [5, 3, 2]}, 3.1)
+        samples = distribution.samples(2, 100000)
+        self.assertEqual({1.0, 2.0, 10.0}, set(np.unique(samples).tolist()))
+        for value, p in [(1.0, 0.5), (2.0, 0.3), (10.0, 0.2)]:
+            self.assertAlmostEqual(p, float(np.mean(samples == value)), delta=0.01)
+
+        # interpolated quantiles, within the values
+        distribution = create_distribution({"type": "empirical", "values": [3.0, 1.0, 2.0], "sampling": "inverse"}, 2.0)
+        samples = distribution.samples(2, 100000)
+        self.assertAlmostEqual(2.0, samples.mean(), delta=0.02)
+        self.assertTrue(np.all((samples >= 1.0) & (samples <= 3.0)))
+
+    def test_registry(self):
+        with self.assertRaises(ValueError):
+            create_distribution({"type": "unknown"}, 1.0)
+        register_distribution("deterministic_exp", lambda mean, config: Exponential(mean))
+        try:
+            self.assertEqual(0.25, create_distribution({"type": "deterministic_exp"}, 0.25).mean)
+        finally:
+            del DISTRIBUTIONS["deterministic_exp"]
+
+    def _mg1(self, server_distr: dict, queue_discipline: str) -> float:
+        experiment = {
+            "simulation_study": "mg1",
+            "arrival_distr": {"type": "poisson"},
+            "nodes": [{"name": "A", "server_distr": dict(server_distr, params=[2.0]), "queue_discipline": {"type": queue_discipline, "params": []},
+                       "server_capacity": 1, "queue_capacity": None}],
+            "routing": {"entry": [{"node": "A", "class": 0}], "matrix": []}
+        }
+        simulation = SimulationFactory().create(HandleFirstArrival(), experiment, 1.0, seed=1234)
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(10000))
+        subscribe_estimators(simulation)
+        simulation.run()
+        return simulation.statistics["SYSTEM-response_time-avg"]
+
+    def test_processor_sharing(self):
+        # M/G/1 PS: R = 1 / (mu - lambda) for any service distribution
+        self.assertAlmostEqual(1.0, self._mg1({"type": "hyperexp", "cv": 2.0}, "ps"), delta=0.1)
+        self.assertAlmostEqual(1.0, self._mg1({"type": "erlang", "k": 4}, "ps"), delta=0.1)
+
+    def test_fifo(self):
+        # M/G/1 FIFO (Pollaczek-Khinchine): R = E[S] + lambda E[S^2] / (2 (1 - rho)) = 0.5 + 0.3125
+        self.assertAlmostEqual(0.8125, self._mg1({"type": "erlang", "k": 4}, "fifo"), delta=0.05)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import json
+import unittest
+
+from caballo.domestico.wwsimulator import SIMULATION_FACTORY_CONFIG_PATH
+from caballo.domestico.wwsimulator.events import ArrivalEvent, DepartureEvent, Event, EventHandler, JobMovementEvent
+from caballo.domestico.wwsimulator.handlers import ArrivalsGeneratorSubscriber, HandleFirstArrival
+from caballo.domestico.wwsimulator.output import (CompletionsEstimator, ObservationTimeEstimator,
+                                                  PopulationEstimator, ResponseTimeEstimator, ScoreEstimator,
+                                                  UtilizationEstimator, BusytimeEstimator)
+from caballo.domestico.wwsimulator.simulation import Simulation, SimulationFactory
+
+
+def run_simulation(num_arrivals, *estimators):
+    with open(SIMULATION_FACTORY_CONFIG_PATH, 'r') as file:
+        data = json.load(file)
+    simulation = SimulationFactory().create(HandleFirstArrival(), data['exps'][0], 1.2, seed=1234)
+    simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(num_arrivals))
+    simulation.scheduler.subscribe(Event, ObservationTimeEstimator())
+    simulation.scheduler.subscribe(DepartureEvent, CompletionsEstimator())
+    for estimator in estimators:
+        simulation.scheduler.subscribe(JobMovementEvent, estimator)
+    simulation.run()
+    return simulation.statistics
+
+class TestTimeAveragedEstimators(unittest.TestCase):
+    def test_littles_law(self):
+        # the run starts and ends with an empty system, so the time-averaged population
+        # must match the sum of the response times exactly
+        statistics = run_simulation(1000, PopulationEstimator(), ResponseTimeEstimator())
+        observation_time = statistics["SYSTEM-observation_time-val"]
+        for node_id in ["SYSTEM", "A", "B", "P"]:
+            completions = statistics[f"{node_id}-completions-val"]
+            self.assertAlmostEqual(statistics[f"{node_id}-population-avg"] * observation_time,
+                                   statistics[f"{node_id}-response_time-avg"] * completions, places=6)
+        self.assertAlmostEqual(statistics["A-population-avg"],
+                               sum(statistics[f"A.{class_id}-population-avg"] for class_id in range(3)), places=6)
+
+    def test_utilization(self):
+        statistics = run_simulation(1000, UtilizationEstimator(), BusytimeEstimator())
+        observation_time = statistics["SYSTEM-observation_time-val"]
+        for node_id in ["A", "B", "P"]:
+            self.assertAlmostEqual(statistics[f"{node_id}-busytime-val"] / observation_time,
+                                   statistics[f"{node_id}-utilization-avg"], places=6)
+            self.assertAlmostEqual(statistics[f"{node_id}-utilization-avg"],
+                                   sum(statistics[f"{node_id}.{class_id}-utilization-avg"] for class_id in range(3)), places=6)
+
+class TestClassEstimators(unittest.TestCase):
+    def test_class_breakdown(self):
+        statistics = run_simulation(1000, ResponseTimeEstimator())
+        for node_id in ["A", "B", "P"]:
+            completions = [statistics[f"{node_id}.{class_id}-completions-val"] for class_id in range(3)]
+            response_times = [statistics[f"{node_id}.{class_id}-response_time-avg"] for class_id in range(3)]
+            self.assertEqual(statistics[f"{node_id}-completions-val"], sum(completions))
+            self.assertAlmostEqual(statistics[f"{node_id}-response_time-avg"],
+                                   sum(c * r for c, r in zip(completions, response_times)) / sum(completions), places=6)
+        # in the web app workflow B only serves class 0 and P only class 1
+        self.assertEqual(0, statistics["B.1-completions-val"])
+        self.assertEqual(0, statistics["P.0-completions-val"])
+
+class TestScoreEstimator(unittest.TestCase):
+    def test_scores(self):
+        class ArrivalRecorder(EventHandler):
+            def __init__(self):
+                self.arrivals = []
+            def _handle(self, context):
+                event = context.event
+                self.arrivals.append((event.external, event.node.id, event.job.class_id, event.job.service_demand, event.time))
+
+        recorder = ArrivalRecorder()
+        with open(SIMULATION_FACTORY_CONFIG_PATH, 'r') as file:
+            data = json.load(file)
+        simulation = SimulationFactory().create(HandleFirstArrival(), data['exps'][0], 1.2, seed=1234)
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(1000))
+        simulation.scheduler.subscribe(ArrivalEvent, ScoreEstimator())
+        simulation.scheduler.subscribe(ArrivalEvent, recorder)
+        simulation.run()
+        statistics = simulation.statistics
+        external_times = [time for external, _, _, _, time in recorder.arrivals if external]
+        # the first arrival only sets the time of the next ones
+        self.assertAlmostEqual((len(external_times) - 1) / 1.2 - (external_times[-1] - external_times[0]), statistics["SYSTEM-score-lambda"], places=6)
+        # P only serves class 1, at rate 2.5
+        demands = [demand for _, node_id, _, demand, _ in recorder.arrivals if node_id == "P"]
+        self.assertAlmostEqual(len(demands) / 2.5 - sum(demands), statistics["P.1-score-rate"], places=6)
+        self.assertAlmostEqual(2.5 * statistics["P.1-score-rate"], statistics["P-score-speed"], places=6)
+
+class TestIntervals(unittest.TestCase):
+    def test_summary(self):
+        simulation = Simulation("test", None, 1)
+        for iteration in range(10):
+            simulation.collect_iteration({"SYSTEM-response_time-avg": iteration + 1, "B.1-response_time-min": float("inf")})
+        self.assertEqual(list(range(1, 11)), simulation.statistics["SYSTEM-response_time-avg"])
+        summary = simulation.summary()
+        self.assertEqual(1, len(summary))
+        statistic, mean, half_width, iterations = summary[0]
+        self.assertEqual(("SYSTEM-response_time-avg", 5.5, 10), (statistic, mean, iterations))
+        self.assertAlmostEqual(simulation.intervals[statistic].half_width(), half_width)
+
+if __name__ == "__main__":
+    unittest.main()
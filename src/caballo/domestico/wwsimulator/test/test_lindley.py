@@ -0,0 +1,68 @@
+import copy
+import json
+import unittest
+
+from caballo.domestico.wwsimulator import SIMULATION_FACTORY_CONFIG_PATH, streams
+from caballo.domestico.wwsimulator.batchmeans import BatchMeansInterceptor, BatchMeansSimulation
+from caballo.domestico.wwsimulator.events import ArrivalEvent, DepartureEvent
+from caballo.domestico.wwsimulator.handlers import ArrivalsGeneratorSubscriber, HandleFirstArrival
+from caballo.domestico.wwsimulator.lindley import create_lindley_simulation
+from caballo.domestico.wwsimulator.main import subscribe_estimators
+from caballo.domestico.wwsimulator.replication import ReplicatedSimulation
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+from pdsteele.des import rngs
+
+
+class TestLindley(unittest.TestCase):
+    def setUp(self):
+        with open(SIMULATION_FACTORY_CONFIG_PATH, 'r') as file:
+            self.experiment = json.load(file)['exps'][0]
+        # the same network with FIFO nodes
+        self.fifo_experiment = copy.deepcopy(self.experiment)
+        for node in self.fifo_experiment['nodes']:
+            node['queue_discipline']['type'] = 'fifo'
+
+    def _event_driven(self, num_arrivals: int, seed: int):
+        simulation = SimulationFactory().create(HandleFirstArrival(), self.fifo_experiment, 1.0, seed=seed)
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(num_arrivals))
+        subscribe_estimators(simulation)
+        return simulation
+
+    def _assert_same_statistics(self, expected, actual):
+        self.assertEqual(set(expected.statistics), set(actual.statistics))
+        for name, values in expected.statistics.items():
+            self.assertEqual(len(values), len(actual.statistics[name]), name)
+            for value, actual_value in zip(values, actual.statistics[name]):
+                self.assertAlmostEqual(value, actual_value, delta=1e-7 * max(1.0, abs(value)), msg=name)
+
+    def test_replicas(self):
+        # deterministic routing: the sample path of the events
+        expected = ReplicatedSimulation([self._event_driven(100, 1234) for _ in range(5)])
+        expected.run()
+        simulation = create_lindley_simulation(self.fifo_experiment, 1.0, 100, 1234, replicas=5)
+        simulation.run()
+        self._assert_same_statistics(expected, simulation)
+        self.assertGreater(simulation.sweeps, 1)
+
+    def test_batch_means(self):
+        replica = self._event_driven(32 * 10, 1234)
+        expected = BatchMeansSimulation(replica)
+        replica.scheduler.intercept(DepartureEvent, BatchMeansInterceptor(32, 10, expected))
+        expected.run()
+        simulation = create_lindley_simulation(self.fifo_experiment, 1.0, 32 * 10, 1234, batch_size=32)
+        simulation.run()
+        self._assert_same_statistics(expected, simulation)
+
+    def test_processor_sharing(self):
+        with self.assertRaises(ValueError):
+            create_lindley_simulation(self.experiment, 1.0, 100, 1234)
+
+    def test_randoms(self):
+        rngs.plantSeeds(1234)
+        expected = [streams.random(streams.ROUTING) for _ in range(100)]
+        rngs.plantSeeds(1234)
+        self.assertEqual(expected[:37], streams.randoms(streams.ROUTING, 37).tolist())
+        self.assertEqual(expected[37:], streams.randoms(streams.ROUTING, 63).tolist())
+
+if __name__ == "__main__":
+    unittest.main()
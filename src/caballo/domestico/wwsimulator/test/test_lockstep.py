@@ -0,0 +1,58 @@
+import json
+import unittest
+
+from caballo.domestico.wwsimulator import SIMULATION_FACTORY_CONFIG_PATH
+from caballo.domestico.wwsimulator.analytic import open_network_means
+from caballo.domestico.wwsimulator.events import ArrivalEvent
+from caballo.domestico.wwsimulator.handlers import ArrivalsGeneratorSubscriber, HandleFirstArrival
+from caballo.domestico.wwsimulator.lockstep import create_lockstep_simulation
+from caballo.domestico.wwsimulator.main import subscribe_estimators
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+
+
+class TestLockstep(unittest.TestCase):
+    def setUp(self):
+        with open(SIMULATION_FACTORY_CONFIG_PATH, 'r') as file:
+            self.experiment = json.load(file)['exps'][0]
+
+    def test_statistics(self):
+        simulation = create_lockstep_simulation(self.experiment, 0.8, 100, 200, 1234)
+        simulation.run()
+
+        # same statistics as a replica of the event driven simulation
+        replica = SimulationFactory().create(HandleFirstArrival(), self.experiment, 0.8, seed=1234)
+        replica.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(200))
+        subscribe_estimators(replica)
+        replica.run()
+        self.assertEqual(set(replica.statistics), set(simulation.statistics))
+
+        self.assertEqual(100, simulation.intervals["SYSTEM-response_time-avg"].n_samples)
+        self.assertTrue(all(completions == 200 for completions in simulation.statistics["SYSTEM-completions-val"]))
+        means = open_network_means(simulation.network)
+        for statistic in ["SYSTEM-interarrival-avg", "A-service-avg", "A-utilization-avg"]:
+            interval = simulation.intervals[statistic]
+            self.assertAlmostEqual(means[statistic], interval.avg, delta=3 * interval.half_width())
+
+    def test_fifo(self):
+        # M/M/1 FIFO: R = 1 / (mu - lambda)
+        experiment = {
+            "simulation_study": "mm1",
+            "arrival_distr": {"type": "poisson"},
+            "nodes": [{"name": "A", "server_distr": {"type": "exp", "params": [2.0]}, "queue_discipline": {"type": "fifo", "params": []},
+                       "server_capacity": 1, "queue_capacity": None}],
+            "routing": {"entry": [{"node": "A", "class": 0}], "matrix": []}
+        }
+        simulation = create_lockstep_simulation(experiment, 1.0, 200, 500, 1234)
+        simulation.run()
+        interval = simulation.intervals["SYSTEM-response_time-avg"]
+        self.assertAlmostEqual(1.0, interval.avg, delta=max(3 * interval.half_width(), 0.05))
+
+    def test_arrival_score(self):
+        # the likelihood ratio score of the arrival rate has mean 0
+        simulation = create_lockstep_simulation(self.experiment, 0.8, 2000, 10, 1234)
+        simulation.run()
+        interval = simulation.intervals["SYSTEM-score-lambda"]
+        self.assertAlmostEqual(0.0, interval.avg, delta=max(3 * interval.half_width(), 0.05))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import copy
+import json
+import unittest
+
+from caballo.domestico.wwsimulator import SIMULATION_FACTORY_CONFIG_PATH
+from caballo.domestico.wwsimulator.metamodel import Metamodel
+
+
+class TestMetamodel(unittest.TestCase):
+    def setUp(self):
+        with open(SIMULATION_FACTORY_CONFIG_PATH, 'r') as file:
+            self.experiment = json.load(file)['exps'][0]
+
+    def with_rate(self, rate):
+        experiment = copy.deepcopy(self.experiment)
+        experiment['nodes'][1]['server_distr']['params'][0] = rate
+        return experiment
+
+    def test_predict(self):
+        metamodel = Metamodel("SYSTEM-response_time-avg")
+        # simulated response times 10% above MVA
+        for rate in [1.25, 1.5, 2.0]:
+            for lambda_val in [0.2, 0.5, 0.8, 1.1]:
+                experiment = self.with_rate(rate)
+                value = 1.1 * metamodel.prior(experiment, lambda_val)
+                metamodel.add(experiment, lambda_val, [0.99 * value, value, 1.01 * value])
+        metamodel.fit()
+
+        experiment = self.with_rate(1.75)
+        mean, std = metamodel.predict(experiment, 0.65)
+        self.assertAlmostEqual(1.1 * metamodel.prior(experiment, 0.65), mean, delta=3 * std + 0.01 * mean)
+
+        # far from the design points the metamodel is the most uncertain
+        candidates = [(self.with_rate(1.5), 0.5), (self.with_rate(4.0), 2.0)]
+        self.assertEqual(2.0, metamodel.next_design_point(candidates)[1])
+
+    def test_layouts(self):
+        metamodel = Metamodel("SYSTEM-response_time-avg")
+        metamodel.add(self.experiment, 0.5, [1.0, 1.1])
+        # a study without the node P
+        other = copy.deepcopy(self.experiment)
+        other['simulation_study'] = "no_p"
+        other['nodes'] = other['nodes'][:2]
+        with self.assertRaisesRegex(ValueError, "study no_p"):
+            metamodel.add(other, 0.5, [1.0, 1.1])
+        self.assertEqual(1, metamodel.n_samples)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import json
+import unittest
+
+from math import exp
+
+from caballo.domestico.wwsimulator import SIMULATION_FACTORY_CONFIG_PATH, streams
+from caballo.domestico.wwsimulator.model import RoutingTable
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+from pdsteele.des import rngs
+
+
+class TestRoutingTable(unittest.TestCase):
+    def test_webapp_routing(self):
+        with open(SIMULATION_FACTORY_CONFIG_PATH, 'r') as file:
+            data = json.load(file)
+        network = SimulationFactory().create_network(data['exps'][0], 1.2)
+        routing = network.routing
+        a, b, p = (network.get_node(node_id).index for node_id in ['A', 'B', 'P'])
+
+        self.assertEqual((a, 0), routing.entry())
+        self.assertEqual((b, 0), routing.route(a, 0))
+        self.assertEqual((a, 1), routing.route(b, 0))
+        self.assertEqual((p, 1), routing.route(a, 1))
+        self.assertEqual((a, 2), routing.route(p, 1))
+        self.assertEqual((RoutingTable.EXIT, RoutingTable.EXIT), routing.route(a, 2))
+
+    def test_random_routing(self):
+        rngs.plantSeeds(1234)
+        # a job leaving node 0 goes to node 1 as class 1 with p=0.25, otherwise leaves the system
+        routing = RoutingTable(2, 2, [(0, 0, 1.0)], {(0, 0): [(1, 1, 0.25)]})
+        routes = [routing.route(0, 0) for _ in range(10000)]
+        self.assertAlmostEqual(0.25, routes.count((1, 1)) / len(routes), places=1)
+        self.assertEqual(len(routes), routes.count((1, 1)) + routes.count((RoutingTable.EXIT, RoutingTable.EXIT)))
+
+    def test_invalid_routing(self):
+        with self.assertRaises(ValueError):
+            RoutingTable(2, 2, [(0, 0, 1.0)], {(0, 0): [(1, 1, 0.75), (1, 0, 0.5)]})
+        with self.assertRaises(ValueError):
+            RoutingTable(2, 2, [(0, 0, 0.5)], {})
+        with self.assertRaises(ValueError):
+            RoutingTable(2, 2, [(0, 2, 1.0)], {})
+
+class TestStreams(unittest.TestCase):
+    def test_antithetic(self):
+        variates = []
+        for antithetic in [False, True]:
+            rngs.plantSeeds(1234)
+            streams.antithetic = antithetic
+            try:
+                variates.append([streams.exponential(streams.EXTERNAL_ARRIVALS, 2.0) for _ in range(10)])
+            finally:
+                streams.antithetic = False
+        for variate, antithetic_variate in zip(*variates):
+            # u and 1 - u
+            self.assertAlmostEqual(1.0, exp(-variate / 2.0) + exp(-antithetic_variate / 2.0))
+
+    def test_independent_seeds(self):
+        seeds = streams.independent_seeds(1234, 5)
+        self.assertEqual(1234, seeds[0])
+        self.assertEqual(seeds, streams.independent_seeds(1234, 5))
+        # the next seed is the seed of the stream after the last one
+        for i in range(1, len(seeds)):
+            rngs.plantSeeds(seeds[i - 1])
+            rngs.selectStream(rngs.STREAMS - 1)
+            self.assertEqual(seeds[i], rngs.A256 * rngs.getSeed() % rngs.MODULUS)
+
+if __name__ == "__main__":
+    unittest.main()
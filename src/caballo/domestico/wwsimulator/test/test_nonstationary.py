@@ -0,0 +1,114 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from caballo.domestico.wwsimulator import main
+
+from caballo.domestico.wwsimulator.events import ArrivalEvent, JobMovementEvent
+from caballo.domestico.wwsimulator.handlers import ArrivalsGeneratorSubscriber, HandleFirstArrival
+from caballo.domestico.wwsimulator.nonstationary import ArrivalProfile, NonStationaryArrivals
+from caballo.domestico.wwsimulator.output import TimeBucketEstimator
+from caballo.domestico.wwsimulator.results import ResultStore
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+from pdsteele.des import rngs
+
+
+class TestNonStationary(unittest.TestCase):
+
+    def _arrival_times(self, profile: ArrivalProfile, periods: int) -> np.ndarray:
+        rngs.plantSeeds(1234)
+        arrivals = NonStationaryArrivals(profile)
+        times = [0.0]
+        while times[-1] < periods * profile.period:
+            times.append(times[-1] + arrivals.next_interarrival())
+        return np.array(times[:-1])
+
+    def test_profile(self):
+        # relative rates scaled to the mean rate
+        profile = ArrivalProfile([0, 6, 12, 18], [1, 2, 4, 1], 24, 4.0)
+        self.assertEqual([2.0, 4.0, 8.0, 2.0], profile.majorant.tolist())
+        self.assertEqual(8.0, profile.rate(24 * 3 + 13))
+        # 6 hours at 2 then 1 hour at 4
+        self.assertAlmostEqual(7.0, profile.invert_majorant(0.0, 16.0))
+        self.assertAlmostEqual(24.0 + 1.0, profile.invert_majorant(23.0, 4.0))
+        with self.assertRaises(ValueError):
+            ArrivalProfile([0, 6], [0, 0], 24, 1.0)
+        with self.assertRaises(ValueError):
+            ArrivalProfile([6, 12], [1, 1], 24, 1.0)
+
+    def test_constant(self):
+        # no arrivals where the rate is 0
+        profile = ArrivalProfile([0, 6, 12, 18], [0.2, 1.0, 2.0, 0.0], 24, 10.0)
+        times = self._arrival_times(profile, 100)
+        counts = np.histogram(times % 24, bins=4, range=(0, 24))[0] / 100
+        for count, rate in zip(counts, [2.5, 12.5, 25.0, 0.0]):
+            self.assertAlmostEqual(rate * 6, count, delta=0.05 * rate * 6 + 1e-9)
+
+    def test_spline(self):
+        profile = ArrivalProfile([0, 6, 12, 18], [0.2, 1.0, 2.0, 0.5], 24, 10.0, interpolation="spline")
+        grid = np.linspace(0, 24, 1000, endpoint=False)
+        rates = np.array([profile.rate(t) for t in grid])
+        self.assertTrue(np.all(rates <= profile.majorant[[profile.piece(t) for t in grid]] + 1e-9))
+        self.assertAlmostEqual(10.0, rates.mean(), delta=0.01)
+        times = self._arrival_times(profile, 100)
+        self.assertAlmostEqual(10.0, len(times) / 2400, delta=0.2)
+        counts = np.histogram(times % 24, bins=24, range=(0, 24))[0] / 100
+        expected = [np.mean([profile.rate(hour + x) for x in np.linspace(0, 1, 20, endpoint=False)]) for hour in range(24)]
+        self.assertTrue(np.allclose(expected, counts, rtol=0.15, atol=0.5))
+
+    def test_buckets(self):
+        # two halves of the period with rates 1 and 3 at a fast node
+        experiment = {
+            "simulation_study": "diurnal",
+            "arrival_distr": {"type": "nonstationary", "params": [2.0], "profile": {"times": [0, 1000], "rates": [1, 3], "period": 2000}},
+            "nodes": [{"name": "A", "server_distr": {"type": "exp", "params": [10.0]}, "queue_discipline": {"type": "ps", "params": []},
+                       "server_capacity": 1, "queue_capacity": None}],
+            "routing": {"entry": [{"node": "A", "class": 0}], "matrix": []}
+        }
+        simulation = SimulationFactory().create(HandleFirstArrival(), experiment, 2.0, seed=1234)
+        generator = ArrivalsGeneratorSubscriber(100000, horizon=2000)
+        simulation.scheduler.subscribe(ArrivalEvent, generator)
+        simulation.scheduler.subscribe(JobMovementEvent, TimeBucketEstimator(1000, 3))
+        simulation.run()
+        statistics = simulation.statistics
+        for bucket, rate in [(0, 1.0), (1, 3.0)]:
+            rho = rate / 10.0
+            self.assertAlmostEqual(rate, statistics[f"SYSTEM-throughput-val@{bucket}"], delta=0.1 * rate)
+            self.assertAlmostEqual(rho, statistics[f"A-utilization-avg@{bucket}"], delta=0.1 * rho)
+            self.assertAlmostEqual(rho / (1 - rho), statistics[f"A-population-avg@{bucket}"], delta=0.2 * rho / (1 - rho))
+            self.assertAlmostEqual(1 / (10.0 - rate), statistics[f"SYSTEM-response_time-avg@{bucket}"], delta=0.2 / (10.0 - rate))
+        # a single node: the system is the node
+        self.assertEqual(statistics["A-response_time-avg@1"], statistics["SYSTEM-response_time-avg@1"])
+        # no arrivals after the horizon, the last jobs leave right after it
+        self.assertAlmostEqual(4000, generator.observed_arrivals, delta=200)
+        self.assertLess(simulation.scheduler.clock, 2010)
+
+    def test_nonstationary_main(self):
+        # a day in 4 buckets: each replica covers the whole period whatever the batch size
+        experiment = {
+            "simulation_study": "diurnal",
+            "arrival_distr": {"type": "nonstationary", "params": [0.05],
+                              "profile": {"times": [0, 21600, 43200, 64800], "rates": [1, 2, 2, 1], "period": 86400, "buckets": 4}},
+            "nodes": [{"name": "A", "server_distr": {"type": "exp", "params": [1.0]}, "queue_discipline": {"type": "fifo", "params": []},
+                       "server_capacity": 1, "queue_capacity": None}],
+            "routing": {"entry": [{"node": "A", "class": 0}], "matrix": []},
+            "batch_means": {"batch_size": 64, "batch_num": 2}
+        }
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(main, "STATISTICS_DIR", directory):
+            store = ResultStore(os.path.join(directory, "results.sqlite"))
+            simulation = main.nonstationary_main(experiment, 0.05, 1234, store)
+            store.close()
+        statistics = simulation.statistics
+        for observation_time in statistics["SYSTEM-observation_time-val"]:
+            self.assertGreater(observation_time, 86000)
+        for bucket in range(4):
+            for name in ("SYSTEM-throughput-val", "SYSTEM-population-avg", "SYSTEM-response_time-avg"):
+                values = statistics[f"{name}@{bucket}"]
+                self.assertEqual(2, len(values))
+                self.assertFalse(np.any(np.isnan(values)), f"{name}@{bucket}")
+
+if __name__ == "__main__":
+    unittest.main()
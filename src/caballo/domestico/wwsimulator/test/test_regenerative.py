@@ -0,0 +1,49 @@
+import unittest
+
+from caballo.domestico.wwsimulator.regenerative import _run_worker, create_regenerative_simulation, run_parallel
+from caballo.domestico.wwsimulator.streams import independent_seeds
+
+
+def _mm1() -> dict:
+    return {
+        "simulation_study": "mm1",
+        "arrival_distr": {"type": "poisson"},
+        "nodes": [{"name": "A", "server_distr": {"type": "exp", "params": [2.0]}, "queue_discipline": {"type": "fifo", "params": []},
+                   "server_capacity": 1, "queue_capacity": None}],
+        "routing": {"entry": [{"node": "A", "class": 0}], "matrix": []}
+    }
+
+class TestRegenerative(unittest.TestCase):
+
+    def test_mm1(self):
+        # M/M/1 with lambda = 1, mu = 2: R = 1 / (mu - lambda) = 1, N = rho / (1 - rho) = 1, U = rho = 0.5
+        simulation = create_regenerative_simulation(_mm1(), 1.0, 5000, 1234)
+        simulation.run()
+        self.assertEqual(5000, len(simulation.statistics["SYSTEM-observation_time-val"]))
+        for statistic, expected in [("SYSTEM-response_time-avg", 1.0), ("SYSTEM-population-avg", 1.0),
+                                    ("A-utilization-avg", 0.5), ("SYSTEM-throughput-avg", 1.0)]:
+            ratio = simulation.intervals[statistic]
+            self.assertEqual(5000, ratio.n_samples, statistic)
+            self.assertAlmostEqual(expected, ratio.avg, delta=3 * ratio.half_width(), msg=statistic)
+            self.assertLess(ratio.half_width(), 0.1 * expected, statistic)
+        # a single node: the system is the node
+        self.assertAlmostEqual(simulation.intervals["A-response_time-avg"].avg, simulation.intervals["SYSTEM-response_time-avg"].avg)
+
+    def test_run_parallel(self):
+        simulation = run_parallel(_mm1(), 1.0, 301, 1234, 2)
+        again = run_parallel(_mm1(), 1.0, 301, 1234, 2)
+        self.assertEqual(simulation.statistics, again.statistics)
+
+        # the cycles of the workers, in order, each with its own seed
+        seeds = independent_seeds(1234, 2)
+        self.assertEqual(2, len(set(seeds)))
+        first, second = _run_worker(_mm1(), 1.0, 151, seeds[0]), _run_worker(_mm1(), 1.0, 150, seeds[1])
+        cycle_lengths = simulation.statistics["SYSTEM-observation_time-val"]
+        self.assertEqual(301, len(cycle_lengths))
+        self.assertEqual(first["SYSTEM-observation_time-val"] + second["SYSTEM-observation_time-val"], cycle_lengths)
+        self.assertEqual(301, simulation.intervals["SYSTEM-response_time-avg"].n_samples)
+        # distinct streams: no cycle of a worker is repeated by the other one
+        self.assertFalse(set(first["SYSTEM-observation_time-val"]) & set(second["SYSTEM-observation_time-val"]))
+
+if __name__ == "__main__":
+    unittest.main()
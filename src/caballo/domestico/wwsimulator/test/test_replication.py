@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from caballo.domestico.wwsimulator import main
+from caballo.domestico.wwsimulator.results import ResultStore
+
+
+def _experiment(num_replicas: int) -> dict:
+    return {
+        "simulation_study": "mm1",
+        "arrival_distr": {"type": "poisson", "params": [1.0]},
+        "nodes": [{"name": "A", "server_distr": {"type": "exp", "params": [2.0]}, "queue_discipline": {"type": "fifo", "params": []},
+                   "server_capacity": 1, "queue_capacity": None}],
+        "routing": {"entry": [{"node": "A", "class": 0}], "matrix": []},
+        "batch_means": {"batch_size": 100, "batch_num": num_replicas}
+    }
+
+class TestReplication(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.patch = mock.patch.object(main, "STATISTICS_DIR", self.directory.name)
+        self.patch.start()
+        self.store = ResultStore(os.path.join(self.directory.name, "results.sqlite"))
+
+    def tearDown(self):
+        self.store.close()
+        self.patch.stop()
+        self.directory.cleanup()
+
+    def test_antithetic(self):
+        # a pair of replicas per iteration
+        simulation = main.rep_main(_experiment(4), 1.0, 1234, self.store, antithetic=True)
+        self.assertEqual(2, len(simulation.statistics["SYSTEM-response_time-avg"]))
+        # no pair to run: rejected before running, as an odd number of replicas
+        for num_replicas in (1, 3):
+            with self.assertRaisesRegex(ValueError, "even number of replicas"):
+                main.rep_main(_experiment(num_replicas), 1.0, 1234, self.store, antithetic=True)
+        # without antithetic pairs a single replica is fine
+        simulation = main.rep_main(_experiment(1), 1.0, 1234, self.store)
+        self.assertEqual(1, len(simulation.statistics["SYSTEM-response_time-avg"]))
+
+if __name__ == "__main__":
+    unittest.main()
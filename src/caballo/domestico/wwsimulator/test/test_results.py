@@ -0,0 +1,58 @@
+import copy
+import json
+import os
+import tempfile
+import unittest
+
+from caballo.domestico.wwsimulator import SIMULATION_FACTORY_CONFIG_PATH
+from caballo.domestico.wwsimulator.results import ResultStore, run_key
+
+
+class TestResultStore(unittest.TestCase):
+    def setUp(self):
+        with open(SIMULATION_FACTORY_CONFIG_PATH, 'r') as file:
+            self.experiment = json.load(file)['exps'][0]
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = ResultStore(os.path.join(self.directory.name, "results.sqlite"))
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_run_key(self):
+        key = run_key(self.experiment, 1.2, 1234, "batch_means")
+        self.assertEqual(key, run_key(copy.deepcopy(self.experiment), 1.2, 1234, "batch_means"))
+        self.assertNotEqual(key, run_key(self.experiment, 1.2, 1234, "replication"))
+        self.assertNotEqual(key, run_key(self.experiment, 1.3, 1234, "batch_means"))
+
+        # sweeping more lambda values does not invalidate the run
+        sweep = copy.deepcopy(self.experiment)
+        sweep['arrival_distr']['params'].append(1.3)
+        self.assertEqual(key, run_key(sweep, 1.2, 1234, "batch_means"))
+
+        # changing a service rate does
+        edited = copy.deepcopy(self.experiment)
+        edited['nodes'][1]['server_distr']['params'][0] = 2.5
+        self.assertNotEqual(key, run_key(edited, 1.2, 1234, "batch_means"))
+
+    def test_save_load_query(self):
+        key = run_key(self.experiment, 1.2, 1234, "batch_means")
+        statistics = {"SYSTEM-response_time-avg": [1.0, 2.0], "B-population-avg": [3.0, 4.0]}
+        self.assertFalse(self.store.contains(key))
+        self.store.save(key, self.experiment, 1.2, 1234, "batch_means", statistics)
+        self.assertTrue(self.store.contains(key))
+        self.assertEqual(statistics, self.store.load(key))
+
+        runs = self.store.runs(study=self.experiment['simulation_study'])
+        self.assertEqual([(key, 1.2, 1234)], [(run[0], run[3], run[4]) for run in runs])
+        self.assertEqual(self.experiment['nodes'], runs[0][-1]['nodes'])
+
+        rows = self.store.query(study=self.experiment['simulation_study'], metric="response_time", node="SYSTEM")
+        self.assertEqual([1.0, 2.0], [row[-1] for row in rows])
+
+        # saving again the same run replaces it
+        self.store.save(key, self.experiment, 1.2, 1234, "batch_means", {"SYSTEM-response_time-avg": [5.0]})
+        self.assertEqual({"SYSTEM-response_time-avg": [5.0]}, self.store.load(key))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -56,6 +56,40 @@ class NotificationEventA(EventHandler):
     def _handle(self, context):
         print("Received notification for event A")
 
+class RecordingHandler(EventHandler):
+    def __init__(self, name, log, children=()):
+        super().__init__()
+        self.name = name
+        self.log = log
+        self.children = children
+    
+    def _handle(self, context):
+        self.log.append((self.name, context.event.time))
+        for child in self.children:
+            context.scheduler.schedule(Event(context.event.time, child))
+
+class TestImmediateEvents(unittest.TestCase):
+    def test_immediate_events_order(self):
+        log = []
+        scheduler = Simulation("test", None, 1).scheduler
+        # 'c' is already in the sorted list at time 1.0 when 'a' schedules its immediate children
+        scheduler.schedule(Event(1.0, RecordingHandler("a", log, [RecordingHandler("a1", log), RecordingHandler("a2", log)])))
+        scheduler.schedule(Event(1.0, RecordingHandler("c", log)))
+        scheduler.schedule(Event(2.0, RecordingHandler("d", log)))
+        while scheduler.has_next():
+            scheduler.next()
+        self.assertEqual([("a", 1.0), ("c", 1.0), ("a1", 1.0), ("a2", 1.0), ("d", 2.0)], log)
+    
+    def test_immediate_events_notify_subscribers(self):
+        log = []
+        scheduler = Simulation("test", None, 1).scheduler
+        scheduler.intercept(Event, RecordingHandler("interceptor", log))
+        scheduler.subscribe(Event, RecordingHandler("subscriber", log))
+        scheduler.schedule(Event(0.0, RecordingHandler("event", log)))
+        scheduler.next()
+        self.assertEqual(["interceptor", "event", "subscriber"], [name for name, _ in log])
+        self.assertFalse(scheduler.has_next())
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
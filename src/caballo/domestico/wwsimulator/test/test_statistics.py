@@ -1,7 +1,8 @@
 import os
 import unittest
+from math import sqrt
 
-from caballo.domestico.wwsimulator.statistics import WelfordEstimator
+from caballo.domestico.wwsimulator.statistics import HistogramQuantileEstimator, IntervalEstimator, MSEREstimator, RatioEstimator, WelfordEstimator, WelfordTimeAveragedEstimator
 from pdsteele import DES_DIR
 
 class TestStatistics(unittest.TestCase):
@@ -16,5 +17,128 @@ class TestStatistics(unittest.TestCase):
         self.assertAlmostEqual(estimator.min, 0.207, places=3)
         self.assertAlmostEqual(estimator.max, 11.219, places=3)
 
+    def test_welford_merge(self):
+        with open(os.path.join(DES_DIR, "uvs.dat"), "r") as data:
+            samples = [float(line) for line in data]
+        half = len(samples) // 2
+        first = WelfordEstimator()
+        for sample in samples[:half]:
+            first.update(sample)
+        second = WelfordEstimator()
+        second.update_many(samples[half:])
+        merged = WelfordEstimator.deserialize(first.serialize()).merge(second)
+
+        self.assertEqual(len(samples), merged.n_samples)
+        self.assertAlmostEqual(merged.avg, 3.042, places=3)
+        self.assertAlmostEqual(merged.std, 1.693, places=3)
+        self.assertAlmostEqual(merged.min, 0.207, places=3)
+        self.assertAlmostEqual(merged.max, 11.219, places=3)
+
+    def test_welford_time_averaged_merge(self):
+        # population of 1 job in [0, 2), 3 jobs in [2, 3), 0 jobs in [3, 5)
+        samples = [1, 3, 0]
+        times = [2.0, 3.0, 5.0]
+        sequential = WelfordTimeAveragedEstimator()
+        for sample, time in zip(samples, times):
+            sequential.update(sample, time)
+        first = WelfordTimeAveragedEstimator()
+        first.update_many(samples[:1], times[:1])
+        second = WelfordTimeAveragedEstimator(start_time=times[0])
+        second.update_many(samples[1:], times[1:])
+        first.merge(second)
+
+        for estimator in [sequential, first]:
+            self.assertAlmostEqual(5.0, estimator.n_samples)
+            self.assertAlmostEqual(1.0, estimator.avg)
+            self.assertAlmostEqual(sqrt((2 * 0 + 1 * 4 + 2 * 1) / 5.0), estimator.std)
+
+    def test_welford_time_averaged_merge_windows(self):
+        # consecutive windows [0, 3) and [3, 5), merged then updated as a single estimator
+        samples = [1, 3, 0, 2, 4]
+        times = [2.0, 3.0, 5.0, 6.0, 8.0]
+        sequential = WelfordTimeAveragedEstimator()
+        for sample, time in zip(samples, times):
+            sequential.update(sample, time)
+        merged = WelfordTimeAveragedEstimator()
+        merged.update_many(samples[:2], times[:2])
+        later = WelfordTimeAveragedEstimator(start_time=times[1])
+        later.update_many(samples[2:3], times[2:3])
+        merged.merge(later)
+        self.assertEqual(times[2], merged.last_time)
+        for sample, time in zip(samples[3:], times[3:]):
+            merged.update(sample, time)
+
+        self.assertAlmostEqual(sequential.n_samples, merged.n_samples)
+        self.assertAlmostEqual(sequential.avg, merged.avg)
+        self.assertAlmostEqual(sequential.std, merged.std)
+        self.assertEqual(sequential.last_time, merged.last_time)
+
+    def test_histogram_quantiles(self):
+        samples = [(i % 1000) / 10.0 + 0.1 for i in range(10000)]
+        estimator = HistogramQuantileEstimator(quantiles=(0.5, 0.99), relative_accuracy=0.01)
+        for sample in samples[:5000]:
+            estimator.update(sample)
+        other = HistogramQuantileEstimator(quantiles=(0.5, 0.99), relative_accuracy=0.01)
+        other.update_many(samples[5000:])
+        merged = HistogramQuantileEstimator.deserialize(estimator.serialize()).merge(other)
+
+        ordered = sorted(samples)
+        for q in [0.5, 0.99, 0.9]:
+            exact = ordered[int(q * (len(samples) - 1))]
+            self.assertAlmostEqual(1.0, merged.quantile(q) / exact, delta=0.01)
+        self.assertEqual(len(samples), merged.n_samples)
+        self.assertAlmostEqual(0.1, merged.quantile(0.0))
+        self.assertAlmostEqual(100.0, merged.quantile(1.0))
+
+    def test_interval(self):
+        estimator = IntervalEstimator(confidence=0.95)
+        for value in range(1, 11):
+            estimator.update(value)
+        self.assertAlmostEqual(5.5, estimator.avg)
+        # t(9, 0.975) * s / sqrt(n - 1) with s = sqrt(8.25)
+        self.assertAlmostEqual(2.262157 * sqrt(8.25) / 3.0, estimator.half_width(), places=4)
+
+    def test_ratio(self):
+        pairs = [(2.0 * x + (x % 3), float(x)) for x in range(1, 101)]
+        estimator = RatioEstimator()
+        for y, x in pairs:
+            estimator.update(y, x)
+        self.assertAlmostEqual(sum(y for y, _ in pairs) / sum(x for _, x in pairs), estimator.avg)
+
+        # the ratio is estimated with the residuals y - ratio * x
+        residuals = WelfordEstimator()
+        for y, x in pairs:
+            residuals.update(y - estimator.avg * x)
+        std = residuals.std * sqrt(len(pairs) / (len(pairs) - 1))
+        self.assertAlmostEqual(1.984217 * std / (50.5 * sqrt(len(pairs))), estimator.half_width(), places=5)
+
+        merged = RatioEstimator()
+        other = RatioEstimator()
+        for y, x in pairs[:30]:
+            merged.update(y, x)
+        for y, x in pairs[30:]:
+            other.update(y, x)
+        merged = RatioEstimator.deserialize(merged.serialize()).merge(other)
+        self.assertEqual(estimator.n_samples, merged.n_samples)
+        self.assertAlmostEqual(estimator.avg, merged.avg)
+        self.assertAlmostEqual(estimator.half_width(), merged.half_width())
+
+    def test_mser(self):
+        # an initial transient decaying from 10 to the steady state mean 1, then noise around 1
+        estimator = MSEREstimator(batch_size=5)
+        for i in range(1000):
+            sample = 1.0 + (9.0 * (1.0 - i / 100) if i < 100 else 0.0) + (0.1 if i % 2 == 0 else -0.1)
+            estimator.update(sample, float(i))
+        self.assertEqual(200, estimator.n_batches)
+        truncation = estimator.truncation()
+        self.assertTrue(15 <= truncation <= 20)
+        self.assertEqual(5.0 * truncation - 1, estimator.cutoff_time(truncation))
+
+        # a sequence still in its transient has no truncation point
+        estimator = MSEREstimator(batch_size=5)
+        for i in range(1000):
+            estimator.update(float(i), float(i))
+        self.assertIsNone(estimator.truncation())
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,57 @@
+import json
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from caballo.domestico.wwsimulator import SIMULATION_FACTORY_CONFIG_PATH, main
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+from caballo.domestico.wwsimulator.statistics import IntervalEstimator
+from caballo.domestico.wwsimulator.sweep import SweepPoint, find_max_lambda, saturation_lambda
+
+
+class TestSweep(unittest.TestCase):
+    def test_saturation(self):
+        with open(SIMULATION_FACTORY_CONFIG_PATH, 'r') as file:
+            experiment = json.load(file)['exps'][0]
+        # B is the bottleneck, with demand 1 / 1.25
+        self.assertAlmostEqual(1.25, saturation_lambda(SimulationFactory().create_network(experiment, 1.0)))
+
+    def test_find_max_lambda(self):
+        # M/M/1 with mu = 2: R = 1 / (2 - lambda) < 4 up to lambda = 1.75
+        evaluated = []
+        def evaluate(lambda_val):
+            evaluated.append(lambda_val)
+            return SweepPoint(lambda_val, 1.0 / (2.0 - lambda_val), 0.01)
+
+        result = find_max_lambda(evaluate, 4.0, 0.1, 2.0, tolerance=0.001)
+        self.assertAlmostEqual(1.75, result.estimate, delta=0.01)
+        self.assertLess(result.lower, 1.75)
+        self.assertLessEqual(len(evaluated), 12)
+        self.assertTrue(all(lambda_val < 2.0 for lambda_val in evaluated))
+
+        # not sustainable even at the lowest lambda
+        result = find_max_lambda(evaluate, 0.1, 0.1, 2.0)
+        self.assertIsNone(result.lower)
+        self.assertIsNone(result.estimate)
+
+    def test_slo_main(self):
+        with open(SIMULATION_FACTORY_CONFIG_PATH, 'r') as file:
+            experiment = json.load(file)['exps'][0]
+        # R = 1 / (1.25 - lambda), not finite in some batch from lambda = 1.16 (above the target)
+        def bm_main(experiment, lambda_val, seed, store):
+            if lambda_val >= 1.16:
+                return SimpleNamespace(intervals={"SYSTEM-response_time-avg": None})
+            interval = IntervalEstimator()
+            interval.update_many([1.0 / (1.25 - lambda_val)] * 10)
+            return SimpleNamespace(intervals={"SYSTEM-response_time-avg": interval})
+
+        with mock.patch.object(main, "bm_main", bm_main):
+            result = main.slo_main(experiment, 1234, None, 10.0, "SYSTEM-response_time-avg")
+            self.assertAlmostEqual(1.15, result.estimate, delta=0.02)
+            self.assertLessEqual(result.lower, 1.15)
+            self.assertTrue(any(point.avg == float("inf") for point in result.points))
+            with self.assertRaisesRegex(ValueError, "SYSTEM-response_time-p99 is not collected"):
+                main.slo_main(experiment, 1234, None, 10.0)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,164 @@
+import random
+import unittest
+from math import exp
+
+from caballo.domestico.wwsimulator.events import ArrivalEvent, EventHandler
+from caballo.domestico.wwsimulator.controlvariates import analytic_controls
+from caballo.domestico.wwsimulator.handlers import ArrivalsGeneratorSubscriber, HandleFirstArrival
+from caballo.domestico.wwsimulator.lockstep import create_lockstep_simulation
+from caballo.domestico.wwsimulator.main import subscribe_estimators
+from caballo.domestico.wwsimulator.model import Job
+from caballo.domestico.wwsimulator.simulation import Simulation, SimulationFactory
+from caballo.domestico.wwsimulator.timeouts import (ExponentialBackoff, TimerWheel, create_client_timeouts,
+                                                    create_retry_policy)
+
+
+def _experiment(timeouts: dict = None, discipline: str = "ps") -> dict:
+    # A (two visits) -> B, as the web app with a single class at B
+    experiment = {
+        "simulation_study": "timeouts",
+        "arrival_distr": {"type": "poisson"},
+        "nodes": [{"name": "A", "server_distr": {"type": "exp", "params": [1.0, 2.0]}, "queue_discipline": {"type": discipline, "params": []},
+                   "server_capacity": 1, "queue_capacity": None},
+                  {"name": "B", "server_distr": {"type": "exp", "params": [2.0]}, "queue_discipline": {"type": "fifo", "params": []},
+                   "server_capacity": 1, "queue_capacity": None}],
+        "routing": {"entry": [{"node": "A", "class": 0}],
+                    "matrix": [{"from": {"node": "A", "class": 0}, "to": [{"node": "B", "class": 0, "p": 1.0}]},
+                               {"from": {"node": "B", "class": 0}, "to": [{"node": "A", "class": 1, "p": 1.0}]}]}
+    }
+    if timeouts is not None:
+        experiment["timeouts"] = timeouts
+    return experiment
+
+class _ArrivalRecorder(EventHandler):
+
+    def __init__(self):
+        super().__init__()
+        self.arrivals = []
+
+    def _handle(self, context):
+        if context.event.external and not context.event.retry:
+            self.arrivals.append(context.event.time)
+
+class _TimeoutRecorder(EventHandler):
+
+    def __init__(self):
+        super().__init__()
+        self.fired = []
+
+    def _handle(self, context):
+        self.fired.append((context.event.time, context.event.job.job_id))
+
+class TestTimeouts(unittest.TestCase):
+
+    def _run(self, experiment: dict, lambda_val: float, num_arrivals: int = 10000):
+        simulation = SimulationFactory().create(HandleFirstArrival(), experiment, lambda_val, seed=1234)
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(num_arrivals))
+        subscribe_estimators(simulation)
+        simulation.run()
+        return simulation
+
+    def test_wheel(self):
+        # the timers not cancelled fire at their exact times, in order, also past a round of the wheel
+        scheduler = Simulation("wheel", None, 1234).scheduler
+        wheel = TimerWheel(0.5, 16)
+        recorder = _TimeoutRecorder()
+        wheel.on_timeout = recorder
+        generator = random.Random(1234)
+        timers = [wheel.add(scheduler, generator.uniform(0.0, 20.0), Job(0, job_id)) for job_id in range(500)]
+        cancelled = set(generator.sample(range(500), 300))
+        for job_id in cancelled:
+            wheel.cancel(scheduler, timers[job_id])
+        self.assertEqual(200, wheel.count)
+        # a single tick event, no timer in the event list
+        pending = list(scheduler._event_list) + list(scheduler._immediate_events)
+        self.assertEqual(1, sum(1 for event in pending if not event.is_cancelled))
+        while scheduler.has_next():
+            scheduler.next()
+        expected = sorted((timer.time, timer.key) for timer in timers if timer.key not in cancelled)
+        self.assertEqual(expected, recorder.fired)
+        self.assertEqual(0, wheel.count)
+
+    def test_retry_policies(self):
+        backoff = ExponentialBackoff(4, 0.5, 2.0, cap=1.5)
+        self.assertEqual([0.5, 1.0, 1.5, None], [backoff.delay(attempt) for attempt in range(1, 5)])
+        self.assertIsNone(create_retry_policy({}).delay(1))
+        self.assertEqual(0.0, create_retry_policy({"type": "immediate", "max_attempts": 2}).delay(1))
+        with self.assertRaises(ValueError):
+            create_retry_policy({"type": "unknown"})
+        timeouts = create_client_timeouts({"deadline": [4.0, None]}, 2)
+        self.assertEqual([4.0, None], timeouts.deadlines)
+        self.assertEqual(0.5, timeouts.wheel.resolution)
+
+    def test_no_deadline(self):
+        # classes without a deadline: the same run as without timeouts
+        statistics = self._run(_experiment({"deadline": [None, None]}), 0.5, 2000).statistics
+        self.assertEqual(self._run(_experiment(), 0.5, 2000).statistics["SYSTEM-response_time-avg"], statistics["SYSTEM-response_time-avg"])
+        self.assertEqual(0.0, statistics["SYSTEM-timeout-val"])
+        self.assertEqual(0.0, statistics["SYSTEM-wasted_work-val"])
+
+    def test_deadline(self):
+        # M/M/1 FIFO: an abandoned job is still served, so the queue is unchanged and P(T > D) = exp(-(mu - lambda) D)
+        experiment = _experiment({"deadline": 4.0}, "fifo")
+        experiment["nodes"] = experiment["nodes"][:1]
+        experiment["routing"]["matrix"] = []
+        statistics = self._run(experiment, 0.5, 20000).statistics
+        expected = exp(-(1.0 - 0.5) * 4.0)
+        self.assertAlmostEqual(expected, statistics["SYSTEM-timeout-val"], delta=0.1 * expected)
+        self.assertEqual(statistics["SYSTEM-timeout-val"], statistics["SYSTEM-abandoned-val"])
+        self.assertAlmostEqual(0.5 * (1.0 - expected), statistics["SYSTEM-goodput-val"], delta=0.05 * 0.5)
+        self.assertGreater(statistics["SYSTEM-wasted_work-val"], statistics["SYSTEM-timeout-val"])
+
+    def test_retries(self):
+        # immediate retries feed the load: more timeouts and wasted work than giving up
+        # (above lambda = 0.5 the retries saturate A and the timeouts never stop, a retry storm)
+        statistics = self._run(_experiment({"deadline": 10.0}), 0.3).statistics
+        retried = self._run(_experiment({"deadline": 10.0, "retry": {"type": "immediate", "max_attempts": 3}}), 0.3).statistics
+        self.assertGreater(retried["SYSTEM-timeout-val"], statistics["SYSTEM-timeout-val"])
+        self.assertGreater(retried["SYSTEM-wasted_work-val"], statistics["SYSTEM-wasted_work-val"])
+        self.assertLess(retried["SYSTEM-abandoned-val"], retried["SYSTEM-timeout-val"])
+        # every attempt leaves the system: timeouts = retries + requests given up
+        attempts = retried["SYSTEM-completions-val"]
+        self.assertGreater(attempts, 10000)
+        self.assertAlmostEqual(retried["SYSTEM-timeout-val"] * attempts,
+                               attempts - 10000 + retried["SYSTEM-abandoned-val"] * 10000, delta=1e-6)
+
+    def test_retries_scores(self):
+        # the retries are not arrivals of the Poisson workload, for the interarrival times and the score of lambda
+        simulation = SimulationFactory().create(HandleFirstArrival(), _experiment({"deadline": 10.0, "retry": {"type": "immediate", "max_attempts": 3}}),
+                                                0.3, seed=1234)
+        recorder = _ArrivalRecorder()
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(10000))
+        subscribe_estimators(simulation)
+        simulation.scheduler.subscribe(ArrivalEvent, recorder)
+        simulation.run()
+        statistics = simulation.statistics
+        self.assertGreater(statistics["SYSTEM-timeout-val"], statistics["SYSTEM-abandoned-val"])
+        arrivals = recorder.arrivals
+        self.assertEqual(10000, len(arrivals))
+        self.assertAlmostEqual((len(arrivals) - 1) / 0.3 - (arrivals[-1] - arrivals[0]), statistics["SYSTEM-score-lambda"], places=6)
+        self.assertAlmostEqual((arrivals[-1] - arrivals[0]) / (len(arrivals) - 1), statistics["SYSTEM-interarrival-avg"], places=6)
+
+    def test_closed(self):
+        # the users retry with backoff, and think once their request completes or is given up.
+        # The abandoned jobs do not hold their user: the users send at most a job every 8 time units
+        # whatever the response time, below the capacity of A (a job every 1.5) as long as they are 5 at most
+        experiment = _experiment({"deadline": 8.0, "retry": {"type": "backoff", "max_attempts": 3, "base": 1.0, "jitter": True}})
+        experiment["arrival_distr"] = {"type": "closed", "think_time": 4.0}
+        statistics = self._run(experiment, 4, 5000).statistics
+        self.assertGreater(statistics["SYSTEM-timeout-val"], 0.0)
+        self.assertGreater(statistics["SYSTEM-completions-val"], 5000)
+        # each request succeeds once or is given up
+        requests = 5000
+        self.assertAlmostEqual(statistics["SYSTEM-goodput-val"] * statistics["SYSTEM-observation_time-val"],
+                               requests * (1.0 - statistics["SYSTEM-abandoned-val"]), delta=0.01 * requests)
+
+    def test_array_engines(self):
+        # the abandonments are not modelled by the array engines nor by the analytic controls
+        experiment = _experiment({"deadline": 10.0})
+        with self.assertRaises(ValueError):
+            create_lockstep_simulation(experiment, 0.3, 2, 10, 1234)
+        self.assertEqual({}, analytic_controls(SimulationFactory().create_network(experiment, 0.3)))
+
+if __name__ == "__main__":
+    unittest.main()
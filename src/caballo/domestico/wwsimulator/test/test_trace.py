@@ -0,0 +1,111 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from caballo.domestico.wwsimulator import SIMULATION_FACTORY_CONFIG_PATH, main
+from caballo.domestico.wwsimulator.batchmeans import BatchMeansInterceptor, BatchMeansSimulation
+from caballo.domestico.wwsimulator.events import ArrivalEvent, DepartureEvent
+from caballo.domestico.wwsimulator.handlers import ArrivalsGeneratorSubscriber, HandleFirstArrival
+from caballo.domestico.wwsimulator.main import subscribe_estimators
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+from caballo.domestico.wwsimulator.trace import BATCH, TRACE_RECORD, TraceRecorder, read_trace, record_trace
+from caballo.domestico.wwsimulator.traceanalysis import TraceAnalysis
+
+
+class TestTrace(unittest.TestCase):
+    def setUp(self):
+        with open(SIMULATION_FACTORY_CONFIG_PATH, 'r') as file:
+            self.experiment = json.load(file)['exps'][0]
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "simulation.trace")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def _simulation(self, num_arrivals: int):
+        simulation = SimulationFactory().create(HandleFirstArrival(), self.experiment, 1.0, seed=1234)
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(num_arrivals))
+        subscribe_estimators(simulation)
+        return simulation
+
+    def _assert_same_statistics(self, statistics, expected):
+        for name, values in statistics.items():
+            if name.split("-")[-1].startswith("p"):
+                # exact quantiles, the estimators use histograms
+                continue
+            expected_values = expected[name] if isinstance(expected[name], list) else [expected[name]]
+            self.assertEqual(len(expected_values), len(values), name)
+            for value, expected_value in zip(values, expected_values):
+                self.assertAlmostEqual(expected_value, value, delta=1e-9 * max(1.0, abs(expected_value)), msg=name)
+
+    def test_replica(self):
+        simulation = self._simulation(300)
+        recorder = record_trace(simulation, self.path)
+        simulation.run()
+
+        trace = read_trace(self.path)
+        self.assertEqual(recorder.n_records, len(trace))
+        self.assertEqual(len(trace) * TRACE_RECORD.itemsize, os.path.getsize(self.path))
+        # an arrival and a departure per visit
+        self.assertEqual(int((trace["kind"] == 0).sum()), int((trace["kind"] == 1).sum()))
+        self.assertEqual(300, int(trace["external"].sum()) // 2)
+
+        analysis = TraceAnalysis(trace, [node.id for node in simulation.network.nodes])
+        statistics = analysis.statistics()
+        self._assert_same_statistics(statistics, simulation.statistics)
+        departures = trace[(trace["kind"] == 1) & (trace["node"] == 0)]
+        response_times = departures["time"] - analysis.arrival_times()[analysis.departing & (analysis.node == 0)]
+        self.assertAlmostEqual(float(np.quantile(response_times, 0.95)), statistics["A-response_time-p95"][0])
+
+    def test_batch_means(self):
+        simulation = self._simulation(32 * 8)
+        bm_simulation = BatchMeansSimulation(simulation)
+        record_trace(simulation, self.path)
+        simulation.scheduler.intercept(DepartureEvent, BatchMeansInterceptor(32, 8, bm_simulation))
+        bm_simulation.run()
+
+        trace = read_trace(self.path)
+        self.assertEqual(8, int((trace["kind"] == BATCH).sum()))
+        statistics = TraceAnalysis(trace, [node.id for node in simulation.network.nodes]).statistics()
+        self.assertEqual(8, len(statistics["SYSTEM-response_time-avg"]))
+        self._assert_same_statistics(statistics, bm_simulation.statistics)
+
+    def test_buffer(self):
+        simulation = self._simulation(50)
+        recorder = record_trace(simulation, self.path)
+        TraceRecorder.BUFFER_SIZE, buffer_size = 7, TraceRecorder.BUFFER_SIZE
+        try:
+            simulation.run()
+        finally:
+            TraceRecorder.BUFFER_SIZE = buffer_size
+        trace = read_trace(self.path)
+        self.assertEqual(recorder.n_records, len(trace))
+        self.assertTrue(np.all(np.diff(trace["time"]) >= 0))
+
+    def test_trace_main(self):
+        self.experiment['batch_means'] = {"batch_size": 32, "batch_num": 4}
+        with mock.patch.object(main, "STATISTICS_DIR", self.directory.name):
+            statistics = main.trace_main(self.experiment, 1.0, 1234).statistics
+            traces = os.path.join(self.directory.name, self.experiment['simulation_study'], "BatchMeansSimulation", "traces")
+            self.assertEqual(1, len(os.listdir(traces)))
+            # the same configuration reuses the trace
+            with mock.patch.object(main, "record_trace") as recorder:
+                self.assertEqual(statistics, main.trace_main(self.experiment, 1.0, 1234).statistics)
+                recorder.assert_not_called()
+            # another configuration records a new one
+            self.experiment['nodes'][1]['server_distr']['params'][0] = 2.5
+            edited = main.trace_main(self.experiment, 1.0, 1234).statistics
+            self.assertEqual(2, len(os.listdir(traces)))
+            self.assertFalse(any(name.endswith(".partial") for name in os.listdir(traces)))
+            self.assertNotEqual(statistics["B-response_time-avg"], edited["B-response_time-avg"])
+
+    def test_empty(self):
+        TraceRecorder(self.path)
+        self.assertEqual(0, len(read_trace(self.path)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import tempfile
+import unittest
+
+from caballo.domestico.wwsimulator.events import ArrivalEvent
+from caballo.domestico.wwsimulator.handlers import ArrivalsGeneratorSubscriber, HandleFirstArrival
+from caballo.domestico.wwsimulator.main import subscribe_estimators
+from caballo.domestico.wwsimulator.simulation import SimulationFactory
+from caballo.domestico.wwsimulator.workload import DEFAULT_TYPE, AccessLogReader, TraceArrivals
+
+
+class TestWorkload(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "access.log")
+        # a request every 2 seconds, alternating POST and GET, then a HEAD
+        with open(self.path, "w") as file:
+            file.write("# time,type,demand\n")
+            for i in range(10):
+                file.write(f"{1000 + 2 * i},{'GET' if i % 2 else 'POST'},0.5\n")
+            file.write("1030,HEAD,0.1\n")
+        self.chunk_size = AccessLogReader.CHUNK_SIZE
+        AccessLogReader.CHUNK_SIZE = 3
+
+    def tearDown(self):
+        AccessLogReader.CHUNK_SIZE = self.chunk_size
+        self.directory.cleanup()
+
+    def test_reader(self):
+        chunks = list(AccessLogReader(self.path, delimiter=",", demand_column=2).chunks())
+        # the comment is skipped, in the first chunk
+        self.assertEqual([2, 3, 3, 3], [len(times) for times, _, _ in chunks])
+        times, types, demands = chunks[0]
+        self.assertEqual([1000.0, 1002.0], times.tolist())
+        self.assertEqual(["POST", "GET"], types.tolist())
+        self.assertEqual([0.5, 0.5], demands.tolist())
+        times, _, demands = list(AccessLogReader(self.path, delimiter=",", time_unit=0.001).chunks())[0]
+        self.assertEqual([1.0, 1.002], times.tolist())
+        self.assertIsNone(demands)
+
+    def test_iso_times(self):
+        path = os.path.join(self.directory.name, "iso.log")
+        with open(path, "w") as file:
+            file.write("2024-05-01T10:00:00Z GET\n")
+            file.write("2024-05-01T10:00:01.500+00:00 POST\n")
+            file.write("2024-05-01T12:00:03+02:00 GET\n")
+        times, types, _ = list(AccessLogReader(path).chunks())[0]
+        self.assertEqual([0.0, 1.5, 3.0], (times - times[0]).tolist())
+        self.assertEqual(1714557600.0, times[0])
+
+    def test_replay(self):
+        arrivals = TraceArrivals(AccessLogReader(self.path, delimiter=","), {"GET": (1, 0), "POST": (0, 1)}, load_factor=2.0)
+        self.assertEqual((0, 1, None), arrivals.entry())
+        interarrivals = []
+        while True:
+            interarrival = arrivals.next_interarrival()
+            if interarrival is None:
+                break
+            interarrivals.append(interarrival)
+            self.assertEqual((1, 0) if len(interarrivals) % 2 else (0, 1), arrivals.entry()[:2])
+        # the HEAD request is not mapped
+        self.assertEqual([1.0] * 9, interarrivals)
+        self.assertEqual(10, arrivals.n_arrivals)
+
+        arrivals = TraceArrivals(AccessLogReader(self.path, delimiter=",", demand_column=2), {DEFAULT_TYPE: (0, 0)})
+        for _ in range(10):
+            self.assertIsNotNone(arrivals.next_interarrival())
+        self.assertEqual((0, 0, 0.1), arrivals.entry())
+
+    def test_unsorted(self):
+        with open(self.path, "a") as file:
+            file.write("1029,GET,0.5\n")
+        arrivals = TraceArrivals(AccessLogReader(self.path, delimiter=","), {DEFAULT_TYPE: (0, 0)})
+        with self.assertRaises(ValueError):
+            while arrivals.next_interarrival() is not None:
+                pass
+
+    def test_simulation(self):
+        # a single visit, at the entry node
+        experiment = {
+            "simulation_study": "replay",
+            "arrival_distr": {"type": "trace", "params": [1.0], "path": self.path, "delimiter": ",", "demand_column": 2,
+                              "classes": {"GET": {"node": "A", "class": 0}, "POST": {"node": "A", "class": 0}}},
+            "nodes": [{"name": "A", "server_distr": {"type": "exp", "params": [2.0]}, "queue_discipline": {"type": "ps", "params": []},
+                       "server_capacity": 1, "queue_capacity": None}],
+            "routing": {"entry": [{"node": "A", "class": 0}], "matrix": []}
+        }
+        simulation = SimulationFactory().create(HandleFirstArrival(), experiment, 2.0, seed=1234)
+        simulation.scheduler.subscribe(ArrivalEvent, ArrivalsGeneratorSubscriber(1000))
+        subscribe_estimators(simulation)
+        simulation.run()
+        # the log ends before the maximum number of arrivals
+        self.assertEqual(10, simulation.statistics["SYSTEM-completions-val"])
+        self.assertAlmostEqual(1.0, simulation.statistics["SYSTEM-interarrival-avg"])
+        self.assertAlmostEqual(0.5, simulation.statistics["A-service-avg"])
+        self.assertAlmostEqual(0.5, simulation.statistics["A-response_time-avg"])
+
+if __name__ == "__main__":
+    unittest.main()
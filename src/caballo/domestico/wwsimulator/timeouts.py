@@ -0,0 +1,342 @@
+from abc import ABC, abstractmethod
+
+from caballo.domestico.wwsimulator import streams
+from caballo.domestico.wwsimulator.events import ArrivalEvent, Event, EventContext, EventHandler, TimeoutEvent
+from caballo.domestico.wwsimulator.handlers import HandleArrival
+from caballo.domestico.wwsimulator.model import Job
+from caballo.domestico.wwsimulator.streams import RETRY
+
+
+class Timer():
+    def __init__(self, key: int, time: float, tick: int, job: Job):
+        self.key = key
+        self.time = time
+        self.tick = tick
+        """
+        Index of the slot time of the timer, i.e. time // resolution.
+        """
+        self.job = job
+        self.event = None
+        """
+        Timeout event of the timer, once its slot is reached.
+        """
+
+class TimerWheel():
+    """
+    Hashed timing wheel of the timeouts of the jobs: the timers are kept in n_slots slots of width resolution,
+    a timer expiring at time t in the slot t // resolution modulo n_slots, so that a timer is added and cancelled
+    in O(1) without touching the event list. A single tick event is scheduled, at the time of the first slot holding
+    a timer; when a slot is reached its timers are scheduled as timeout events at their exact times. Most timers
+    are cancelled (the job leaves the system in time) before their slot is reached and never enter the event list.
+    A slot also holds the timers of the later rounds of the wheel, skipped until their round: n_slots * resolution
+    should cover the longest deadline.
+    > Varghese, Lauck - Hashed and Hierarchical Timing Wheels, ACM SIGOPS Operating Systems Review 21(5) (1987)
+    """
+
+    def __init__(self, resolution: float, n_slots: int = 256):
+        if resolution <= 0 or n_slots < 1:
+            raise ValueError("A timer wheel has a positive resolution and at least one slot")
+        self.resolution = resolution
+        self.n_slots = n_slots
+        self.slots = [{} for _ in range(n_slots)]
+        """
+        Timers of each slot by key.
+        """
+        self.count = 0
+        """
+        Number of timers in the slots.
+        """
+        self._cursor = 0
+        """
+        Tick of the next slot to reach, the timers of the earlier ones are already scheduled.
+        """
+        self._tick_event = None
+        self._tick = None
+        """
+        Tick of the tick event.
+        """
+        self._next_key = 0
+        self.on_timeout = None
+        """
+        Handler of the timeout events.
+        """
+
+    def add(self, scheduler, time: float, job: Job) -> Timer:
+        """
+        Adds a timer of the job expiring at the given time.
+        """
+        tick = int(time // self.resolution)
+        timer = Timer(self._next_key, time, tick, job)
+        self._next_key += 1
+        if self.count == 0:
+            # the wheel was idle: its cursor catches up with the clock
+            self._cursor = max(self._cursor, int(scheduler.clock // self.resolution))
+        if tick < self._cursor:
+            # the slot was reached already
+            self._expire(scheduler, timer)
+            return timer
+        self.slots[tick % self.n_slots][timer.key] = timer
+        self.count += 1
+        if self._tick is None or tick < self._tick:
+            self._schedule_tick(scheduler, tick)
+        return timer
+
+    def cancel(self, scheduler, timer: Timer):
+        """
+        Cancels a timer, e.g. of a job that left the system before its deadline.
+        """
+        if timer.event is not None:
+            scheduler.cancel(timer.event)
+            timer.event = None
+            return
+        slot = self.slots[timer.tick % self.n_slots]
+        if slot.pop(timer.key, None) is None:
+            return
+        self.count -= 1
+        if self.count == 0 and self._tick_event is not None:
+            # no tick past the last timer
+            scheduler.cancel(self._tick_event)
+            self._tick_event = None
+            self._tick = None
+
+    def _expire(self, scheduler, timer: Timer):
+        timer.event = TimeoutEvent(max(timer.time, scheduler.clock), self.on_timeout, timer.job)
+        scheduler.schedule(timer.event)
+
+    def _schedule_tick(self, scheduler, tick: int):
+        if self._tick_event is not None:
+            scheduler.cancel(self._tick_event)
+        self._tick = tick
+        self._tick_event = Event(max(tick * self.resolution, scheduler.clock), HandleTick(self))
+        scheduler.schedule(self._tick_event)
+
+    def tick(self, scheduler):
+        """
+        Reaches the slot of the tick event: its timers of the current round are scheduled at their times
+        and the next tick event at the first slot holding a timer.
+        """
+        tick = self._tick
+        self._tick_event = None
+        self._tick = None
+        slot = self.slots[tick % self.n_slots]
+        for timer in [timer for timer in slot.values() if timer.tick == tick]:
+            del slot[timer.key]
+            self.count -= 1
+            self._expire(scheduler, timer)
+        self._cursor = tick + 1
+        if self.count == 0:
+            return
+        for next_tick in range(self._cursor, self._cursor + self.n_slots):
+            if any(timer.tick == next_tick for timer in self.slots[next_tick % self.n_slots].values()):
+                self._schedule_tick(scheduler, next_tick)
+                return
+        # only timers of the later rounds
+        self._schedule_tick(scheduler, min(timer.tick for slot in self.slots for timer in slot.values()))
+
+class HandleTick(EventHandler):
+    def __init__(self, wheel: TimerWheel):
+        super().__init__()
+        self.wheel = wheel
+
+    def _handle(self, context: EventContext):
+        self.wheel.tick(context.scheduler)
+
+class RetryPolicy(ABC):
+    """
+    Delay before the client sends again a request whose attempt timed out, up to max_attempts attempts in all.
+    """
+
+    def __init__(self, max_attempts: int):
+        if max_attempts < 1:
+            raise ValueError("A request has at least one attempt")
+        self.max_attempts = max_attempts
+
+    def delay(self, attempt: int) -> float:
+        """
+        Delay before the attempt after the given one (1 for the first), None if the client gives up.
+        """
+        if attempt >= self.max_attempts:
+            return None
+        return self._delay(attempt)
+
+    @abstractmethod
+    def _delay(self, attempt: int) -> float:
+        pass
+
+class ImmediateRetry(RetryPolicy):
+
+    def _delay(self, attempt):
+        return 0.0
+
+class ExponentialBackoff(RetryPolicy):
+    """
+    Waits base * factor^(attempt - 1), at most cap. With jitter the delay is drawn uniformly
+    between 0 and it (full jitter), so that the retries of the requests timed out together spread out.
+    """
+
+    def __init__(self, max_attempts: int, base: float, factor: float = 2.0, cap: float = float("inf"), jitter: bool = False):
+        super().__init__(max_attempts)
+        if base <= 0 or factor < 1:
+            raise ValueError("The backoff has a positive base and a factor of at least 1")
+        self.base = base
+        self.factor = factor
+        self.cap = cap
+        self.jitter = jitter
+
+    def _delay(self, attempt):
+        delay = min(self.cap, self.base * self.factor ** (attempt - 1))
+        if self.jitter:
+            delay *= streams.random(RETRY)
+        return delay
+
+RETRY_POLICIES = {
+    "none": lambda config: ImmediateRetry(1),
+    "immediate": lambda config: ImmediateRetry(config.get("max_attempts", 3)),
+    "backoff": lambda config: ExponentialBackoff(config.get("max_attempts", 3), config["base"], config.get("factor", 2.0),
+                                                 config.get("cap", float("inf")), config.get("jitter", False)),
+}
+"""
+Factories of the retry policies by type, as in the retry of the timeouts of config.json, taking the configuration,
+e.g. {"type": "backoff", "max_attempts": 4, "base": 0.5, "factor": 2.0, "cap": 8.0, "jitter": true}.
+"""
+
+def register_retry_policy(policy: str, factory):
+    """
+    Registers the factory of a retry policy, a function of the configuration.
+    """
+    RETRY_POLICIES[policy] = factory
+
+def create_retry_policy(config: dict) -> RetryPolicy:
+    """
+    Creates the retry policy of a configuration, no retries by default.
+    """
+    policy = config.get("type", "none")
+    if policy not in RETRY_POLICIES:
+        raise ValueError(f"Retry policy {policy} not supported")
+    return RETRY_POLICIES[policy](config)
+
+class Attempt():
+    """
+    Attempt of a client request with a deadline.
+    """
+
+    def __init__(self, number: int, entry_node: int, entry_class: int):
+        self.number = number
+        """
+        Number of the attempt of the request, 1 for the first.
+        """
+        self.entry_node = entry_node
+        self.entry_class = entry_class
+        """
+        Node of the routing table and class the request enters the system with, for its retries.
+        """
+        self.timer = None
+        self.abandoned = False
+        """
+        True when the deadline expired: the client no longer waits for the job, that leaves the system
+        at its next departure (the server does not know and completes the service in progress).
+        """
+        self.work = 0.0
+        """
+        Service demand of the job at all the nodes it visited, wasted if abandoned.
+        """
+        self.departure = None
+        """
+        Departure of the job scheduled at its current node, None while routed to the next one.
+        """
+
+class ClientTimeouts():
+    """
+    Deadlines of the clients of the jobs by the class they enter the system with: a job still in the system
+    at its deadline is abandoned by its client, that sends the request again as a new job according to
+    the retry policy (or gives up, a user of a closed workload then thinks before its next request).
+    The deadline of each attempt is a timer of a timer wheel.
+    """
+
+    def __init__(self, deadlines: list, retry: RetryPolicy, wheel: TimerWheel):
+        self.deadlines = deadlines
+        """
+        Deadline of each class, None if the jobs entering with the class have no deadline.
+        """
+        self.retry = retry
+        self.wheel = wheel
+        self.wheel.on_timeout = HandleTimeout()
+        self._next_retry_id = -1
+        """
+        The retries have negative ids, never colliding with the ones of the jobs of the workload.
+        """
+
+    def start(self, job: Job, entry_node: int, scheduler, time: float):
+        """
+        The job entered the system at the given time: its deadline starts, if its class has one.
+        """
+        if job.attempt is None:
+            deadline = self.deadlines[job.class_id] if job.class_id < len(self.deadlines) else None
+            if deadline is None:
+                return
+            job.attempt = Attempt(1, entry_node, job.class_id)
+        else:
+            deadline = self.deadlines[job.attempt.entry_class]
+        job.attempt.timer = self.wheel.add(scheduler, time + deadline, job)
+
+    def completed(self, job: Job, scheduler):
+        """
+        The job left the system before its deadline, completed or dropped.
+        """
+        self.wheel.cancel(scheduler, job.attempt.timer)
+
+    def expire(self, context: EventContext):
+        """
+        The deadline of the job of the timeout event expired: the job is abandoned and the request is sent again
+        after the delay of the retry policy, or given up.
+        """
+        event = context.event
+        job = event.job
+        attempt = job.attempt
+        attempt.abandoned = True
+        attempt.timer.event = None
+        if attempt.departure is not None:
+            attempt.departure.external = True
+        delay = self.retry.delay(attempt.number)
+        network = context.network
+        if delay is None:
+            if job.user is not None:
+                network.population.think(job, context.scheduler, event.time)
+            return
+        event.retried = True
+        retry = Job(attempt.entry_class, self._next_retry_id)
+        self._next_retry_id -= 1
+        retry.user = job.user
+        retry.attempt = Attempt(attempt.number + 1, attempt.entry_node, attempt.entry_class)
+        arrival = ArrivalEvent(event.time + delay, HandleArrival(), retry, None, attempt.entry_node)
+        arrival.external = True
+        arrival.retry = True
+        context.scheduler.schedule(arrival)
+
+class HandleTimeout(EventHandler):
+    def __init__(self):
+        super().__init__()
+
+    def _handle(self, context: EventContext):
+        self.halt_if_wrong_event(context.event, TimeoutEvent)
+        context.network.timeouts.expire(context)
+
+def create_client_timeouts(config: dict, n_classes: int) -> ClientTimeouts:
+    """
+    Creates the client timeouts of an experiment, e.g.
+    {"deadline": [5.0, null, null], "retry": {"type": "backoff", "max_attempts": 4, "base": 0.5, "cap": 8.0, "jitter": true},
+     "resolution": 0.25, "slots": 256}
+    where deadline is the deadline of each class a job may enter the system with (null if none, a single value
+    for all the classes) and resolution is the width of the slots of the timer wheel, by default an eighth
+    of the shortest deadline.
+    """
+    deadlines = config['deadline']
+    if not isinstance(deadlines, list):
+        deadlines = [deadlines] * n_classes
+    deadlines = [float(deadline) if deadline is not None else None for deadline in deadlines]
+    if any(deadline is not None and deadline <= 0 for deadline in deadlines):
+        raise ValueError("Deadlines must be positive")
+    finite = [deadline for deadline in deadlines if deadline is not None]
+    resolution = config.get('resolution', min(finite) / 8 if finite else 1.0)
+    wheel = TimerWheel(resolution, config.get('slots', 256))
+    return ClientTimeouts(deadlines, create_retry_policy(config.get('retry', {})), wheel)
@@ -0,0 +1,95 @@
+import os
+
+import numpy as np
+
+from caballo.domestico.wwsimulator.events import DepartureEvent, EventHandler, JobMovementEvent
+
+ARRIVAL = 0
+DEPARTURE = 1
+BATCH = 2
+"""
+Kind of the marker records starting a new batch, written when the estimators are reset.
+"""
+LOSS = 3
+"""
+Kind of the records of the arrivals dropped by a full node.
+"""
+
+TRACE_RECORD = np.dtype([("time", "<f8"), ("job", "<i8"), ("node", "<i2"), ("job_class", "<i2"),
+                         ("kind", "u1"), ("external", "u1")])
+"""
+Fixed-width record of a trace, one per processed job movement: 22 bytes, little endian and unaligned.
+"""
+
+def _kind(event) -> int:
+    if type(event) is DepartureEvent:
+        return DEPARTURE
+    return LOSS if event.dropped else ARRIVAL
+
+class TraceRecorder(EventHandler):
+    """
+    Subscribes to job movements.
+    Appends a record of each processed job movement (time, kind, job id, class at the node, node index,
+    external flag) to a binary file of TRACE_RECORD, and a BATCH marker at each reset (i.e. at the
+    batch boundaries of BatchMeansInterceptor). The records are buffered and written BUFFER_SIZE at a time,
+    so the cost per event is a tuple append; the trace is read back memory-mapped by read_trace and
+    analysed offline by traceanalysis.
+    """
+
+    BUFFER_SIZE = 65536
+    """
+    Records kept in memory before they are written to the file.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        """
+        Path of the trace file, truncated when the recorder is created.
+        """
+        self.n_records = 0
+        """
+        Number of records written to the file.
+        """
+        self._buffer = []
+        open(path, "wb").close()
+
+    def _handle(self, context):
+        event = context.event
+        self.halt_if_wrong_event(event, JobMovementEvent)
+        self._buffer.append((event.time, event.job.job_id, event.node.index, event.job_class,
+                             _kind(event), event.external))
+        if len(self._buffer) == TraceRecorder.BUFFER_SIZE:
+            self._write()
+
+    def reset(self, context=None):
+        if context is not None:
+            self._buffer.append((context.event.time, -1, -1, -1, BATCH, False))
+
+    def flush(self, context=None):
+        self._write()
+
+    def _write(self):
+        if len(self._buffer) == 0:
+            return
+        with open(self.path, "ab") as file:
+            file.write(np.array(self._buffer, dtype=TRACE_RECORD).tobytes())
+        self.n_records += len(self._buffer)
+        self._buffer = []
+
+def record_trace(simulation, path: str) -> TraceRecorder:
+    """
+    Subscribes a trace recorder to the job movements of a simulation.
+    """
+    recorder = TraceRecorder(path)
+    simulation.scheduler.subscribe(JobMovementEvent, recorder)
+    return recorder
+
+def read_trace(path: str) -> np.ndarray:
+    """
+    Maps a trace file in memory (read only) as an array of TRACE_RECORD.
+    """
+    if os.path.getsize(path) == 0:
+        # an empty file cannot be mapped
+        return np.empty(0, dtype=TRACE_RECORD)
+    return np.memmap(path, dtype=TRACE_RECORD, mode="r")
@@ -0,0 +1,137 @@
+import numpy as np
+
+from caballo.domestico.wwsimulator.output import _GLOBAL, OutputStatistic, quantile_variant, save_statistic_value
+from caballo.domestico.wwsimulator.trace import BATCH, DEPARTURE, LOSS
+
+class TraceAnalysis():
+    """
+    Estimates the statistics of a simulation offline from its trace (see trace.TraceRecorder), all the
+    movements at once with NumPy, so new statistics can be computed without running the simulation again.
+    The trace is split in segments at its BATCH markers: without markers the whole trace is an iteration
+    (a replica), otherwise each batch is an iteration and the movements after the last marker are not.
+    As with the estimators, a batch starts at the departure completing the previous one, its time averages
+    run until the departure completing it and its response times are the ones of the departures in it.
+    """
+
+    def __init__(self, trace: np.ndarray, node_ids: list):
+        self.node_ids = node_ids
+        """
+        Id of each node by index, the trace records the node indexes only.
+        """
+        markers = np.flatnonzero(trace["kind"] == BATCH)
+        movements = np.delete(np.arange(len(trace)), markers)
+        self.time = np.asarray(trace["time"][movements], dtype=float)
+        self.job = np.asarray(trace["job"][movements])
+        self.node = np.asarray(trace["node"][movements], dtype=int)
+        self.job_class = np.asarray(trace["job_class"][movements], dtype=int)
+        self.departing = np.asarray(trace["kind"][movements]) == DEPARTURE
+        self.lost = np.asarray(trace["kind"][movements]) == LOSS
+        """
+        Arrivals dropped by a full node, the last movement of their job.
+        """
+        self.external = np.asarray(trace["external"][movements]).astype(bool)
+
+        # a marker is followed by the movement starting the batch
+        self.starts = np.concatenate(([0], markers - np.arange(len(markers))))
+        self.iterations = np.ones(len(self.starts), dtype=bool)
+        if len(markers) > 0:
+            self.iterations[-1] = False
+        self.ends = np.append(self.starts[1:], len(self.time))
+        self.segment = np.repeat(np.arange(len(self.starts)), self.ends - self.starts)
+        n_movements = len(self.time)
+        self.start_times = self.time[self.starts]
+        self.end_times = self.time[np.minimum(self.ends, n_movements - 1)]
+        # the movements after the last batch are not observed
+        self.observed_times = np.where(self.iterations, self.end_times - self.start_times, 1.0)
+        self._durations = np.zeros(n_movements)
+        self._durations[:-1] = np.diff(self.time)
+
+    def arrival_times(self) -> np.ndarray:
+        """
+        Arrival time at the node of the visit of each departure (undefined for the arrivals):
+        the movements of a job alternate arrivals and departures.
+        """
+        order = np.argsort(self.job, kind="stable")
+        arrival_times = np.full(len(self.time), np.nan)
+        arrival_times[order[1:]] = self.time[order[:-1]]
+        arrival_times[~self.departing] = np.nan
+        return arrival_times
+
+    def entry_times(self) -> np.ndarray:
+        """
+        Time each job entered the system, by movement.
+        """
+        order = np.argsort(self.job, kind="stable")
+        jobs = self.job[order]
+        first = np.concatenate(([True], jobs[1:] != jobs[:-1]))
+        entry_times = np.empty(len(self.time))
+        entry_times[order] = self.time[order][first][np.cumsum(first) - 1]
+        return entry_times
+
+    def populations(self) -> list:
+        """
+        Population of each node and of the system after each movement.
+        """
+        steps = np.where(self.departing, -1, np.where(self.lost, 0, 1))
+        populations = [np.cumsum(np.where(self.node == node_index, steps, 0)) for node_index in range(len(self.node_ids))]
+        # a job lost inside the system leaves it
+        system_steps = np.where(self.external, steps, np.where(self.lost, -1, 0))
+        populations.append(np.cumsum(system_steps))
+        return populations
+
+    def time_averages(self, values: np.ndarray) -> tuple:
+        """
+        Time average and standard deviation of a piecewise constant variable over each segment,
+        given its value after each movement.
+        """
+        values = values.astype(float)
+        avg = np.add.reduceat(values * self._durations, self.starts) / self.observed_times
+        squares = np.add.reduceat(values * values * self._durations, self.starts) / self.observed_times
+        return avg, np.sqrt(np.maximum(squares - avg * avg, 0.0))
+
+    def statistics(self, quantiles=(0.5, 0.95, 0.99)) -> dict:
+        """
+        Statistics of the iterations by name, with a value per iteration, with the keys of the estimators:
+        observation time, completions, busy times, utilizations, populations and response times of the
+        nodes and of the system. The response time quantiles are the exact sample ones.
+        """
+        statistics = {}
+        iterations = self.iterations
+        labels = list(self.node_ids) + [_GLOBAL]
+        save_statistic_value(OutputStatistic.OBSERVATION_TIME, _GLOBAL, (self.time[self.ends - 1] - self.start_times)[iterations].tolist(), "val", statistics)
+
+        for label, population in zip(labels, self.populations()):
+            avg, std = self.time_averages(population)
+            save_statistic_value(OutputStatistic.POPULATION, label, avg[iterations].tolist(), "avg", statistics)
+            save_statistic_value(OutputStatistic.POPULATION, label, std[iterations].tolist(), "std", statistics)
+            busy_times = np.add.reduceat((population > 0) * self._durations, self.starts)
+            save_statistic_value(OutputStatistic.BUSY_TIME, label, busy_times[iterations].tolist(), "val", statistics)
+            if label != _GLOBAL:
+                save_statistic_value(OutputStatistic.UTILIZATION, label, (busy_times / self.observed_times)[iterations].tolist(), "avg", statistics)
+
+        departures = np.flatnonzero(self.departing)
+        arrival_times = self.arrival_times()
+        entry_times = self.entry_times()
+        node_departures = [departures[self.node[departures] == node_index] for node_index in range(len(self.node_ids))]
+        node_departures.append(departures[self.external[departures]])
+        for label, movements in zip(labels, node_departures):
+            starts = arrival_times[movements] if label != _GLOBAL else entry_times[movements]
+            response_times = self.time[movements] - starts
+            segments = self.segment[movements]
+            completions = np.bincount(segments, minlength=len(self.starts))
+            save_statistic_value(OutputStatistic.COMPLETIONS, label, completions[iterations].tolist(), "val", statistics)
+            # response times of each segment, in segment order
+            groups = np.split(response_times[np.argsort(segments, kind="stable")], np.cumsum(completions)[:-1])
+            variants = {"avg": [], "std": [], "max": [], "min": []}
+            variants.update({quantile_variant(q): [] for q in quantiles})
+            for group in (group for group, iteration in zip(groups, iterations) if iteration):
+                empty = len(group) == 0
+                variants["avg"].append(np.nan if empty else float(group.mean()))
+                variants["std"].append(np.nan if empty else float(group.std()))
+                variants["max"].append(np.nan if empty else float(group.max()))
+                variants["min"].append(np.nan if empty else float(group.min()))
+                for q in quantiles:
+                    variants[quantile_variant(q)].append(np.nan if empty else float(np.quantile(group, q)))
+            for variant, values in variants.items():
+                save_statistic_value(OutputStatistic.RESPONSE_TIME, label, values, variant, statistics)
+        return statistics
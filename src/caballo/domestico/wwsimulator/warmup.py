@@ -0,0 +1,78 @@
+from caballo.domestico.wwsimulator.events import DepartureEvent, EventHandler
+from caballo.domestico.wwsimulator.output import _GLOBAL, OutputStatistic, save_statistic_sample_value, save_statistic_value
+from caballo.domestico.wwsimulator.statistics import MSEREstimator
+
+
+class WarmupDetector(EventHandler):
+    """
+    Subscribes to job completions.
+    Detects online the end of the warm-up period with MSER-5 on the sample stream
+    of the running mean of the response time saved by the ResponseTimeEstimator,
+    from which each response time is recovered.
+    When the steady state is detected, records the cutoff as <node>-warmup-time
+    (time of the last truncated sample) and <node>-warmup-completions (truncated samples),
+    then resets the estimators so that the initialization bias is discarded.
+    Must subscribe to DepartureEvent after the ResponseTimeEstimator.
+    """
+    def __init__(self, node_id: str = _GLOBAL, batch_size: int = 5, min_batches: int = 20, reset: bool = True):
+        super().__init__()
+        self.node_id = node_id
+        self.reset_estimators = reset
+        """
+        Whether to reset the estimators when the steady state is detected or only to record the cutoff.
+        """
+        self.min_batches = min_batches
+        """
+        Minimum number of batches before trying to detect the steady state.
+        """
+        self.estimator = MSEREstimator(batch_size)
+        self.detected = False
+        self.cutoff_time = None
+        """
+        Time of the last truncated sample.
+        """
+        self.cutoff_samples = None
+        """
+        Number of truncated samples.
+        """
+        self.detection_time = None
+        """
+        Time the steady state was detected, i.e. the estimators were reset.
+        """
+        self._key = OutputStatistic.RESPONSE_TIME.for_node_variant(node_id, "avg")
+        self._next_sample = 0
+        self._prev_avg = 0.0
+        self._next_check = min_batches
+
+    def _handle(self, context):
+        self.halt_if_wrong_event(context.event, DepartureEvent)
+        if self.detected:
+            return
+        
+        # the samples saved since the last event, by the ResponseTimeEstimator
+        stream = context.samples.get(self._key, [])
+        estimator = self.estimator
+        for avg, time in stream[self._next_sample:]:
+            n = estimator.n_samples + 1
+            estimator.update(n * avg - (n - 1) * self._prev_avg, time)
+            self._prev_avg = avg
+        self._next_sample = len(stream)
+        
+        # the truncation is checked as the number of batches grows by 10%
+        if estimator.n_batches < self._next_check:
+            return
+        self._next_check = max(estimator.n_batches + 1, int(estimator.n_batches * 1.1))
+        truncation = estimator.truncation()
+        if truncation is None:
+            return
+        
+        self.detected = True
+        self.cutoff_samples = truncation * estimator.batch_size
+        self.cutoff_time = estimator.cutoff_time(truncation)
+        self.detection_time = context.event.time
+        if self.reset_estimators:
+            context.scheduler.reset_subscribers(context)
+        save_statistic_value(OutputStatistic.WARMUP, self.node_id, self.cutoff_time if self.cutoff_time is not None else 0.0, "time", context.statistics)
+        save_statistic_value(OutputStatistic.WARMUP, self.node_id, self.cutoff_samples, "completions", context.statistics)
+        # also in the sample streams, to mark the cutoff on the transient plots
+        save_statistic_sample_value(OutputStatistic.WARMUP, self.node_id, self.cutoff_samples, self.cutoff_time, "cutoff", context.samples)
@@ -0,0 +1,172 @@
+import itertools
+import os
+from datetime import datetime
+
+import numpy as np
+
+from caballo.domestico.wwsimulator import RES_DIR
+
+DEFAULT_TYPE = "*"
+"""
+Request type of the entry of the requests whose type is not mapped.
+"""
+
+class AccessLogReader():
+    """
+    Streams the requests of a text access log, one per line with delimited fields (e.g. CSV), in chunks of
+    CHUNK_SIZE lines, so the log is never loaded in memory as a whole. Empty lines and lines starting with #
+    are skipped. The timestamps are numbers (e.g. epoch seconds, scaled by time_unit) or ISO 8601 dates,
+    in non decreasing order.
+    """
+
+    CHUNK_SIZE = 65536
+    """
+    Lines parsed at a time.
+    """
+
+    def __init__(self, path: str, time_column: int = 0, type_column: int = 1, demand_column: int = None,
+                 delimiter: str = None, time_unit: float = 1.0):
+        self.path = path
+        self.time_column = time_column
+        self.type_column = type_column
+        self.demand_column = demand_column
+        """
+        Column of the service demand of the request in seconds, None if the log has none.
+        """
+        self.delimiter = delimiter
+        """
+        Separator of the fields, None for whitespace.
+        """
+        self.time_unit = time_unit
+        """
+        Seconds per unit of the numeric timestamps, e.g. 0.001 for milliseconds.
+        """
+
+    def _parse_time(self, text: str) -> float:
+        try:
+            return float(text) * self.time_unit
+        except ValueError:
+            # fromisoformat of python 3.9 does not accept the Z suffix of UTC
+            if text.endswith("Z"):
+                text = text[:-1] + "+00:00"
+            return datetime.fromisoformat(text).timestamp()
+
+    def chunks(self):
+        """
+        Yields the requests of the log in chunks, as arrays of times in seconds, types and service demands
+        (None without the demand column).
+        """
+        with open(self.path, "r") as file:
+            while True:
+                lines = list(itertools.islice(file, AccessLogReader.CHUNK_SIZE))
+                if len(lines) == 0:
+                    return
+                rows = [line.strip().split(self.delimiter) for line in lines if line.strip() and not line.startswith("#")]
+                if len(rows) == 0:
+                    continue
+                times = np.array([self._parse_time(row[self.time_column].strip()) for row in rows])
+                types = np.array([row[self.type_column].strip() for row in rows])
+                demands = None
+                if self.demand_column is not None:
+                    demands = np.array([float(row[self.demand_column]) for row in rows])
+                yield times, types, demands
+
+class TraceArrivals():
+    """
+    Source of the external arrivals of a network replaying a log: each request enters the system at the
+    (node index, class) of its type, at its time in the log divided by the load factor (so a factor of 2 replays
+    the log at twice its rate), the first one at time 0. With service demands in the log, a request takes its
+    demand as the service demand of its first visit, the other visits draw theirs as usual.
+    Requests of unmapped types are skipped, unless the entries have a DEFAULT_TYPE.
+    The log is read a chunk at a time, as the arrivals are generated.
+    """
+
+    def __init__(self, reader: AccessLogReader, entries: dict, load_factor: float = 1.0):
+        if load_factor <= 0:
+            raise ValueError("The load factor must be positive")
+        self.reader = reader
+        self.entries = entries
+        """
+        (node index, class) of each request type.
+        """
+        self.load_factor = load_factor
+        self.n_arrivals = 0
+        """
+        Number of requests replayed so far.
+        """
+        self._chunks = reader.chunks()
+        self._index = 0
+        self._times = np.empty(0)
+        self._nodes = self._classes = self._demands = None
+        self._started = False
+        self._last_time = None
+
+    def _next_chunk(self) -> bool:
+        for times, types, demands in self._chunks:
+            known = np.array([request_type in self.entries or DEFAULT_TYPE in self.entries for request_type in types], dtype=bool)
+            if not known.any():
+                continue
+            entries = [self.entries.get(request_type, self.entries.get(DEFAULT_TYPE)) for request_type in types[known]]
+            self._times = times[known]
+            self._nodes = [node_index for node_index, _ in entries]
+            self._classes = [class_id for _, class_id in entries]
+            self._demands = demands[known].tolist() if demands is not None else None
+            self._index = 0
+            return True
+        return False
+
+    def _advance(self) -> bool:
+        self._index += 1
+        if self._index >= len(self._times) and not self._next_chunk():
+            return False
+        time = float(self._times[self._index])
+        if self._last_time is not None and time < self._last_time:
+            raise ValueError(f"The requests of {self.reader.path} are not sorted by time")
+        self._last_time = time
+        self.n_arrivals += 1
+        return True
+
+    def _current(self):
+        if not self._started:
+            # the first request arrives at time 0
+            self._started = True
+            self._index = -1
+            if not self._advance():
+                raise ValueError(f"No request of {self.reader.path} has a mapped type")
+
+    def next_interarrival(self):
+        """
+        Moves to the next request and returns the time since the previous one, None at the end of the log.
+        """
+        self._current()
+        previous = self._last_time
+        if not self._advance():
+            return None
+        return (self._last_time - previous) / self.load_factor
+
+    def entry(self):
+        """
+        Returns the (node index, class, service demand or None) of the current request.
+        """
+        self._current()
+        demand = self._demands[self._index] if self._demands is not None else None
+        return self._nodes[self._index], self._classes[self._index], demand
+
+def create_trace_arrivals(arrival_distr: dict, node_indexes: dict, load_factor: float) -> TraceArrivals:
+    """
+    Creates the arrival source of an experiment with arrival_distr of type trace, e.g.
+    {"type": "trace", "params": [1.0, 2.0], "path": "access.log", "delimiter": ",", "time_column": 0,
+     "type_column": 1, "demand_column": 2, "time_unit": 0.001, "classes": {"GET /": {"node": "A", "class": 0}}}
+    where params are the load factors of the sweep and a relative path is in the resources directory.
+    """
+    path = arrival_distr['path']
+    if not os.path.isabs(path):
+        path = os.path.join(RES_DIR, path)
+    reader = AccessLogReader(path, arrival_distr.get('time_column', 0), arrival_distr.get('type_column', 1),
+                             arrival_distr.get('demand_column'), arrival_distr.get('delimiter'), arrival_distr.get('time_unit', 1.0))
+    entries = {}
+    for request_type, hop in arrival_distr['classes'].items():
+        if hop['node'] not in node_indexes:
+            raise ValueError(f"Unknown node {hop['node']} for request type {request_type}")
+        entries[request_type] = (node_indexes[hop['node']], hop['class'])
+    return TraceArrivals(reader, entries, load_factor)